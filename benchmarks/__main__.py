@@ -0,0 +1,246 @@
+"""Measures the hot paths of cirrus.
+
+    python -m benchmarks filters
+    python -m benchmarks listing [--rows 100000] [--page-size 1000]
+    python -m benchmarks pipeline
+    python -m benchmarks watcher
+
+filters times compile_filters and TopResults over generated items,
+listing the rows/s and memory of an S3 listing tree as QStandardItems
+and as columns, pipeline the TransferPipeline's first insert and peak
+memory, and watcher how LocalWatcher coalesces a burst of writes.
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from types import SimpleNamespace
+
+
+def filters_benchmark(args):
+    from cirrus import filters
+
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    extensions = ('.csv', '.txt')
+    items = [
+        SimpleNamespace(
+            root=f'/bucket/folder {i % 100}/Report_{i}{extensions[i % 2]}',
+            size=i * 10,
+            mtime=now - datetime.timedelta(hours=i % 48),
+            ctime=now,
+        )
+        for i in range(200_000)
+    ]
+    state = filters.FilterState(
+        name=(filters.CONTAINS, 'report_1'),
+        extension=(filters.EQUALS, '.CSV'),
+        mtime=(filters.WITHIN_LAST, now - datetime.timedelta(days=1)),
+        size=('>', 1_000),
+    )
+    predicate = filters.compile_filters(state)
+    start = time.perf_counter()
+    matched = sum(1 for item in items if predicate(item))
+    elapsed = time.perf_counter() - start
+    print(
+        f'{matched:,} of {len(items):,} items matched in {elapsed:.3f}s | '
+        f'{len(items) / elapsed:,.0f} items/s'
+    )
+    top = filters.TopResults(filters.LARGEST, 100)
+    start = time.perf_counter()
+    top.add(items)
+    elapsed = time.perf_counter() - start
+    print(
+        f'100 largest of {len(items):,} items in {elapsed:.3f}s | '
+        f'{len(items) / elapsed:,.0f} items/s'
+    )
+
+
+def listing_benchmark(args):
+    from cirrus import cache, utils
+    from cirrus.items import S3Item
+    from cirrus.models import BaseS3FilesTreeModel, S3FilesTreeModel
+
+    from PySide6.QtCore import QObject, Qt, Signal
+    from PySide6.QtGui import QStandardItemModel, QStandardItem
+    from PySide6.QtWidgets import QApplication, QTreeView
+
+    class Emitter(QObject):
+        # Stands in for the fetch thread, so every signal is queued
+        new_file_item = Signal(object, object)
+        new_rows = Signal(object, object, str, list)
+        loaded = Signal(object, object)
+
+    class BenchModel(S3FilesTreeModel):
+        def fetch_children(self, item, node=None, refresh=False):
+            pass
+
+    app = QApplication(sys.argv[:1])
+    client = {'Type': 'S3', 'Root': '/bench/', 'Access Key': '', 'Region': ''}
+    mtime = utils.date.now()
+    entries = [
+        cache.Entry(f'file-{i:08}', False, i, mtime, None)
+        for i in range(args.rows)
+    ]
+    pages = [
+        entries[start:start + args.page_size]
+        for start in range(0, len(entries), args.page_size)
+    ]
+
+    def standard_model():
+        model = QStandardItemModel()
+        model.setHorizontalHeaderLabels(['Name', 'Size', 'Last Modified'])
+        return model, model.invisibleRootItem()
+
+    def columnar_model():
+        model = BenchModel(client=client)
+        return model, model.root_node
+
+    def create_file_item(parent, entry):
+        # How a key was stored before the model kept columns
+        _client = client.copy()
+        _client['Root'] = f'/bench/{entry.key}'
+        display_items = [
+            QStandardItem(entry.key),
+            QStandardItem(f'{entry.size:,}'),
+            QStandardItem(utils.date.to_iso(entry.mtime)),
+        ]
+        display_items[0].setData(
+            S3Item(_client, size=entry.size, mtime=entry.mtime)
+        )
+        parent.insertRow(parent.rowCount(), display_items)
+
+    def per_row(emitter, parent):
+        for page in pages:
+            for entry in page:
+                emitter.new_file_item.emit(parent, entry)
+            app.processEvents()
+
+    def paged(emitter, parent):
+        for page in pages:
+            emitter.new_rows.emit(parent, None, '', page)
+            app.processEvents()
+        emitter.loaded.emit(parent, None)
+        app.processEvents()
+
+    runs = (
+        ('items', standard_model, per_row),
+        ('columns', columnar_model, paged),
+    )
+    for name, new_model, insert in runs:
+        tracemalloc.start()
+        model, parent = new_model()
+        emitter = Emitter()
+        emitter.new_file_item.connect(create_file_item, Qt.QueuedConnection)
+        if isinstance(model, BaseS3FilesTreeModel):
+            emitter.new_rows.connect(model.insert_rows, Qt.QueuedConnection)
+            emitter.loaded.connect(
+                model.remove_loading_row, Qt.QueuedConnection
+            )
+        view = QTreeView()
+        view.setModel(model)
+        view.show()
+        app.processEvents()
+        started = time.perf_counter()
+        insert(emitter, parent)
+        elapsed = time.perf_counter() - started
+        assert model.rowCount() == args.rows
+        # Python objects only; QStandardItems also hold C++ memory
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f'{name:<8} {args.rows:,} rows in {elapsed:.2f}s | '
+            f'{args.rows / elapsed:,.0f} rows/s | '
+            f'{used / args.rows:,.0f} bytes/row'
+        )
+        view.close()
+
+
+def pipeline_benchmark(args):
+    from cirrus import settings
+    from cirrus.core import store
+    from cirrus.core.pipeline import TransferPipeline, destination_paths
+
+    def rows(folder, count):
+        path = destination_paths(folder, '/tmp/destination')
+        for i in range(count):
+            source = f'{folder}/{i % 1_000:03}/{i}.txt'
+            yield (
+                source,
+                path(source),
+                i,
+                'local',
+                'local',
+            )
+
+    def producer(folder):
+        return lambda: rows(folder, 50_000)
+
+    # Traced for its peak memory, which is why it is kept small
+    with tempfile.TemporaryDirectory() as top:
+        settings.DATABASE = os.path.join(top, 'transfers.db')
+        store.setup()
+        pipeline = TransferPipeline()
+        first = []
+
+        def started(count):
+            if not first:
+                first.append(time.perf_counter())
+
+        pipeline.inserted.connect(started)
+        tracemalloc.start()
+        start = time.perf_counter()
+        count = pipeline.run([producer(f'/data/{i}') for i in range(4)])
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f'{count:,} rows in {elapsed:.3f}s | '
+            f'first insert after {first[0] - start:.3f}s | '
+            f'peak {peak / 1024 / 1024:.1f} MiB'
+        )
+
+
+def watcher_benchmark(args):
+    from cirrus.watcher import COALESCE_DELAY, local_watcher
+
+    if (watcher := local_watcher()) is None:
+        sys.exit('inotify is not available')
+    batches = []
+    watcher.changed.connect(batches.append)
+    with tempfile.TemporaryDirectory() as top:
+        watcher.watch(top)
+        start = time.perf_counter()
+        for i in range(1_000):
+            folder = os.path.join(top, f'folder {i % 10}')
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f'{i}.txt'), 'w') as f:
+                f.write(str(i))
+        written = time.perf_counter() - start
+        time.sleep(COALESCE_DELAY * 3)
+        changes = sum(len(batch) for batch in batches)
+        print(
+            f'1,000 files written in {written:.3f}s | '
+            f'{changes:,} changes in {len(batches)} batch(es)'
+        )
+        watcher.unwatch(top)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Measures the hot paths of cirrus',
+    )
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+    benchmarks.add_parser('filters').set_defaults(run=filters_benchmark)
+    listing = benchmarks.add_parser('listing')
+    listing.add_argument('--rows', type=int, default=100_000)
+    listing.add_argument('--page-size', type=int, default=1_000)
+    listing.set_defaults(run=listing_benchmark)
+    benchmarks.add_parser('pipeline').set_defaults(run=pipeline_benchmark)
+    benchmarks.add_parser('watcher').set_defaults(run=watcher_benchmark)
+    args = parser.parse_args()
+    args.run(args)
@@ -3,7 +3,6 @@ import logging
 from cirrus import database, settings
 
 from PySide6.QtGui import QColor, QPalette
-from PySide6.QtSql import QSqlDatabase
 from PySide6.QtWidgets import QApplication
 
 
@@ -20,15 +19,8 @@ logging.basicConfig(
 
 
 def create_connection():
-    database.setup()
     con_names = ['con', 'transfer_con', 'error_con', 'completed_con']
-    for con_name in con_names:
-        con = QSqlDatabase.addDatabase('QSQLITE', con_name)
-        con.setDatabaseName(settings.DATABASE)
-        if not con.open():
-            database.critical_msg('creating', con.lastError().databaseText())
-            return False
-    return True
+    return database.create_connections(con_names)
 
 
 if __name__ == '__main__':
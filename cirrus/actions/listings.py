@@ -336,7 +336,7 @@ class RecursiveAddItemsRunnable(BaseRunnable):
         batch_size = 1
         processed = 0
         for folder in self.folders:
-            for root, dirs, files in folder.walk():
+            for root, dirs, files in folder.walk(flat=True):
                 destination = os.path.abspath(
                     os.path.join(
                         self.destination.root,
@@ -1,16 +1,29 @@
+import logging
 import os
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 from .base import BaseAction, BaseRunnable
-from cirrus import dialogs, settings, utils
+from .transfers import DownloadResultsRunnable
+from cirrus import dialogs, filters, index, settings, utils
 from cirrus.actions.signals import ActionSignals
 from cirrus.windows.search import SearchResultsWindow
 
-from PySide6.QtCore import Slot
+from PySide6.QtCore import QThreadPool, Slot
 from PySide6.QtGui import QIcon
 
 
+# Locations searched at once
+SEARCH_WORKERS = 4
+# Results sent to the window at once, and the most seconds a smaller
+# batch waits before it is sent
+RESULTS_BATCH = 1_000
+RESULTS_WAIT = 0.25
+
+
 class SearchAllAction(BaseAction):
 
     def __init__(self, parent, folders=None):
@@ -79,73 +92,34 @@ class SearchRunnable(BaseRunnable):
         )
         self.search_results_window.aborted.connect(self.stop)
         self.search_results_window.closed.connect(self.closed)
+        self.search_results_window.download_requested.connect(self.download)
         self.search_results_window.show()
-        self.stopped = False
+        self.stopped = threading.Event()
+        self.state = None
+        self.use_index = False
+        self.top = None
+        self.results = None
+        self.search_folders = []
+        # Roots of the locations whose search raised
+        self.failed = []
+        self.downloads = []
 
     @Slot()
     def run(self):
         self.signals.started.emit()
-        filters = []
-        if name := self.dialog.filters.name.text():
-            name = os.path.splitext(name)[0]
-            filters.append(
-                partial(
-                    self.dialog.filters.name_option.itemData(
-                        self.dialog.filters.name_option.currentIndex()
-                    ),
-                    name
-                )
-            )
-        if file_type := self.dialog.filters.file_types.text():
-            file_type = '.' + file_type.lstrip('.')
-            filters.append(
-                partial(
-                    self.dialog.filters.file_types_option.itemData(
-                        self.dialog.filters.file_types_option.currentIndex()
-                    ),
-                    file_type
-                )
-            )
-        if ctime := self.dialog.filters.ctime.text():
-            if str(ctime) != '0':
-                value_text = self.dialog.filters.ctime_option_increment.currentText()  # noqa E501
-                compare_date = utils.date.subtract_period(value_text, ctime)
-                seconds = utils.date.period_to_seconds(value_text, ctime)
-                filters.append(
-                    partial(
-                        self.dialog.filters.ctime_option.itemData(
-                            self.dialog.filters.ctime_option.currentIndex()
-                        ),
-                        compare_date,
-                        seconds
-                    )
-                )
-        if mtime := self.dialog.filters.mtime.text():
-            if str(mtime) != '0':
-                value_text = self.dialog.filters.mtime_option_increment.currentText()  # noqa E501
-                compare_date = utils.date.subtract_period(value_text, mtime)
-                seconds = utils.date.period_to_seconds(value_text, mtime)
-                filters.append(
-                    partial(
-                        self.dialog.filters.mtime_option.itemData(
-                            self.dialog.filters.mtime_option.currentIndex()
-                        ),
-                        compare_date,
-                        seconds
-                    )
-                )
-        if (size := self.dialog.filters.size.text()) != '0':
-            value = self.dialog.filters.size_option_increment.currentText()
-            value = utils.files.human_to_bytes(f'{size}{value}')
-            filters.append(
-                partial(
-                    self.dialog.filters.size_option.itemData(
-                        self.dialog.filters.size_option.currentIndex()
-                    ),
-                    value
-                )
-            )
-        cb_func = self.search_results_window.view.model().add_results
+        self.state = self.dialog.filters.state()
+        self.use_index = self.dialog.use_index
+        predicate = filters.compile_filters(self.state)
+        model = self.search_results_window.view.model()
+        cb_func = model.add_results
+        if (top := self.dialog.top()) is not None:
+            # Only the results that would still be kept are queued
+            self.top = filters.TopResults(*top)
+            passes, admits = predicate, self.top.admits
+
+            def predicate(item):
+                return passes(item) and admits(item)
+
         if self.dialog.recursive:
             search_func = self.recursive_search
         else:
@@ -157,44 +131,117 @@ class SearchRunnable(BaseRunnable):
                 i.text() for i in self.dialog.location_selections
                 if i.isChecked()
             }
-        search_folders = (
+        search_folders = self.search_folders = [
             i for i in self.dialog.folders if i.root in location_selections
+        ]
+        # Every location is searched on its own thread and their results
+        # are merged into batches for the window
+        self.results = utils.threads.BatchQueue(
+            producers=len(search_folders), batch_size=RESULTS_BATCH
+        )
+        pool = ThreadPoolExecutor(
+            max_workers=max(1, min(SEARCH_WORKERS, len(search_folders))),
+            thread_name_prefix='search',
         )
-        results = []
-        for folder in search_folders:
-            if self.stopped:
-                self.signals.finished.emit('Stopped')
-                self.signals.aborted.emit()
-                return
-            for result in search_func(folder):
-                if self.stopped:
-                    self.signals.finished.emit('Stopped')
-                    self.signals.aborted.emit()
-                    return
-                if all(f(result) for f in filters):
-                    results.append(result)
-                    if len(results) % 100 == 0:
-                        self.signals.callback.emit(partial(cb_func, results))
-                        results = []
-        if results:
-            self.signals.callback.emit(partial(cb_func, results))
-        self.signals.finished.emit('Completed')
+        try:
+            for folder in search_folders:
+                pool.submit(
+                    self.search_folder, folder, search_func, predicate
+                )
+            shown = time.monotonic()
+            while not self.stopped.is_set():
+                batch = self.results.get_batch(timeout=RESULTS_WAIT)
+                if batch is None:
+                    break
+                if self.top is None:
+                    if batch:
+                        self.signals.callback.emit(partial(cb_func, batch))
+                    continue
+                # The top results so far replace those shown at most
+                # every RESULTS_WAIT seconds
+                self.top.add(batch)
+                if (
+                    self.top.changed
+                    and time.monotonic() - shown >= RESULTS_WAIT
+                ):
+                    self.signals.callback.emit(
+                        partial(model.set_results, self.top.results())
+                    )
+                    shown = time.monotonic()
+        finally:
+            self.results.close()
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self.top is not None and self.top.changed:
+            self.signals.callback.emit(
+                partial(model.set_results, self.top.results())
+            )
+        status = 'Stopped' if self.stopped.is_set() else 'Completed'
+        if failed := len(self.failed):
+            plural = 's' if failed > 1 else ''
+            status = f'{status} ({failed} location{plural} failed)'
+        if self.stopped.is_set():
+            self.signals.finished.emit(status)
+            self.signals.aborted.emit()
+            return
+        self.signals.finished.emit(status)
+
+    def search_folder(self, folder, search_func, predicate):
+        """Puts the results in `folder` that pass `predicate` in
+        self.results until they run out or the search is stopped"""
+        results = search_func(folder)
+        try:
+            for result in results:
+                if self.stopped.is_set():
+                    break
+                if predicate(result) and not self.results.put(result):
+                    break
+        except Exception as e:
+            self.failed.append(folder.root)
+            logging.warning(f'Search of {folder.root} failed: {e!r}')
+        finally:
+            results.close()
+            self.results.done()
 
     def recursive_search(self, item):
-        for _, __, files in item.walk():
-            yield from files
+        if self.use_index:
+            yield from index.search_index().candidates(item, self.state)
+        else:
+            yield from filters.candidates(item, self.state)
 
     def top_level_search(self, item):
-        for result in item.listdir():
-            if not result.is_dir:
-                yield result
+        if self.use_index:
+            yield from index.search_index().candidates(
+                item, self.state, recursive=False
+            )
+        else:
+            yield from filters.candidates(item, self.state, recursive=False)
+
+    @Slot(str)
+    def download(self, destination):
+        """Streams the checked results into the transfers queue, to be
+        downloaded to the local `destination` folder"""
+        view = self.search_results_window.view
+        if not view.model().finished:
+            return
+        runnable = DownloadResultsRunnable(
+            view.model(), view.hidden_rows, self.search_folders, destination
+        )
+        runnable.signals.select.connect(self.signals.select)
+        runnable.signals.process_queue.connect(self.signals.process_queue)
+        runnable.signals.update.connect(self.signals.update)
+        runnable.signals.finished.connect(self.signals.update)
+        self.downloads.append(runnable)
+        QThreadPool.globalInstance().start(runnable)
 
     def stop(self):
-        self.stopped = True
+        self.stopped.set()
+        if self.results is not None:
+            # Wakes the threads waiting on a full queue
+            self.results.close()
 
     @Slot()
     def closed(self):
         # Probably redundant but good practice to ensure GC
-        self.stopped = True
+        self.stop()
         self.parent = None
         self = None
@@ -1,15 +1,21 @@
+import logging
 import os
+import time
 
-from collections import defaultdict
 from functools import partial
 
 from .base import BaseAction, BaseRunnable
-from cirrus import database, dialogs, settings, utils
+from cirrus import dialogs, filters, settings
 from cirrus.actions.signals import ActionSignals
+from cirrus.core import pipeline
 
 from PySide6.QtCore import Slot
 
 
+# Most seconds between showing the transfers added by a pipeline
+SELECT_WAIT = 1.0
+
+
 class DropRowsAction(BaseAction):
 
     def __init__(self, parent, indexes):
@@ -94,81 +100,84 @@ class TransferFilterAction(BaseAction):
         return TransferFilterRunnable(self.parent, self.dialog, self.conflict)
 
 
-class TransferFilterRunnable(BaseRunnable):
+class PipelineRunnable(BaseRunnable):
+    """Base for the runnables that stream transfers into the database
+    with a cirrus.core.pipeline.TransferPipeline"""
 
-    def __init__(self, parent, dialog, conflict=None):
+    def __init__(self, conflict=None, process=False):
         super().__init__()
         self.setAutoDelete(False)
-        self.parent = parent
-        self.dialog = dialog
         self.signals = ActionSignals()
-        self.stopped = False
         self.conflict = conflict
+        self.process = process
+        self.stopped = False
+        self.pipeline = None
+        self.processed = 0
+        self.shown = 0
+
+    def run_pipeline(self, producers):
+        """Runs `producers` through a new pipeline. Returns the number of
+        transfers added"""
+        self.pipeline = pipeline.TransferPipeline(conflict=self.conflict)
+        self.pipeline.inserted.connect(self.inserted)
+        if self.stopped:
+            self.pipeline.stop()
+        self.shown = time.monotonic()
+        try:
+            return self.pipeline.run(producers)
+        finally:
+            self.queued()
+
+    def finish(self, count, noun):
+        """Emits finished with the `count` of `noun` added to the queue
+        and the number of errors that kept the rest out"""
+        errors = ''
+        if failed := len(self.pipeline.errors):
+            errors = f' with {failed:,} error{"s" if failed > 1 else ""}'
+        self.signals.finished.emit(f'{count:,} {noun} added to queue{errors}.')
+
+    def inserted(self, count):
+        self.processed += count
+        if time.monotonic() - self.shown >= SELECT_WAIT:
+            self.queued()
+
+    def queued(self):
+        """Shows the transfers added since the last call"""
+        if self.processed:
+            self.signals.select.emit()
+            if self.process:
+                self.signals.process_queue.emit()
+            self.signals.update.emit(f'Added {self.processed:,} to queue.')
+            self.processed = 0
+        self.shown = time.monotonic()
+
+    def stop(self):
+        self.stopped = True
+        if self.pipeline is not None:
+            self.pipeline.stop()
+
+    @Slot()
+    def closed(self):
+        # Probably redundant but good practice to ensure GC
+        self.stop()
+        self.parent = None
+        self = None
+
+
+class TransferFilterRunnable(PipelineRunnable):
+
+    def __init__(self, parent, dialog, conflict=None):
+        super().__init__(conflict)
+        self.parent = parent
+        self.dialog = dialog
+        self.state = None
 
     @Slot()
     def run(self):
         self.process = self.dialog.add_and_start_radio.isChecked()
         self.signals.started.emit()
-        filters = []
-        if name := self.dialog.filters.name.text():
-            name = os.path.splitext(name)[0]
-            filters.append(
-                partial(
-                    self.dialog.filters.name_option.itemData(
-                        self.dialog.filters.name_option.currentIndex()
-                    ),
-                    name
-                )
-            )
-        if file_type := self.dialog.filters.file_types.text():
-            file_type = '.' + file_type.lstrip('.')
-            filters.append(
-                partial(
-                    self.dialog.filters.file_types_option.itemData(
-                        self.dialog.filters.file_types_option.currentIndex()
-                    ),
-                    file_type
-                )
-            )
-        if ctime := self.dialog.filters.ctime.text():
-            if str(ctime) != '0':
-                value_text = self.dialog.filters.ctime_option_increment.currentText()  # noqa E501
-                compare_date = utils.date.subtract_period(value_text, ctime)
-                seconds = utils.date.period_to_seconds(value_text, ctime)
-                filters.append(
-                    partial(
-                        self.dialog.filters.ctime_option.itemData(
-                            self.dialog.filters.ctime_option.currentIndex()
-                        ),
-                        compare_date,
-                        seconds
-                    )
-                )
-        if mtime := self.dialog.filters.mtime.text():
-            if str(mtime) != '0':
-                value_text = self.dialog.filters.mtime_option_increment.currentText()  # noqa E501
-                compare_date = utils.date.subtract_period(value_text, mtime)
-                seconds = utils.date.period_to_seconds(value_text, mtime)
-                filters.append(
-                    partial(
-                        self.dialog.filters.mtime_option.itemData(
-                            self.dialog.filters.mtime_option.currentIndex()
-                        ),
-                        compare_date,
-                        seconds
-                    )
-                )
-        if (size := self.dialog.filters.size.text()) != '0':
-            value_text = self.dialog.filters.size_option_increment.currentText()  # noqa E501
-            value = utils.files.human_to_bytes(f'{size}{value_text}')
-            filters.append(
-                partial(
-                    self.dialog.filters.size_option.itemData(
-                        self.dialog.filters.size_option.currentIndex()
-                    ),
-                    value
-                )
-            )
+        self.state = self.dialog.filters.state()
+        predicate = filters.compile_filters(self.state)
         if self.dialog.recursive:
             search_func = self.recursive_search
         else:
@@ -181,9 +190,9 @@ class TransferFilterRunnable(BaseRunnable):
                 i.text() for i in self.dialog.location_selections
                 if i.isChecked()
             }
-        search_folders = (
+        search_folders = [
             i for i in self.dialog.folders if i.root in location_selections
-        )
+        ]
         # Destination Folders
         if len(self.dialog.destinations) == 1:
             dest_location_selections = {self.dialog.destinations[0].root}
@@ -196,122 +205,102 @@ class TransferFilterRunnable(BaseRunnable):
             i for i in self.dialog.destinations
             if i.root in dest_location_selections
         ]
-        output = defaultdict(list)
-        batch_size = 1
-        processed = 0
-        for folder in search_folders:
-            if self.stopped:
-                if output:
-                    for dest, queued_items in output.items():
-                        cb = partial(
-                            database.add_transfers,
-                            items=queued_items,
-                            destination=dest.root,
-                            s_type=folder.type,
-                            d_type=dest.type,
-                            conflict_resolution=self.conflict,
-                        )
-                        self.signals.callback.emit(cb)
-                    self.signals.select.emit()
-                    if self.process:
-                        self.signals.process_queue.emit()
-                self.signals.finished.emit('Stopped')
-                self.signals.aborted.emit()
-                return
-            for result in search_func(folder):
-                if self.stopped:
-                    if output:
-                        for dest, queued_items in output.items():
-                            cb = partial(
-                                database.add_transfers,
-                                items=queued_items,
-                                destination=dest.root,
-                                s_type=folder.type,
-                                d_type=dest.type,
-                                conflict_resolution=self.conflict,
-                            )
-                            self.signals.callback.emit(cb)
-                        self.signals.select.emit()
-                        if self.process:
-                            self.signals.process_queue.emit()
-                        if processed:
-                            self.signals.update.emit(
-                                f'Added {processed:,} to queue.'
-                            )
-                            processed = 0
-                    self.signals.finished.emit('Stopped')
-                    self.signals.aborted.emit()
-                    return
-                if all(f(result) for f in filters):
-                    for destination in destinations:
-                        if batch_size % 100 == 0:
-                            for dst_root_type, queued_items in output.items():
-                                cb = partial(
-                                    database.add_transfers,
-                                    items=queued_items,
-                                    destination=dst_root_type[0],
-                                    s_type=folder.type,
-                                    d_type=dst_root_type[1],
-                                    conflict_resolution=self.conflict,
-                                )
-                                self.signals.callback.emit(cb)
-                            self.signals.select.emit()
-                            if self.process:
-                                self.signals.process_queue.emit()
-                            if processed:
-                                self.signals.update.emit(
-                                    f'Added {processed:,} to queue.'
-                                )
-                                processed = 0
-                            output = defaultdict(list)
-                        dst_path = os.path.dirname(
-                            os.path.abspath(
-                                os.path.join(
-                                    destination.root,
-                                    os.path.basename(folder.root.rstrip('/')),
-                                    os.path.relpath(
-                                        result.root,
-                                        start=folder.root
-                                    )
-                                )
-                            )
-                        )
-                        output[(dst_path, destination.type)].append(result)
-                        batch_size += 1
-                        processed += 1
-        if output:
-            for dst_root_type, queued_items in output.items():
-                cb = partial(
-                    database.add_transfers,
-                    items=queued_items,
-                    destination=dst_root_type[0],
-                    s_type=folder.type,
-                    d_type=dst_root_type[1],
-                    conflict_resolution=self.conflict,
-                )
-                self.signals.callback.emit(cb)
-            self.signals.select.emit()
-            if self.process:
-                self.signals.process_queue.emit()
-            if processed:
-                self.signals.update.emit(f'Added {processed:,} to queue.')
-        self.signals.finished.emit(f'Testing - {self.parent.root} - FINISHED')
+        count = self.run_pipeline([
+            partial(
+                self.transfer_rows,
+                folder,
+                destinations,
+                search_func,
+                predicate,
+            )
+            for folder in search_folders
+        ])
+        if self.stopped:
+            self.signals.finished.emit('Stopped')
+            self.signals.aborted.emit()
+            return
+        self.finish(count, 'transfers')
+
+    def transfer_rows(self, folder, destinations, search_func, predicate):
+        """Yields a transfers row to every destination for the results in
+        `folder` that pass `predicate`"""
+        paths = [
+            (pipeline.destination_paths(folder.root, i.root), i.type)
+            for i in destinations
+        ]
+        for result in search_func(folder):
+            if predicate(result):
+                for path, d_type in paths:
+                    yield (
+                        result.root,
+                        path(result.root),
+                        result.size,
+                        folder.type,
+                        d_type,
+                    )
 
     def recursive_search(self, item):
-        for _, __, files in item.walk():
-            yield from files
+        yield from filters.candidates(item, self.state)
 
     def top_level_search(self, item):
-        for result in item.listdir():
-            if not result.is_dir:
-                yield result
+        yield from filters.candidates(item, self.state, recursive=False)
 
-    def stop(self):
-        self.stopped = True
+
+class DownloadResultsRunnable(PipelineRunnable):
+    """Downloads the checked rows of a finished SearchResultsModel that
+    are not hidden to the local `destination` folder.
+
+    The results of a finished search no longer change, so they are read
+    from this thread as they are.
+    """
+
+    def __init__(self, model, hidden_rows, folders, destination):
+        super().__init__(process=True)
+        self.model = model
+        # Snapshots, as the window can still change both
+        self.checked = bytes(model.checked)
+        self.hidden_rows = frozenset(hidden_rows)
+        # Longest first, so a result is matched to its innermost folder
+        self.folders = sorted(folders, key=lambda i: -len(i.root))
+        self.destination = destination
 
     @Slot()
-    def closed(self):
-        # Probably redundant but good practice to ensure GC
-        self.stopped = True
-        self.parent = None
-        self = None
+    def run(self):
+        self.signals.started.emit()
+        count = self.run_pipeline([self.transfer_rows])
+        if self.stopped:
+            self.signals.finished.emit('Stopped')
+            self.signals.aborted.emit()
+            return
+        self.finish(count, 'downloads')
+
+    def transfer_rows(self):
+        """Yields a transfers row for every result to download"""
+        model = self.model
+        # The searched folder of each folder in model.folders
+        matches = dict()
+        for row in model.checked_rows(self.checked):
+            if row in self.hidden_rows:
+                continue
+            parent = model.parents[row]
+            if (match := matches.get(parent)) is None:
+                match = matches[parent] = self.match(model.folders[parent])
+            if not match:
+                continue
+            source = model.path(row)
+            folder, path = match
+            yield (
+                source, path(source), model.sizes[row], folder.type, 'local'
+            )
+
+    def match(self, path):
+        """Returns the searched folder `path` is in and its
+        destination_paths, or False if there is none"""
+        for folder in self.folders:
+            top = folder.root.rstrip('/' + os.sep)
+            if path.startswith((top + '/', top + os.sep)):
+                return folder, pipeline.destination_paths(
+                    folder.root, self.destination
+                )
+        logging.warn(f'No searched folder found for {path}')
+        return False
@@ -0,0 +1,347 @@
+"""Persistent cache of S3-like prefix listings.
+
+Listings are keyed by (endpoint, bucket, prefix) and stored in
+settings.LISTING_CACHE, separate from the transfers database. A cached
+listing is only a starting point: callers show it immediately, list the
+prefix again in the background, and apply the ListingDiff returned by
+ListingCache.put.
+"""
+import collections
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+
+from cirrus import settings
+
+
+# Seconds a listing is served without revalidating it
+FRESH_FOR = 10
+# Listings not refreshed for this many seconds are purged on setup
+MAX_AGE = 7 * 24 * 60 * 60
+
+Entry = collections.namedtuple(
+    'Entry',
+    ['key', 'is_dir', 'size', 'mtime', 'etag']
+)
+Listing = collections.namedtuple('Listing', ['entries', 'fetched'])
+ListingDiff = collections.namedtuple(
+    'ListingDiff',
+    ['added', 'removed', 'changed']
+)
+# Totals over every file under a prefix. mtimes are epoch seconds and
+# `fetched` is when the oldest listing of the subtree was cached
+SubtreeStats = collections.namedtuple(
+    'SubtreeStats',
+    ['files', 'min_size', 'max_size', 'min_mtime', 'max_mtime', 'fetched']
+)
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def entry_from_content(content):
+    """Returns an Entry for a CommonPrefixes or Contents dict from
+    list_objects_v2"""
+    if (prefix := content.get('Prefix')) is not None:
+        return Entry(prefix, True, 0, 0, None)
+    return Entry(
+        content['Key'],
+        False,
+        content.get('Size', 0),
+        content.get('LastModified', 0),
+        content.get('ETag'),
+    )
+
+
+def diff(old, new):
+    """Returns the ListingDiff that turns `old` into `new`, both
+    iterables of Entry. Entries are matched by key and changed if any
+    other field differs
+    """
+    old = {entry.key: entry for entry in old}
+    added, changed = [], []
+    for entry in new:
+        if (previous := old.pop(entry.key, None)) is None:
+            added.append(entry)
+        elif previous != entry:
+            changed.append(entry)
+    return ListingDiff(
+        added=added,
+        removed=list(old.values()),
+        changed=changed,
+    )
+
+
+def listing_cache():
+    """Returns the shared ListingCache, creating it on first use"""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ListingCache()
+        return _CACHE
+
+
+class ListingCache:
+    """SQLite-backed store of Entry lists per (endpoint, bucket, prefix).
+
+    Every call opens its own connection, so a ListingCache can be used
+    from any thread.
+    """
+
+    def __init__(self, path=None, *, fresh_for=FRESH_FOR, max_age=MAX_AGE):
+        self.path = settings.LISTING_CACHE if path is None else path
+        self.fresh_for = fresh_for
+        self.max_age = max_age
+        self.setup()
+
+    def connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        con.execute('PRAGMA foreign_keys = ON')
+        return con
+
+    def setup(self):
+        con = self.connect()
+        try:
+            con.execute('PRAGMA journal_mode = WAL')
+            with con:
+                con.execute(
+                    '''CREATE TABLE IF NOT EXISTS listings (
+                        pk INTEGER PRIMARY KEY,
+                        endpoint TEXT NOT NULL,
+                        bucket TEXT NOT NULL,
+                        prefix TEXT NOT NULL,
+                        fetched REAL NOT NULL,
+                        UNIQUE (endpoint, bucket, prefix)
+                    )'''
+                )
+                con.execute(
+                    '''CREATE TABLE IF NOT EXISTS entries (
+                        listing INTEGER NOT NULL
+                            REFERENCES listings (pk) ON DELETE CASCADE,
+                        key TEXT NOT NULL,
+                        is_dir INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        mtime REAL,
+                        etag TEXT,
+                        PRIMARY KEY (listing, key)
+                    ) WITHOUT ROWID'''
+                )
+                con.execute(
+                    'DELETE FROM listings WHERE fetched < ?',
+                    (time.time() - self.max_age,)
+                )
+        except sqlite3.Error as e:
+            logging.warn(f'Listing cache setup failed: {e}')
+        finally:
+            con.close()
+
+    def get(self, endpoint, bucket, prefix):
+        """Returns the cached Listing for `prefix`, or None if it has not
+        been cached"""
+        prefix = prefix or ''
+        con = self.connect()
+        try:
+            row = con.execute(
+                '''SELECT pk, fetched FROM listings
+                   WHERE endpoint = ? AND bucket = ? AND prefix = ?''',
+                (endpoint, bucket, prefix)
+            ).fetchone()
+            if row is None:
+                return None
+            pk, fetched = row
+            rows = con.execute(
+                '''SELECT key, is_dir, size, mtime, etag FROM entries
+                   WHERE listing = ? ORDER BY key''',
+                (pk,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.warn(f'Listing cache read failed for {prefix}: {e}')
+            return None
+        finally:
+            con.close()
+        return Listing(
+            entries=[self.__to_entry(*row) for row in rows],
+            fetched=fetched,
+        )
+
+    def fetched(self, endpoint, bucket, prefix):
+        """Returns when `prefix` was cached as a timestamp, or None if it
+        has not been cached. Unlike get, no entries are read"""
+        con = self.connect()
+        try:
+            row = con.execute(
+                '''SELECT fetched FROM listings
+                   WHERE endpoint = ? AND bucket = ? AND prefix = ?''',
+                (endpoint, bucket, prefix or '')
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warn(f'Listing cache read failed for {prefix}: {e}')
+            return None
+        finally:
+            con.close()
+        return None if row is None else row[0]
+
+    def count(self, endpoint, bucket, prefix):
+        """Returns the number of entries cached for `prefix`, or None if
+        it has not been cached"""
+        con = self.connect()
+        try:
+            row = con.execute(
+                '''SELECT COUNT(e.key) FROM listings l
+                   LEFT JOIN entries e ON e.listing = l.pk
+                   WHERE l.endpoint = ? AND l.bucket = ? AND l.prefix = ?
+                   GROUP BY l.pk''',
+                (endpoint, bucket, prefix or '')
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warn(f'Listing cache read failed for {prefix}: {e}')
+            return None
+        finally:
+            con.close()
+        return None if row is None else row[0]
+
+    def subtree_stats(self, endpoint, bucket, prefix):
+        """Returns {prefix: SubtreeStats} for `prefix` and each prefix
+        under it whose whole subtree is cached, i.e., every folder in it
+        has a cached listing"""
+        prefix = prefix or ''
+        bounds = (endpoint, bucket, prefix, prefix + '\U0010ffff')
+        con = self.connect()
+        try:
+            listings = con.execute(
+                '''SELECT l.prefix, COUNT(e.key), MIN(e.size), MAX(e.size),
+                          MIN(e.mtime), MAX(e.mtime), l.fetched
+                   FROM listings l
+                   LEFT JOIN entries e ON e.listing = l.pk AND NOT e.is_dir
+                   WHERE l.endpoint = ? AND l.bucket = ?
+                       AND l.prefix >= ? AND l.prefix < ?
+                   GROUP BY l.pk''',
+                bounds
+            ).fetchall()
+            folders = con.execute(
+                '''SELECT l.prefix, e.key
+                   FROM listings l JOIN entries e ON e.listing = l.pk
+                   WHERE l.endpoint = ? AND l.bucket = ?
+                       AND l.prefix >= ? AND l.prefix < ? AND e.is_dir''',
+                bounds
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.warn(f'Listing cache read failed for {prefix}: {e}')
+            return dict()
+        finally:
+            con.close()
+        children = collections.defaultdict(list)
+        for parent, key in folders:
+            if key != parent:
+                children[parent].append(key)
+        own = {row[0]: SubtreeStats(*row[1:]) for row in listings}
+        stats = dict()
+        # Deepest first, so each folder's children are totalled already
+        for parent in sorted(own, key=len, reverse=True):
+            total = own[parent]
+            for child in children[parent]:
+                if child not in stats:
+                    break
+                total = self.__add_stats(total, stats[child])
+            else:
+                stats[parent] = total
+        return stats
+
+    @staticmethod
+    def __add_stats(first, second):
+        def bound(function, a, b):
+            return b if a is None else a if b is None else function(a, b)
+
+        return SubtreeStats(
+            files=first.files + second.files,
+            min_size=bound(min, first.min_size, second.min_size),
+            max_size=bound(max, first.max_size, second.max_size),
+            min_mtime=bound(min, first.min_mtime, second.min_mtime),
+            max_mtime=bound(max, first.max_mtime, second.max_mtime),
+            fetched=min(first.fetched, second.fetched),
+        )
+
+    def fresh(self, listing):
+        return time.time() - listing.fetched < self.fresh_for
+
+    def put(self, endpoint, bucket, prefix, entries):
+        """Replaces the cached listing for `prefix` with `entries` and
+        returns the ListingDiff from the previously cached listing. Only
+        the differences are written
+        """
+        prefix = prefix or ''
+        previous = self.get(endpoint, bucket, prefix)
+        changes = diff(previous.entries if previous else [], entries)
+        con = self.connect()
+        try:
+            with con:
+                con.execute(
+                    '''INSERT INTO listings (endpoint, bucket, prefix, fetched)
+                       VALUES (?, ?, ?, ?)
+                       ON CONFLICT (endpoint, bucket, prefix)
+                       DO UPDATE SET fetched = excluded.fetched''',
+                    (endpoint, bucket, prefix, time.time())
+                )
+                pk, = con.execute(
+                    '''SELECT pk FROM listings
+                       WHERE endpoint = ? AND bucket = ? AND prefix = ?''',
+                    (endpoint, bucket, prefix)
+                ).fetchone()
+                con.executemany(
+                    'DELETE FROM entries WHERE listing = ? AND key = ?',
+                    ((pk, entry.key) for entry in changes.removed)
+                )
+                con.executemany(
+                    '''INSERT OR REPLACE INTO entries
+                       (listing, key, is_dir, size, mtime, etag)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                    (
+                        (pk, *self.__to_row(entry))
+                        for entry in changes.added + changes.changed
+                    )
+                )
+        except sqlite3.Error as e:
+            logging.warn(f'Listing cache write failed for {prefix}: {e}')
+        finally:
+            con.close()
+        return changes
+
+    def invalidate(self, endpoint, bucket, prefix=None):
+        """Drops the cached listing for `prefix`, or for the whole bucket
+        if `prefix` is None"""
+        con = self.connect()
+        try:
+            with con:
+                if prefix is None:
+                    con.execute(
+                        '''DELETE FROM listings
+                           WHERE endpoint = ? AND bucket = ?''',
+                        (endpoint, bucket)
+                    )
+                else:
+                    con.execute(
+                        '''DELETE FROM listings
+                           WHERE endpoint = ? AND bucket = ? AND prefix = ?''',
+                        (endpoint, bucket, prefix)
+                    )
+        except sqlite3.Error as e:
+            logging.warn(f'Listing cache invalidate failed for {prefix}: {e}')
+        finally:
+            con.close()
+
+    @staticmethod
+    def __to_row(entry):
+        mtime = entry.mtime.timestamp() if entry.mtime else None
+        return entry.key, int(entry.is_dir), entry.size, mtime, entry.etag
+
+    @staticmethod
+    def __to_entry(key, is_dir, size, mtime, etag):
+        if mtime is not None:
+            mtime = datetime.datetime.fromtimestamp(
+                mtime, tz=datetime.timezone.utc
+            )
+        else:
+            mtime = 0
+        return Entry(key, bool(is_dir), size, mtime, etag)
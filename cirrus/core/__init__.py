@@ -0,0 +1,6 @@
+"""The transfer engine without any Qt dependencies.
+
+cirrus.database.DatabaseQueue and cirrus.executor.Executor are thin Qt
+adapters over cirrus.core.scheduler.TransferQueue and
+cirrus.core.executor.Executor, which the headless cirrus.run uses directly.
+"""
@@ -0,0 +1,39 @@
+import logging
+import threading
+
+
+class Event:
+    """A minimal, thread-safe stand-in for a Qt Signal so the core classes
+    can be observed without importing Qt.
+
+    Callbacks are called synchronously in the emitting thread. The Qt
+    adapters connect an Event to a Signal's emit to cross back into the
+    GUI thread.
+    """
+
+    def __init__(self):
+        self.__callbacks = []
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(callbacks={len(self.__callbacks)})'
+
+    def connect(self, callback):
+        with self.__lock:
+            self.__callbacks.append(callback)
+
+    def disconnect(self, callback=None):
+        with self.__lock:
+            if callback is None:
+                self.__callbacks.clear()
+            elif callback in self.__callbacks:
+                self.__callbacks.remove(callback)
+
+    def emit(self, *args):
+        with self.__lock:
+            callbacks = list(self.__callbacks)
+        for callback in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.warn(f'Failed to execute {callback!r}: {e!r}')
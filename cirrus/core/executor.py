@@ -0,0 +1,430 @@
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+
+from cirrus import items, retries, utils
+from cirrus.core import store
+from cirrus.core.events import Event
+from cirrus.exceptions import ConflictException
+from cirrus.progress import ProgressBus
+from cirrus.statuses import TransferStatus
+
+
+class Executor:
+    """Runs the transfers from a cirrus.core.scheduler.TransferQueue on
+    up to max_workers threads.
+
+    The started and completed Events mirror the Signals of the Qt
+    cirrus.executor.Executor adapter. Per-item progress is published
+    through cls.progress.
+    """
+
+    def __init__(
+        self,
+        db_queue,
+        max_workers=None,
+        retry_policy=None,
+        batch_small_objects=True,
+        small_object_size=utils.files.MB,
+        batch_size=64,
+    ):
+        self.started = Event()
+        self.completed = Event()
+        self.database_queue = db_queue
+        self.database_queue.add_worker.connect(
+            self.increase_max_worker_count
+        )
+        self.database_queue.remove_worker.connect(
+            self.decrease_max_worker_count
+        )
+        self.thread_lock = threading.Lock()
+        self.threads = []
+        self.current_workers = 0
+        self.max_workers = max_workers
+        if retry_policy is None:
+            retry_policy = retries.RetryPolicy()
+        self.retry_policy = retry_policy
+        # Transfers of at most small_object_size bytes that share a source
+        # and destination account are transferred as one unit of work
+        self.batch_small_objects = batch_small_objects
+        self.small_object_size = small_object_size
+        self.batch_size = batch_size
+        # Per-item events are published through the progress bus and are
+        # consumed by the GUI or the headless runner on their own schedule
+        self.progress = ProgressBus()
+        # Not great. May want to come from windows (?)
+        # Shutdown needs to be handled better
+        self.transfer_queue = None
+        self.__stop = False
+
+    def fill_thread_pool(self):
+        while self.current_workers < self.max_workers:
+            thread_uuid = str(uuid.uuid1())
+            t = threading.Thread(
+                target=self.run, name=thread_uuid, daemon=True
+            )
+            self.threads.append(t)
+            t.start()
+            self.increase_worker_count()
+            logging.info(f'Initiated thread {self.current_workers}')
+
+    def start(self):
+        self.__stop = False
+        self.started.emit()
+        self.database_queue.build_queue()
+        if self.current_workers < self.max_workers:
+            self.fill_thread_pool()
+        for thread in self.threads:
+            if not thread.is_alive() and not thread.ident:
+                thread.start()
+                logging.info(f'Started thread: {thread}')
+
+    def stop(self):
+        self.__stop = True
+        self.database_queue.stop()
+        for thread in self.threads:
+            if thread.is_alive():
+                logging.info(f'Stopping thread: {thread}')
+                thread.join(timeout=0.2)
+                if thread.is_alive():
+                    logging.info(f'Could not stop thread: {thread}')
+                else:
+                    logging.info(f'Stoped thread: {thread}')
+            self.decrease_worker_count()
+        self.threads.clear()
+        self.completed.emit()
+
+    def run(self):
+        if self.__stop:
+            return
+        for transfer_item in self.database_queue.next_item():
+            if self.__stop:
+                self.progress.stopped(transfer_item)
+                return
+            if self.is_small_object(transfer_item):
+                key = batch_key(transfer_item)
+                batch = [transfer_item]
+                batch.extend(
+                    self.database_queue.take_matching(
+                        lambda item: (
+                            self.is_small_object(item)
+                            and batch_key(item) == key
+                        ),
+                        self.batch_size - 1,
+                    )
+                )
+                self.process_batch(batch)
+                if self.__stop:
+                    return
+                continue
+            transfer_item.status = TransferStatus.TRANSFERRING
+            checkpoint = store.TransferCheckpoint.load(transfer_item)
+            # A checkpointed destination exists because it was partially
+            # written, so the conflict resolution must not skip it
+            if not checkpoint.started and skip_transfer(transfer_item):
+                transfer_item.status = TransferStatus.COMPLETED
+                transfer_item.message = 'Skipped'
+                self.progress.finished(transfer_item)
+            else:
+                self.progress.started(transfer_item)
+                self.process(transfer_item, checkpoint)
+                if self.__stop:
+                    if transfer_item.processed == transfer_item.size:
+                        self.progress.finished(transfer_item)
+                    else:
+                        self.progress.stopped(transfer_item)
+                    return
+                elif self.schedule_retry(transfer_item):
+                    self.progress.retrying(transfer_item)
+                else:
+                    self.progress.finished(transfer_item)
+        self.decrease_worker_count()  # semaphore or something
+        self.completed.emit()
+
+    def process(self, item, checkpoint=None):
+        if self.__stop:
+            item.status = TransferStatus.QUEUED
+            item.message = 'Shutdown'
+            return
+        if checkpoint is None:
+            checkpoint = store.TransferCheckpoint.load(item)
+        if checkpoint.started and checkpoint.target != item.destination.root:
+            # Resuming a transfer that was renamed by its conflict resolution
+            item.destination = item.destination.create(
+                items.new_client(item.destination.client, checkpoint.target),
+                size=item.destination.size,
+            )
+        source = item.source
+        upload_recv = item.destination.upload(checkpoint=checkpoint)
+        try:
+            # The first value sent back is the offset to resume from
+            offset = upload_recv.send(None)
+            if offset:
+                logging.info(f'Resuming {item.pk} from {checkpoint!r}')
+            item.processed = offset
+            for chunk in source.download(offset=offset):
+                if self.__stop:
+                    item.status = TransferStatus.QUEUED
+                    item.message = 'Shutdown'
+                    if checkpoint.resumable:
+                        # Leave the partial destination for the next run
+                        upload_recv.close()
+                    else:
+                        _ = upload_recv.send(None)
+                        item.destination.remove()
+                        checkpoint.clear()
+                    return
+                if written_amount := upload_recv.send(chunk):
+                    item.processed += written_amount
+            written_amount = upload_recv.send(None)
+            upload_recv.close()
+            item.processed += written_amount
+        except Exception as e:
+            item.error_category = retries.classify(e)
+            item.status = TransferStatus.ERROR
+            item.message = f'{item.error_category.label}: {e}'
+        else:
+            item.status = TransferStatus.COMPLETED
+            checkpoint.clear(completed=True)
+        finally:
+            upload_recv.close()
+
+    def is_small_object(self, item):
+        return (
+            self.batch_small_objects
+            and not item.source.is_dir
+            and item.size <= self.small_object_size
+        )
+
+    def process_batch(self, batch):
+        """Transfers every TransferItem in `batch` using one source and one
+        destination client. Each object is read and written in a single
+        request instead of being streamed.
+
+        The batch is published to the progress bus once before and once
+        after it is transferred
+        """
+        for item in batch:
+            item.status = TransferStatus.TRANSFERRING
+        self.progress.started(*batch)
+        done, retrying = [], []
+        try:
+            source_client = shared_client(batch[0].source)
+            destination_client = shared_client(batch[0].destination)
+        except Exception as e:
+            source_client = destination_client = None
+            logging.warn(f'Could not create a client for the batch: {e}')
+        for index, item in enumerate(batch):
+            if self.__stop:
+                for stopped_item in batch[index:]:
+                    stopped_item.status = TransferStatus.QUEUED
+                    stopped_item.message = 'Shutdown'
+                self.progress.stopped(*batch[index:])
+                break
+            try:
+                if skip_transfer(item, client=destination_client):
+                    item.status = TransferStatus.COMPLETED
+                    item.message = 'Skipped'
+                else:
+                    data = item.source.read(client=source_client)
+                    item.processed = item.destination.write(
+                        data, client=destination_client
+                    )
+                    item.status = TransferStatus.COMPLETED
+            except Exception as e:
+                item.error_category = retries.classify(e)
+                item.status = TransferStatus.ERROR
+                item.message = f'{item.error_category.label}: {e}'
+                if self.schedule_retry(item):
+                    retrying.append(item)
+                    continue
+            done.append(item)
+        if retrying:
+            self.progress.retrying(*retrying)
+        if done:
+            self.progress.finished(*done)
+
+    def schedule_retry(self, item):
+        """Returns the errored `item` to the database_queue after the
+        retry_policy's backoff if the error is transient.
+
+        Returns True if the item will be retried; else, False
+        """
+        if item.status != TransferStatus.ERROR or item.error_category is None:
+            return False
+        item.attempts += 1
+        if not self.retry_policy.should_retry(
+            item.error_category, item.attempts
+        ):
+            return False
+        delay = self.retry_policy.delay(item.error_category, item.attempts)
+        logging.info(
+            f'Retrying {item.pk} in {delay:.1f}s after attempt '
+            f'{item.attempts}: {item.message}'
+        )
+        item.status = TransferStatus.QUEUED
+        item.message = (
+            f'Retrying in {delay:.0f}s '
+            f'({item.attempts}/{self.retry_policy.max_attempts}): '
+            f'{item.message}'
+        )
+        item.error_category = None
+        self.database_queue.retry_later(item, delay)
+        return True
+
+    def _process(self, item):
+        # This is a placeholder function for testing
+        # bitrate = 10 * (1024 * 1024)
+        # bitrate = 1024
+        # bitrate = 10
+        bitrate = 1
+        # bitrate = .1
+        completed = 0
+        if skip_transfer(item):
+            item.status = TransferStatus.COMPLETED
+            item.message = 'Skipped'
+            return
+        while completed < item.size:
+            if self.__stop:
+                item.message = 'Shutdown'
+                return
+            completed += bitrate
+            if completed > item.size:
+                completed = item.size
+            item.processed = completed
+            bitrate += bitrate
+            if random.randint(0, 1_000) % 333 == 0:
+                item.status = TransferStatus.ERROR
+                item.message = 'ERROR'
+                return
+            if completed != item.size:
+                time.sleep(.5)
+        item.status = TransferStatus.COMPLETED
+
+    def decrease_max_worker_count(self):
+        with self.thread_lock:
+            if self.max_workers >= 2:
+                self.max_workers -= 1
+
+    def increase_max_worker_count(self):
+        with self.thread_lock:
+            self.max_workers += 1
+        self.start()
+
+    def decrease_worker_count(self):
+        with self.thread_lock:
+            if self.current_workers > 0:
+                self.current_workers -= 1
+
+    def increase_worker_count(self):
+        with self.thread_lock:
+            self.current_workers += 1
+
+    def shutdown(self):
+        self.__stop = True
+        self.database_queue.stop()
+        if not self.database_queue.join():
+            logging.warn('Could not stop database_queue')
+        self.stop()
+
+
+def batch_key(transfer_item):
+    """Returns a key that is equal for TransferItems that can share the
+    same source and destination clients"""
+    destination = transfer_item.destination
+    return (
+        client_key(transfer_item.source),
+        client_key(destination),
+        destination.bucket if isinstance(destination, items.BaseS3Item)
+        else None,
+    )
+
+
+def client_key(item):
+    if not isinstance(item, items.BaseS3Item):
+        return (item.type,)
+    return (
+        item.type,
+        item.client.get('Access Key'),
+        item.client.get('Region'),
+        item.client.get('Endpoint URL'),
+    )
+
+
+def shared_client(item):
+    """Returns a client that can be re-used for every item with the same
+    client_key; else, None for local items"""
+    if isinstance(item, items.BaseS3Item):
+        return item.setup_client()
+
+
+def skip_transfer(transfer_item, client=None):
+    # Terrible name
+    """If the TransferItem.conflict is 'overwrite', returns True.
+
+    Otherwise, checks if the TransferItem.destination already exists in its
+    respective location. If so, compares the existing destination
+    file against the TransferItem.source file information.
+
+    The supplied conflict resolution in the TransferItem.conflict
+    will be used.
+
+    The function will return True if the transfer should skipped; else, False
+
+    An existing destination `client` can be passed to re-use its connection
+
+    For convenience, the comparison strings are:
+        - overwrite
+        - hash
+        - size
+        - newer
+        - rename
+        - skip
+    """
+    if transfer_item.conflict == 'overwrite':
+        # Skip all checks
+        return False
+    if not transfer_item.destination.object_exists(client=client):
+        return False
+    else:
+        if transfer_item.conflict == 'skip':
+            return True
+    if transfer_item.conflict == 'hash':
+        # TODO: Add logging/status indicator updates as s3/DO may take a while
+        # TODO: Change the TransferItems 'rate' to 'Checking hash...'
+        source_hash_md5 = hashlib.md5()
+        for chunk in transfer_item.source.download():
+            source_hash_md5.update(chunk)
+        dest_hash_md5 = hashlib.md5()
+        for chunk in transfer_item.destination.download():
+            dest_hash_md5.update(chunk)
+        return source_hash_md5.hexdigest() == dest_hash_md5.hexdigest()
+    if transfer_item.conflict == 'size':
+        return transfer_item.source.size == transfer_item.destination.size
+    if transfer_item.conflict == 'newer':
+        return transfer_item.source.mtime <= transfer_item.destination.mtime
+    if transfer_item.conflict == 'rename':
+        client_copy = transfer_item.destination.client.copy()
+        root, fname = os.path.split(transfer_item.destination.root)
+        version = 0
+        while transfer_item.destination.object_exists(client=client):
+            version += 1
+            client_copy['Root'] = os.path.join(
+                root,
+                f' ({version})'.join(os.path.splitext(fname))
+            )
+            new_item = transfer_item.destination.create(
+                client_copy,
+                size=transfer_item.destination.size,
+                is_dir=transfer_item.destination.is_dir,
+                mtime=transfer_item.destination.mtime,
+                ctime=transfer_item.destination.ctime,
+            )
+            transfer_item.destination = new_item
+        return False
+    raise ConflictException(str(transfer_item))
@@ -0,0 +1,159 @@
+"""Streams the files found by a walk into the transfers table.
+
+    pipeline = TransferPipeline(conflict='skip')
+    pipeline.inserted.connect(print)
+    pipeline.run([partial(rows, folder) for folder in folders])
+
+Every producer is called on its own thread and returns a generator of
+(source, destination, size, source_type, destination_type) rows, e.g., by
+walking a folder and filtering what it finds. The rows are put in a
+bounded BatchQueue, so a walk waits while QUEUE_SIZE rows are waiting,
+and the thread calling run inserts them INSERT_BATCH at a time, or
+whatever arrived within INSERT_WAIT seconds. `inserted` is emitted after
+every insert, so the TransferQueue can page the new PENDING rows into its
+own bounded queue while the walk goes on. No stage holds more than its
+queue, however many files pass the filters.
+
+A producer that raises only stops its own rows. The error is kept in
+`errors` and emitted with `failed`, as is a batch that could not be
+inserted, which stops the pipeline.
+"""
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from cirrus import utils
+from cirrus.core import store
+from cirrus.core.events import Event
+
+
+# Rows inserted at once, and the most seconds a smaller batch waits
+INSERT_BATCH = 1_000
+INSERT_WAIT = 0.5
+# Rows waiting to be inserted before the producers wait
+QUEUE_SIZE = 10_000
+# Producers run at once
+PRODUCERS = 4
+
+
+def destination_paths(folder, destination):
+    """Returns path(source), which returns where `source`, found under the
+    `folder` path, is transferred to under the `destination` folder path
+    """
+    top = folder.rstrip('/')
+    target = os.path.abspath(
+        os.path.join(destination, os.path.basename(top))
+    )
+    prefix = top + '/'
+
+    def path(source):
+        rest = source[len(prefix):]
+        # Joined as is unless relpath would normalize it
+        if (
+            source.startswith(prefix)
+            and rest
+            and not rest.startswith(('.', '/'))
+            and not rest.endswith('/')
+            and '/.' not in rest
+            and '//' not in rest
+        ):
+            return os.path.join(target, rest)
+        return os.path.abspath(
+            os.path.join(target, os.path.relpath(source, start=folder))
+        )
+
+    return path
+
+
+class TransferPipeline:
+    """Inserts the rows of one or more producers as PENDING transfers.
+
+    `inserted` is emitted with the number of rows after every insert, in
+    the thread calling run. `failed` is emitted with every error added to
+    `errors`, in the thread it was raised in.
+    """
+
+    def __init__(
+        self,
+        *,
+        conflict=None,
+        batch_size=INSERT_BATCH,
+        wait=INSERT_WAIT,
+        maxsize=QUEUE_SIZE,
+        workers=PRODUCERS,
+    ):
+        self.conflict = 'skip' if conflict is None else conflict
+        self.batch_size = batch_size
+        self.wait = wait
+        self.maxsize = maxsize
+        self.workers = workers
+        self.inserted = Event()
+        self.failed = Event()
+        self.count = 0
+        self.errors = []
+        self.stopped = threading.Event()
+        self.__queue = None
+
+    def run(self, producers):
+        """Inserts the rows of every producer until they run out or stop
+        is called. Returns the number of rows inserted, which only covers
+        every row if `errors` is empty"""
+        self.__queue = utils.threads.BatchQueue(
+            producers=len(producers),
+            batch_size=self.batch_size,
+            maxsize=self.maxsize,
+        )
+        if self.stopped.is_set():
+            self.__queue.close()
+        pool = ThreadPoolExecutor(
+            max_workers=max(1, min(self.workers, len(producers))),
+            thread_name_prefix='pipeline',
+        )
+        try:
+            for producer in producers:
+                pool.submit(self.__produce, producer)
+            # Rows already queued when stopped are still inserted
+            while (batch := self.__queue.get_batch(self.wait)) is not None:
+                if not batch:
+                    continue
+                if not store.insert_transfers(
+                    [row + (self.conflict,) for row in batch]
+                ):
+                    self.__fail(
+                        RuntimeError(f'Failed to insert {len(batch):,} rows')
+                    )
+                    self.stop()
+                    break
+                self.count += len(batch)
+                self.inserted.emit(len(batch))
+        finally:
+            self.__queue.close()
+            pool.shutdown(wait=False, cancel_futures=True)
+        return self.count
+
+    def stop(self):
+        self.stopped.set()
+        if self.__queue is not None:
+            # Wakes the producers waiting on a full queue
+            self.__queue.close()
+
+    def __produce(self, producer):
+        rows = None
+        try:
+            rows = producer()
+            for row in rows:
+                if self.stopped.is_set() or not self.__queue.put(row):
+                    break
+        except Exception as e:
+            self.__fail(e)
+        finally:
+            if rows is not None:
+                rows.close()
+            self.__queue.done()
+
+    def __fail(self, error):
+        logging.warning(f'Failed to queue transfers: {error!r}')
+        self.errors.append(error)
+        self.failed.emit(error)
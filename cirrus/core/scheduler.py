@@ -0,0 +1,410 @@
+import collections
+import gc
+import logging
+import queue
+import sqlite3
+import threading
+
+from cirrus import items, retries, settings
+from cirrus.core import store
+from cirrus.core.events import Event
+from cirrus.statuses import TransferPriority, TransferStatus
+
+
+class DatabaseWorkers:
+
+    def __init__(self):
+        self.peak_bitrate = 0
+        self.total_processed = 0
+        self.avg_bitrate = 0
+        self.current_bitrate = 0
+        self.num_finished_workers = 0
+        self.num_current_workers = 0
+        self.completed = set()
+        self.output = collections.namedtuple(
+            'output',
+            [
+                'num_finished_workers',
+                'num_current_workers',
+                'peak_bitrate',
+                'avg_bitrate',
+                'current_bitrate'
+            ]
+        )
+
+    def __call__(self):
+        print(
+            f'Updating workers | PREV: {self.num_current_workers}',
+            end=''
+        )
+        self.update()
+        print(f' | NOW: {self.num_current_workers}', flush=True)
+        output = self.output(
+            num_finished_workers=self.num_finished_workers,
+            num_current_workers=self.num_current_workers,
+            peak_bitrate=self.peak_bitrate,
+            avg_bitrate=self.avg_bitrate,
+            current_bitrate=self.current_bitrate,
+        )
+        return output
+
+    def update(self):
+        # TODO: Check if local/S3/etc. Will be done in the TransferItem
+        worker_found = False
+        transferring = set()
+        self.num_current_workers = 0
+        processed = 0
+        done_statuses = {TransferStatus.ERROR, TransferStatus.COMPLETED}
+        # No DB will have the epehemeral data.
+        # Maybe keep a list in the executor and then pass that to the
+        # class from `central.py`
+        for item in gc.get_objects():  # I hate me, too
+            if isinstance(item, items.TransferItem) and item.pk not in self.completed:  # noqa E501
+                if item.status in done_statuses:
+                    if not worker_found:
+                        worker_found = True
+                    self.total_processed += item.processed
+                    if (bitrate := item.rate_in_bytes()) > self.peak_bitrate:
+                        self.peak_bitrate = bitrate
+                    self.num_finished_workers += 1
+                    self.completed.add(item.pk)
+                elif item.status == TransferStatus.TRANSFERRING:
+                    processed += item.processed
+                    if item.pk not in transferring:
+                        self.num_current_workers += 1
+                        transferring.add(item.pk)
+        if worker_found:
+            self.avg_bitrate = self.total_processed // self.num_finished_workers  # noqa E501
+        if self.num_current_workers:
+            self.current_bitrate = processed // self.num_current_workers
+
+
+class TransferQueue:
+    """Feeds PENDING transfers from the database to the Executor's workers.
+
+    A single queue thread selects PENDING rows with sqlite3, marks them
+    QUEUED, and puts them in the bounded cls.hot_queue PriorityQueue that
+    the workers consume with cls.next_item().
+
+    The add_worker, remove_worker, and completed Events mirror the Signals
+    of the Qt cirrus.database.DatabaseQueue adapter.
+    """
+
+    def __init__(self, *, max_workers=10):
+        self.add_worker = Event()
+        self.remove_worker = Event()
+        self.completed = Event()
+        self.clients = list(settings.saved_clients())
+        self.workers = DatabaseWorkers()
+        self.max_workers = max_workers
+        self.queue_being_built = False
+        self.lock = threading.Lock()
+        # TODO: Tweak max size wrt timeout
+        self.hot_queue = queue.PriorityQueue(maxsize=self.max_workers * 2)
+        # Failed items waiting out their backoff before re-entering hot_queue
+        self.retry_queue = retries.DelayedRetryQueue(self.requeue)
+        self.queue_thread = None
+        self.__stopped = False
+
+    def build_queue(self):
+        """Creates and starts the cls.queue_thread. Will set
+        cls.__stopped to False and cls.queue_being_built to True
+
+        If cls.queue_being_built is already True, does nothing and returns
+
+        Can be called multiple times
+        """
+        with self.lock:
+            if self.queue_being_built:
+                return
+            self.__stopped = False
+            self.queue_being_built = True
+            self.queue_thread = threading.Thread(
+                target=self.__build_queue,
+                name='database_thread',
+                daemon=True,
+            )
+            self.queue_thread.start()
+
+    def __build_queue(self):
+        self.abort_abandoned_uploads()
+        try:
+            con = store.connect()
+        except sqlite3.Error as e:
+            store.critical_msg('build_queue (connect)', str(e))
+            self.__finish_building()
+            return
+        try:
+            while not self.__stopped:
+                if not self.__queue_next_rows(con):
+                    return
+        finally:
+            con.close()
+            self.__finish_building()
+
+    def __finish_building(self):
+        with self.lock:
+            self.queue_being_built = False
+
+    def __queue_next_rows(self, con):
+        """Queues the next page of PENDING rows. Returns False once there
+        are no more rows or the queue was stopped
+        """
+        try:
+            rows = con.execute('''
+                SELECT
+                    pk,
+                    source,
+                    destination,
+                    size,
+                    priority,
+                    source_type,
+                    destination_type,
+                    conflict,
+                    attempts
+                FROM
+                    transfers
+                WHERE
+                    status = (?)
+                ORDER BY
+                    priority DESC,
+                    pk ASC
+                LIMIT
+                    (?)
+            ''', (
+                TransferStatus.PENDING.value,
+                # TODO: Tweak LIMIT wrt to Timeout
+                self.max_workers * 2,
+            )).fetchall()
+        except sqlite3.Error as e:
+            store.critical_msg('next_item (exec)', str(e))
+            return False
+        pks_to_update = []
+        for row in rows:
+            if self.__stopped:
+                return False
+            transfer_item = self.create_transfer_item(*row)
+            if transfer_item is None:
+                continue
+            pks_to_update.append(transfer_item.pk)
+            priority = transfer_item.priority.value
+            try:
+                # TODO: Tweak the timeout and list at start
+                timeout = 0 if self.__stopped else 2
+                self.hot_queue.put((priority, transfer_item), timeout=timeout)
+            except queue.Full:
+                if not self.__stopped:
+                    self.adjust_workers()
+                self.hot_queue.put((priority, transfer_item))
+        if not pks_to_update or self.__stopped:
+            return False
+        try:
+            with con:
+                con.executemany(
+                    'UPDATE transfers SET status = (?) WHERE pk = (?)',
+                    [
+                        (TransferStatus.QUEUED.value, pk)
+                        for pk in pks_to_update
+                    ],
+                )
+        except sqlite3.Error as e:
+            store.critical_msg('next_item', str(e))
+            return False
+        return True
+
+    def create_transfer_item(
+        self,
+        pk,
+        source,
+        destination,
+        size,
+        priority,
+        source_type,
+        destination_type,
+        conflict,
+        attempts,
+    ):
+        """Returns a QUEUED TransferItem for a transfers row or None if
+        a saved client could not be found for its source or destination
+        """
+        src_act_type = source_type.lower()
+        src_client = self.find_client(src_act_type, source)
+        if not src_client:
+            logging.warn(
+                f'Could not find client for Source: {source}. Skipping'
+            )
+            return
+        src_client['Root'] = source
+        src_item = items.types[src_act_type](src_client, size=size)
+        dst_act_type = destination_type.lower()
+        dst_client = self.find_client(dst_act_type, destination)
+        if not dst_client:
+            logging.warn(
+                f'Could not find client for Destination: {destination}. '
+                'Skipping'
+            )
+            return
+        dst_client['Root'] = destination
+        dst_item = items.types[dst_act_type](dst_client, size=size)
+        priority = 3 if not priority else priority
+        return items.TransferItem(
+            pk,
+            src_item,
+            dst_item,
+            size,
+            status=TransferStatus.QUEUED,
+            priority=TransferPriority(priority),
+            conflict=conflict.lower().strip(),
+            attempts=attempts or 0,
+        )
+
+    def abort_abandoned_uploads(self):
+        """Aborts the multipart uploads in the abandoned_uploads table, so
+        S3 stops keeping their parts. Those that fail are tried again the
+        next time the queue is built"""
+        aborted = []
+        for upload_id, target, destination_type in store.abandoned_uploads():
+            # Checkpoints from before the type was recorded were S3-like
+            act_types = [destination_type.lower()] if destination_type else [
+                act_type for act_type in items.types if act_type != 'local'
+            ]
+            for act_type in act_types:
+                if (client := self.find_client(act_type, target)):
+                    item = items.types[act_type](items.new_client(
+                        client, target
+                    ))
+                    if item.abort_upload(upload_id):
+                        aborted.append(upload_id)
+                    break
+            else:
+                logging.warn(f'Could not find client to abort {target}')
+        if aborted:
+            store.forget_abandoned_uploads(aborted)
+
+    def find_client(self, act_type, root):
+        """Searches the current settings.saved_clients() list
+        to find an account type that has the longest matched
+        Root to the passed root
+
+        Returns either the found client or None
+        """
+        client = items.match_client(
+            self.clients, act_type, root
+        )
+        if not client:
+            # Update clients in case new client was added
+            self.clients = list(settings.saved_clients())
+            client = items.match_client(
+                self.clients, act_type, root
+            )
+        return client
+
+    def next_item(self, timeout=5.0):
+        """Yields the next item in the cls.hot_queue PriorityQueue
+
+        If an Empty queue Exception occurs and either cls.__stopped is True or
+        cls.queue_being_built is False and no retries are waiting, the
+        completed event is emitted and the method returns None; else,
+        cls.adjust_workers() is called to reduce the number of available
+        workers as they're outpacing the producers
+        """
+        while True:
+            try:
+                # TODO: Tweak timeout
+                _, item = self.hot_queue.get(timeout=timeout)
+            except queue.Empty:
+                # Timeout emits an queue.Empty Error
+                if self.__stopped:
+                    self.completed.emit()
+                    return
+                if not self.queue_being_built and not self.retry_queue.pending:
+                    self.completed.emit()
+                    return
+                self.adjust_workers()
+            else:
+                self.hot_queue.task_done()
+                yield item
+
+    def take_matching(self, predicate, limit):
+        """Removes and returns up to `limit` TransferItems from cls.hot_queue
+        for which `predicate(item)` is True, in priority order.
+
+        Never blocks. Items that do not match keep their place in the queue
+        """
+        if limit <= 0:
+            return []
+        with self.hot_queue.mutex:
+            entries = sorted(self.hot_queue.queue)
+            taken, kept = [], []
+            for entry in entries:
+                if len(taken) < limit and predicate(entry[1]):
+                    taken.append(entry[1])
+                else:
+                    kept.append(entry)
+            if not taken:
+                return taken
+            # A sorted list is already a valid heap
+            self.hot_queue.queue[:] = kept
+            self.hot_queue.unfinished_tasks -= len(taken)
+            if not self.hot_queue.unfinished_tasks:
+                self.hot_queue.all_tasks_done.notify_all()
+            self.hot_queue.not_full.notify(len(taken))
+        return taken
+
+    def retry_later(self, item, delay):
+        """Returns `item` to the cls.hot_queue after `delay` seconds without
+        holding a worker thread in the meantime
+        """
+        self.retry_queue.put(item, delay)
+
+    def requeue(self, item):
+        """Puts a previously queued TransferItem back into cls.hot_queue"""
+        if self.__stopped:
+            return
+        self.hot_queue.put((item.priority.value, item))
+
+    def adjust_workers(self):
+        # TODO: Add a remove_worker signal to the executor
+        #       subclass when there are too many rate limit hits
+        # TODO: Think of a way to smartly calculate
+        #       if a thread needs to be killed
+        # NOTE: This could potentially be a costly call.
+        return
+        w = self.workers()
+        if not all([w.current_bitrate, w.peak_bitrate, w.avg_bitrate]):
+            return
+        if w.current_bitrate / w.peak_bitrate >= .5:
+            if w.current_bitrate / w.avg_bitrate >= .75:
+                self.add_worker.emit()
+
+    def join(self, timeout=0.1, attempts=10):
+        """Attempts to join the queue_thread that controls
+        the cls.__build_queue functionality.
+
+        The default timeout is 0.1 seconds.
+        The default number of attempts if 10
+        """
+        if self.queue_thread:
+            attempt = 0
+            while self.queue_thread.is_alive():
+                if attempt == attempts:
+                    logging.warn(
+                        'queue_thread could not be '
+                        f'joined after {attempt} attempts'
+                    )
+                    return False
+                self.queue_thread.join(timeout)
+                attempt += 1
+        return True
+
+    def stop(self):
+        """Sets the cls.__stopped flag to True and drains the cls.hot_queue
+        of all pending items.
+        """
+        self.__stopped = True
+        self.retry_queue.clear()
+        while True:
+            try:
+                _ = self.hot_queue.get_nowait()
+            except queue.Empty:
+                break
@@ -0,0 +1,632 @@
+import logging
+import sqlite3
+
+from functools import wraps
+
+from cirrus import settings, utils
+from cirrus.statuses import TransferStatus
+
+
+def db_logger(log_level=logging.debug):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            log_level(
+                f'Database: {func.__name__}(args:{args!r}, kwargs:{kwargs!r}'
+            )
+            result = func(*args, **kwargs)
+            log_level(
+                f'Database: {func.__name__}(args:{args!r}, '
+                f'kwargs:{kwargs!r} -> {result}'
+            )
+            return result
+        return wrapper
+    return decorator
+
+
+def connect():
+    """Returns a new sqlite3 connection to settings.DATABASE. sqlite3
+    connections cannot be shared between threads, so each caller opens
+    and closes its own
+    """
+    return sqlite3.connect(settings.DATABASE, timeout=30)
+
+
+def execute_many(source, sql, rows):
+    """Executes `sql` for every row in `rows` in a single transaction.
+    Returns True on success; else, False
+    """
+    try:
+        con = connect()
+        try:
+            with con:
+                con.executemany(sql, rows)
+        finally:
+            con.close()
+    except sqlite3.Error as e:
+        critical_msg(source, str(e))
+        return False
+    return True
+
+
+class TransferCheckpoint:
+    """Resume state for a single transfer, persisted to the `checkpoints`
+    and `checkpoint_parts` tables.
+
+    Local destinations record the byte offset that has been flushed to disk.
+    S3-like destinations record the multipart UploadId and every completed
+    part, so a restarted transfer resumes from the last completed part
+    instead of byte 0.
+
+    A checkpoint is keyed by the transfer's pk but is only considered valid
+    if the source, destination, and size still match, as pks can be re-used
+    once rows are dropped. `target` is the location actually being written,
+    which differs from `destination` when the conflict resolution renamed it.
+
+    An UploadId that is replaced or cleared before it completed is moved
+    to the `abandoned_uploads` table, and so is that of a checkpoint whose
+    transfer row is deleted, until the upload is aborted. See
+    cirrus.core.scheduler.TransferQueue.abort_abandoned_uploads.
+
+    The worker threads cannot share the QSqlDatabase connections, so every
+    write uses its own short-lived sqlite3 connection.
+    """
+
+    def __init__(
+        self,
+        pk,
+        *,
+        source,
+        destination,
+        size,
+        destination_type=None,
+        target=None,
+        upload_id=None,
+        offset=0,
+        parts=None,
+    ):
+        self.pk = pk
+        self.source = source
+        self.destination = destination
+        self.size = size
+        self.destination_type = destination_type
+        self.target = destination if target is None else target
+        self.upload_id = upload_id
+        self.offset = offset
+        self.parts = list(parts) if parts is not None else []
+        # Set by the destination's upload() when the checkpoint can be used
+        self.resumable = False
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(pk={self.pk}, '
+                f'target="{self.target}", upload_id={self.upload_id}, '
+                f'offset={self.offset}, parts={len(self.parts)})')
+
+    @property
+    def started(self):
+        return bool(self.upload_id or self.offset)
+
+    @classmethod
+    def load(cls, transfer_item):
+        """Returns the persisted checkpoint for `transfer_item` or a new,
+        empty checkpoint if none exists or the stored one is stale
+        """
+        checkpoint = cls(
+            transfer_item.pk,
+            source=transfer_item.source.root,
+            destination=transfer_item.destination.root,
+            size=transfer_item.size,
+            destination_type=transfer_item.destination.type,
+        )
+        try:
+            con = connect()
+            try:
+                row = con.execute('''
+                    SELECT
+                        source,
+                        destination,
+                        size,
+                        target,
+                        upload_id,
+                        byte_offset,
+                        destination_type
+                    FROM
+                        checkpoints
+                    WHERE
+                        transfer_pk = (?)
+                ''', (checkpoint.pk,)).fetchone()
+                if row is None:
+                    return checkpoint
+                (
+                    source,
+                    destination,
+                    size,
+                    target,
+                    upload_id,
+                    offset,
+                    destination_type,
+                ) = row
+                if (source, destination, size) != (
+                    checkpoint.source, checkpoint.destination, checkpoint.size
+                ):
+                    logging.info(f'Discarding stale checkpoint for {row}')
+                    # The stale upload is abandoned with its own target
+                    checkpoint.target = target
+                    checkpoint.upload_id = upload_id
+                    checkpoint.destination_type = destination_type
+                    checkpoint.clear()
+                    checkpoint.target = checkpoint.destination
+                    checkpoint.destination_type = (
+                        transfer_item.destination.type
+                    )
+                    return checkpoint
+                checkpoint.target = target
+                checkpoint.upload_id = upload_id
+                checkpoint.offset = offset
+                checkpoint.parts = con.execute('''
+                    SELECT
+                        part_number,
+                        etag,
+                        size
+                    FROM
+                        checkpoint_parts
+                    WHERE
+                        transfer_pk = (?)
+                    ORDER BY
+                        part_number ASC
+                ''', (checkpoint.pk,)).fetchall()
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            critical_msg('TransferCheckpoint.load', str(e))
+        return checkpoint
+
+    def begin(self, target, *, upload_id=None):
+        """Starts a fresh checkpoint writing to `target`. A previous
+        UploadId is abandoned"""
+        statements = self.__abandon_statements(upload_id)
+        self.target = target
+        self.upload_id = upload_id
+        self.offset = 0
+        self.parts = []
+        self.__execute([
+            *statements,
+            ('DELETE FROM checkpoint_parts WHERE transfer_pk = (?)',
+             (self.pk,)),
+            (self.__upsert_sql, self.__upsert_values()),
+        ])
+
+    def add_part(self, part_number, etag, size):
+        """Records a completed multipart part and advances the offset"""
+        self.parts.append((part_number, etag, size))
+        self.offset += size
+        self.__execute([
+            ('''
+                INSERT OR REPLACE INTO
+                    checkpoint_parts (transfer_pk, part_number, etag, size)
+                VALUES
+                    (?, ?, ?, ?)''',
+             (self.pk, part_number, etag, size)),
+            (self.__upsert_sql, self.__upsert_values()),
+        ])
+
+    def keep_parts(self, count):
+        """Drops every recorded part after the first `count` parts"""
+        if count >= len(self.parts):
+            return
+        self.parts = self.parts[:count]
+        self.offset = sum(size for _, __, size in self.parts)
+        last_part = self.parts[-1][0] if self.parts else 0
+        self.__execute([
+            ('''
+                DELETE FROM
+                    checkpoint_parts
+                WHERE
+                    transfer_pk = (?) AND part_number > (?)''',
+             (self.pk, last_part)),
+            (self.__upsert_sql, self.__upsert_values()),
+        ])
+
+    def update_offset(self, offset):
+        """Records the number of bytes safely written to the target"""
+        self.offset = offset
+        self.__execute([(self.__upsert_sql, self.__upsert_values())])
+
+    def clear(self, *, completed=False):
+        """Removes the persisted checkpoint. Its UploadId is abandoned
+        unless the upload `completed`"""
+        statements = [] if completed else self.__abandon_statements()
+        self.upload_id = None
+        self.offset = 0
+        self.parts = []
+        self.__execute([
+            *statements,
+            ('DELETE FROM checkpoint_parts WHERE transfer_pk = (?)',
+             (self.pk,)),
+            ('DELETE FROM checkpoints WHERE transfer_pk = (?)', (self.pk,)),
+        ])
+
+    def __abandon_statements(self, replacement=None):
+        if not self.upload_id or self.upload_id == replacement:
+            return []
+        return [(
+            '''
+                INSERT OR IGNORE INTO
+                    abandoned_uploads (upload_id, target, destination_type)
+                VALUES
+                    (?, ?, ?)''',
+            (self.upload_id, self.target, self.destination_type),
+        )]
+
+    __upsert_sql = '''
+        INSERT OR REPLACE INTO
+            checkpoints (
+                transfer_pk,
+                source,
+                destination,
+                size,
+                target,
+                upload_id,
+                byte_offset,
+                updated,
+                destination_type
+            )
+        VALUES
+            (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+    def __upsert_values(self):
+        return (
+            self.pk,
+            self.source,
+            self.destination,
+            self.size,
+            self.target,
+            self.upload_id,
+            self.offset,
+            utils.date.iso_now(),
+            self.destination_type,
+        )
+
+    def __execute(self, statements):
+        try:
+            con = connect()
+            try:
+                with con:
+                    for sql, values in statements:
+                        con.execute(sql, values)
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            critical_msg('TransferCheckpoint', str(e))
+            return False
+        return True
+
+
+def abandoned_uploads():
+    """Returns the (upload_id, target, destination_type) of every multipart
+    upload waiting to be aborted"""
+    try:
+        con = connect()
+        try:
+            return con.execute('''
+                SELECT
+                    upload_id,
+                    target,
+                    destination_type
+                FROM
+                    abandoned_uploads
+            ''').fetchall()
+        finally:
+            con.close()
+    except sqlite3.Error as e:
+        critical_msg('abandoned_uploads', str(e))
+        return []
+
+
+def forget_abandoned_uploads(upload_ids):
+    """Removes the aborted `upload_ids` from the abandoned uploads"""
+    return execute_many(
+        'forget_abandoned_uploads',
+        'DELETE FROM abandoned_uploads WHERE upload_id = (?)',
+        [(upload_id,) for upload_id in upload_ids],
+    )
+
+
+# Not logged with db_logger, as the rows of a batch would be formatted
+# into every message
+def insert_transfers(rows):
+    """Inserts PENDING transfers from `rows` of (source, destination, size,
+    source_type, destination_type, conflict) in a single transaction.
+    Returns True on success; else, False
+    """
+    return execute_many(
+        'insert_transfers',
+        '''
+            INSERT INTO
+                transfers (
+                    source,
+                    destination,
+                    size,
+                    source_type,
+                    destination_type,
+                    conflict
+                )
+            VALUES
+                (?, ?, ?, ?, ?, ?)
+        ''',
+        rows,
+    )
+
+
+@db_logger()
+def queued_batch_update(pks_to_update):
+    return execute_many(
+        'queued_batch_update',
+        'UPDATE transfers SET status = (?) WHERE pk = (?)',
+        [(TransferStatus.QUEUED.value, pk) for pk in pks_to_update],
+    )
+
+
+@db_logger()
+def started_batch_update(transfer_items):
+    return execute_many(
+        'started_batch_update',
+        'UPDATE transfers SET start_time = (?) WHERE pk = (?)',
+        [
+            (utils.date.to_iso(item.started), item.pk)
+            for item in transfer_items
+        ],
+    )
+
+
+@db_logger()
+def error_batch_update(transfer_items):
+    return execute_many(
+        'error_batch_update',
+        '''
+            UPDATE
+                transfers
+            SET
+                status = (?), error_message = (?), end_time = (?),
+                attempts = (?)
+            WHERE
+                pk = (?)
+        ''',
+        [
+            (
+                item.status.value,
+                item.message,
+                utils.date.to_iso(item.completed),
+                item.attempts,
+                item.pk,
+            )
+            for item in transfer_items
+        ],
+    )
+
+
+@db_logger()
+def retry_batch_update(transfer_items):
+    return execute_many(
+        'retry_batch_update',
+        '''
+            UPDATE
+                transfers
+            SET
+                status = (?), error_message = (?), attempts = (?)
+            WHERE
+                pk = (?)
+        ''',
+        [
+            (item.status.value, item.message, item.attempts, item.pk)
+            for item in transfer_items
+        ],
+    )
+
+
+@db_logger()
+def completed_batch_update(transfer_items):
+    return execute_many(
+        'completed_batch_update',
+        '''
+            UPDATE
+                transfers
+            SET
+                status = (?), end_time = (?)
+            WHERE
+                pk = (?)
+        ''',
+        [
+            (
+                item.status.value,
+                utils.date.to_iso(item.completed),
+                item.pk,
+            )
+            for item in transfer_items
+        ],
+    )
+
+
+@db_logger()
+def restart_queued_transfers():
+    return execute_many(
+        'restart_queued_transfers',
+        '''
+            UPDATE
+                transfers
+            SET
+                status = (?), start_time = ""
+            WHERE
+                status == (?)
+        ''',
+        [(TransferStatus.PENDING.value, TransferStatus.QUEUED.value)],
+    )
+
+
+@db_logger()
+def count_transfers(status, *, since=None):
+    """Returns the number of transfers with `status`, optionally only
+    those that ended at or after the `since` datetime
+    """
+    sql = 'SELECT COUNT(*) FROM transfers WHERE status = (?)'
+    values = (status.value,)
+    if since is not None:
+        sql += ' AND end_time >= (?)'
+        values += (utils.date.to_iso(since),)
+    try:
+        con = connect()
+        try:
+            return con.execute(sql, values).fetchone()[0]
+        finally:
+            con.close()
+    except sqlite3.Error as e:
+        critical_msg('count_transfers', str(e))
+        return 0
+
+
+def critical_msg(source, msg, parent=None):
+    # This sould require a parent for blocking
+    print(source, msg, sep=' | ')
+    logging.critical(f'Database Error: {source} | {msg}')
+    '''
+    QMessageBox.critical(
+        parent,
+        'Error!',
+        f'Database Error: {msg}'
+    )
+    '''
+
+
+@db_logger()
+def setup(*, con_name='con'):
+    con = connect()
+    cur = con.cursor()
+    # Columns should only be for items that we want to keep on exit
+    _ = cur.execute('''
+        CREATE TABLE IF NOT EXISTS transfers (
+            pk INTEGER PRIMARY KEY ASC,
+            source TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            priority INTEGER DEFAULT 3,
+            status INTEGER DEFAULT 0,
+            start_time TEXT,
+            end_time TEXT,
+            error_message TEXT,
+            source_type TEXT NOT NULL,
+            destination_type TEXT NOT NULL,
+            conflict TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0
+        );''')
+    columns = {
+        row[1] for row in cur.execute('PRAGMA table_info(transfers)')
+    }
+    if 'attempts' not in columns:
+        _ = cur.execute(
+            'ALTER TABLE transfers ADD COLUMN attempts INTEGER DEFAULT 0'
+        )
+    idx_check = cur.execute('''
+        SELECT
+            COUNT(*)
+        FROM
+            sqlite_master
+        WHERE
+            type='index' and name='idx_transfers_status'
+    ''')
+    if not idx_check.fetchone()[0]:
+        _ = cur.execute(
+            'CREATE INDEX idx_transfers_status on transfers (status)'
+        )
+    idx_check = cur.execute('''
+        SELECT
+            COUNT(*)
+        FROM
+            sqlite_master
+        WHERE
+            type='index' and name='idx_transfers_priority'
+    ''')
+    if not idx_check.fetchone()[0]:
+        _ = cur.execute(
+            'CREATE INDEX idx_transfers_priority on transfers (priority)'
+        )
+    # Resume state for interrupted transfers. See TransferCheckpoint
+    _ = cur.execute('''
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            transfer_pk INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            target TEXT NOT NULL,
+            upload_id TEXT,
+            byte_offset INTEGER DEFAULT 0,
+            updated TEXT,
+            destination_type TEXT
+        );''')
+    columns = {
+        row[1] for row in cur.execute('PRAGMA table_info(checkpoints)')
+    }
+    if 'destination_type' not in columns:
+        _ = cur.execute(
+            'ALTER TABLE checkpoints ADD COLUMN destination_type TEXT'
+        )
+    _ = cur.execute('''
+        CREATE TABLE IF NOT EXISTS checkpoint_parts (
+            transfer_pk INTEGER NOT NULL,
+            part_number INTEGER NOT NULL,
+            etag TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (transfer_pk, part_number)
+        );''')
+    # Multipart uploads that were never completed, waiting to be aborted
+    _ = cur.execute('''
+        CREATE TABLE IF NOT EXISTS abandoned_uploads (
+            upload_id TEXT PRIMARY KEY,
+            target TEXT NOT NULL,
+            destination_type TEXT
+        );''')
+    # A deleted transfer takes its checkpoint with it and abandons its
+    # UploadId
+    _ = cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS transfers_deleted
+        AFTER DELETE ON transfers
+        BEGIN
+            INSERT OR IGNORE INTO
+                abandoned_uploads (upload_id, target, destination_type)
+            SELECT
+                upload_id, target, destination_type
+            FROM
+                checkpoints
+            WHERE
+                transfer_pk = OLD.pk AND upload_id IS NOT NULL;
+            DELETE FROM checkpoint_parts WHERE transfer_pk = OLD.pk;
+            DELETE FROM checkpoints WHERE transfer_pk = OLD.pk;
+        END
+    ''')
+    # Rows removed from the transfers table before the trigger existed
+    # leave their checkpoints behind
+    _ = cur.execute('''
+        INSERT OR IGNORE INTO
+            abandoned_uploads (upload_id, target, destination_type)
+        SELECT
+            upload_id, target, destination_type
+        FROM
+            checkpoints
+        WHERE
+            transfer_pk NOT IN (SELECT pk FROM transfers)
+            AND upload_id IS NOT NULL
+    ''')
+    _ = cur.execute('''
+        DELETE FROM
+            checkpoint_parts
+        WHERE
+            transfer_pk NOT IN (SELECT pk FROM transfers)
+    ''')
+    _ = cur.execute('''
+        DELETE FROM
+            checkpoints
+        WHERE
+            transfer_pk NOT IN (SELECT pk FROM transfers)
+    ''')
+    _ = con.commit()
+    _ = cur.execute('PRAGMA journal_mode=WAL;')
+    _ = con.commit()
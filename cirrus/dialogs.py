@@ -2,13 +2,14 @@ import os
 
 from functools import partial
 
-from cirrus import items, settings, utils, windows
+from cirrus import filters, items, settings, utils, windows
 from cirrus.widgets import FlowLayout, FileFilters
 
 from PySide6.QtCore import Qt, Signal, Slot
 from PySide6.QtWidgets import (
     QButtonGroup,
     QCheckBox,
+    QComboBox,
     QDialog,
     QDialogButtonBox,
     QGridLayout,
@@ -17,6 +18,7 @@ from PySide6.QtWidgets import (
     QLineEdit,
     QRadioButton,
     QSizePolicy,
+    QSpinBox,
     QToolButton,
     QVBoxLayout,
 )
@@ -216,7 +218,9 @@ class SearchItemsDialog(QDialog):
 
         # Filters
         self.filters = FileFilters(window=self.parent)
+        self.filters.validity_changed.connect(self.filters_validity_changed)
         filters_form = self.filters.setup_form()
+        filters_form.addRow('Show:', self.setup_top_selection())
 
         self.layout = QVBoxLayout()
         self.location_selections = []
@@ -244,6 +248,14 @@ class SearchItemsDialog(QDialog):
                 )
             )
         self.layout.addLayout(filters_form)
+        self.use_index = settings.search_index_enabled()
+        self.use_index_checkbox = QCheckBox('Use search index')
+        self.use_index_checkbox.setToolTip(
+            'Answer repeated searches from the files already indexed'
+        )
+        self.use_index_checkbox.setChecked(self.use_index)
+        self.use_index_checkbox.toggled.connect(self.toggle_use_index)
+        self.layout.addWidget(self.use_index_checkbox)
         self.layout.addWidget(self.button_box)
         self.setLayout(self.layout)
         self.filters.after_setup_styling()
@@ -253,6 +265,7 @@ class SearchItemsDialog(QDialog):
             for btn in self.button_box.buttons():
                 if not btn.isEnabled():
                     btn.setEnabled(True)
+            self.filters_validity_changed(self.filters.valid)
         else:
             if self.all_locations_deselected():
                 for btn in self.button_box.buttons():
@@ -263,10 +276,58 @@ class SearchItemsDialog(QDialog):
             btn.isChecked() for btn in self.location_selections
         )
 
+    @Slot(bool)
+    def filters_validity_changed(self, valid):
+        # A pattern that does not compile cannot be searched for
+        if self.location_selections and self.all_locations_deselected():
+            valid = False
+        self.search_btn.setEnabled(valid)
+        self.recursive_search_btn.setEnabled(valid)
+
     @Slot(bool)
     def toggle_recursive(self, checked):
         self.recursive = False if self.recursive else True
 
+    def setup_top_selection(self):
+        layout = QHBoxLayout()
+        options = [
+            ('All Results', None),
+            ('Largest', filters.LARGEST),
+            ('Smallest', filters.SMALLEST),
+            ('Newest', filters.NEWEST),
+            ('Oldest', filters.OLDEST),
+        ]
+        self.top_option = QComboBox()
+        for index, option in enumerate(options):
+            text, key = option
+            self.top_option.addItem(text)
+            self.top_option.setItemData(index, key)
+        self.top_count = QSpinBox()
+        self.top_count.setRange(1, 100_000)
+        self.top_count.setValue(100)
+        self.top_count.setEnabled(False)
+        self.top_option.currentIndexChanged.connect(self.top_option_changed)
+        layout.addWidget(self.top_option)
+        layout.addWidget(self.top_count)
+        layout.addStretch(1)
+        return layout
+
+    @Slot(int)
+    def top_option_changed(self, index):
+        self.top_count.setEnabled(self.top_option.itemData(index) is not None)
+
+    def top(self):
+        """Returns (order, count) for a top-N search, or None to show
+        every result"""
+        if (order := self.top_option.currentData()) is None:
+            return None
+        return order, self.top_count.value()
+
+    @Slot(bool)
+    def toggle_use_index(self, checked):
+        self.use_index = checked
+        settings.update_search_index_status(checked)
+
 
 class TransferItemsDialog(QDialog):
 
@@ -345,6 +406,7 @@ class TransferItemsDialog(QDialog):
 
         # Filters
         self.filters = FileFilters(window=self.parent)
+        self.filters.validity_changed.connect(self.filters_validity_changed)
         filters_form = self.filters.setup_form()
 
         self.layout = QVBoxLayout()
@@ -420,6 +482,7 @@ class TransferItemsDialog(QDialog):
             for btn in self.button_box.buttons():
                 if not btn.isEnabled():
                     btn.setEnabled(True)
+            self.filters_validity_changed(self.filters.valid)
 
     def all_locations_deselected(self):
         if self.location_selections:
@@ -436,6 +499,14 @@ class TransferItemsDialog(QDialog):
             has_destination = True
         return not all((has_destination, has_selection))
 
+    @Slot(bool)
+    def filters_validity_changed(self, valid):
+        # A pattern that does not compile cannot be filtered with
+        if self.all_locations_deselected():
+            valid = False
+        self.search_btn.setEnabled(valid)
+        self.recursive_search_btn.setEnabled(valid)
+
     @Slot(bool)
     def toggle_recursive(self):
         self.recursive = False if self.recursive else True
@@ -0,0 +1,426 @@
+"""Shared, cancellable listings of S3-like prefixes.
+
+FetchManager.list_prefix lists a prefix on a bounded pool of threads and
+reports each step to callback(token, event) as a ListingEvent:
+
+    CACHED  the cached listing, to be applied as a diff
+    PAGE    a page of a listing that had no cached copy
+    PAUSED  the requested pages were listed and more remain
+    LISTED  the complete listing; `cached` is True if CACHED came first
+    FRESH   the cached listing was fresh, so nothing else was listed
+    FAILED  the listing failed; entries are empty
+
+Requests for a prefix that is already being listed share that listing
+and get every event sent so far replayed to them. The most recently
+requested listing is started first. Each request returns a FetchToken,
+and a listing stops once every token sharing it has been cancelled.
+
+A request may ask for a number of pages, after which the listing pauses
+until FetchManager.more asks for the next. FetchManager.prefetch lists
+the first page of a prefix nobody has asked for yet, when no requested
+listing is waiting, so an expand can start from it.
+"""
+import collections
+import logging
+import threading
+
+from cirrus import cache, index, settings
+
+
+FETCH_WORKERS = 4
+# Pages listed before a listing pauses: the page shown and one ahead
+INITIAL_PAGES = 2
+# Entries that paused, speculative listings may hold in total
+PREFETCH_BUDGET = 50_000
+# Speculative listings waiting to start. Older ones are dropped first
+PREFETCH_QUEUE = 16
+
+CACHED = 'cached'
+PAGE = 'page'
+PAUSED = 'paused'
+LISTED = 'listed'
+FRESH = 'fresh'
+FAILED = 'failed'
+
+ListingEvent = collections.namedtuple(
+    'ListingEvent',
+    ['kind', 'entries', 'cached']
+)
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def fetch_manager():
+    """Returns the shared FetchManager, creating it on first use"""
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = FetchManager()
+        return _MANAGER
+
+
+class FetchToken:
+    """Cancels one request made through FetchManager.list_prefix"""
+
+    __slots__ = ('job', 'callback', 'cancelled')
+
+    def __init__(self, job, callback):
+        self.job = job
+        self.callback = callback
+        self.cancelled = False
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}('
+            f'key={self.job.key}, cancelled={self.cancelled})'
+        )
+
+    def cancel(self):
+        self.job.unsubscribe(self)
+
+
+class _Job:
+    """One listing of a prefix and the tokens waiting on it.
+
+    `wanted` is the number of pages to list before pausing, or None for
+    every page, and `steps` is the paused listing.
+    """
+
+    __slots__ = (
+        'key',
+        'item',
+        'refresh',
+        'wanted',
+        'speculative',
+        'listed',
+        'size',
+        'steps',
+        'tokens',
+        'events',
+        'cancelled',
+        'lock',
+        'manager',
+    )
+
+    def __init__(
+        self,
+        manager,
+        key,
+        item,
+        *,
+        refresh=False,
+        wanted=None,
+        speculative=False,
+    ):
+        self.manager = manager
+        self.key = key
+        self.item = item
+        self.refresh = refresh
+        self.wanted = wanted
+        self.speculative = speculative
+        self.listed = 0
+        self.size = 0
+        self.steps = None
+        self.tokens = []
+        self.events = []
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def want(self, pages):
+        if self.wanted is not None:
+            self.wanted = None if pages is None else max(self.wanted, pages)
+
+    def subscribe(self, callback, refresh):
+        """Returns a FetchToken for `callback` after replaying the
+        events published so far to it, or None if the job was cancelled
+        """
+        token = FetchToken(self, callback)
+        with self.lock:
+            if self.cancelled:
+                return None
+            self.refresh = self.refresh or refresh
+            self.tokens.append(token)
+            for event in self.events:
+                self.deliver(token, event)
+        return token
+
+    def unsubscribe(self, token):
+        with self.lock:
+            token.cancelled = True
+            if token in self.tokens:
+                self.tokens.remove(token)
+            if not self.tokens:
+                self.cancelled = True
+        if self.cancelled:
+            self.manager.discard(self)
+
+    def publish(self, kind, entries, cached=False, *, replay=True):
+        event = ListingEvent(kind, entries, cached)
+        with self.lock:
+            if replay:
+                self.events.append(event)
+            for token in list(self.tokens):
+                self.deliver(token, event)
+
+    @staticmethod
+    def deliver(token, event):
+        try:
+            token.callback(token, event)
+        except Exception as e:
+            logging.warn(f'Failed to deliver {event.kind} to {token}: {e!r}')
+
+
+class FetchManager:
+    """Lists prefixes on up to `max_workers` threads, newest request
+    first, sharing listings of the same prefix between requests.
+
+    The threads are daemons, like the per-fetch threads they replace, so
+    a listing in flight never holds up closing the app.
+    """
+
+    def __init__(
+        self,
+        max_workers=FETCH_WORKERS,
+        listing_cache=None,
+        *,
+        prefetch_budget=PREFETCH_BUDGET,
+    ):
+        self.cache = listing_cache
+        if self.cache is None:
+            self.cache = cache.listing_cache()
+        self.max_workers = max_workers
+        self.prefetch_budget = prefetch_budget
+        self.workers = 0
+        self.__lock = threading.Lock()
+        # Jobs by key, whether waiting, running, or paused
+        self.__jobs = dict()
+        # Waiting jobs, most recently requested last
+        self.__pending = []
+        # Waiting speculative jobs, started when __pending is empty
+        self.__speculative = []
+        # Paused jobs by key, oldest first
+        self.__paused = dict()
+
+    def list_prefix(self, item, callback, *, refresh=False, pages=None):
+        """Lists the children of the folder `item`, calling
+        callback(FetchToken, ListingEvent) for each step, and returns the
+        FetchToken. Events sent before this request are replayed from
+        the calling thread, the rest come from a worker thread.
+
+        `refresh` skips the freshness check of the cached listing. If
+        `pages` is given, the listing pauses after that many pages unless
+        it has to be complete to revalidate a cached listing
+        """
+        key = (item.endpoint, item.bucket, item.space or '')
+        token = None
+        while token is None:
+            paused = False
+            with self.__lock:
+                job = self.__jobs.get(key)
+                if job is None or job.cancelled:
+                    job = _Job(self, key, item, refresh=refresh, wanted=pages)
+                    self.__jobs[key] = job
+                    self.__pending.append(job)
+                    self.__start_worker()
+                else:
+                    job.want(pages)
+                    job.speculative = False
+                    # Requested again, so it is the most recent request
+                    if self.__paused.get(key) is job:
+                        if job.wanted is None or job.wanted > job.listed:
+                            del self.__paused[key]
+                            self.__pending.append(job)
+                            self.__start_worker()
+                        else:
+                            paused = True
+                    elif job in self.__pending:
+                        self.__pending.remove(job)
+                        self.__pending.append(job)
+                    elif job in self.__speculative:
+                        self.__speculative.remove(job)
+                        self.__pending.append(job)
+            # Replays happen outside of self.__lock, as a callback may
+            # request another listing
+            token = job.subscribe(callback, refresh)
+        if paused:
+            job.deliver(token, ListingEvent(PAUSED, [], False))
+        return token
+
+    def more(self, token, pages=1):
+        """Lists `pages` more pages for `token` if its listing is paused
+        and returns True if it was resumed"""
+        job = token.job
+        with self.__lock:
+            if token.cancelled or self.__paused.get(job.key) is not job:
+                return False
+            job.want(job.listed + pages)
+            del self.__paused[job.key]
+            self.__pending.append(job)
+            self.__start_worker()
+        return True
+
+    def has_more(self, token):
+        """Returns True if the listing of `token` is paused with pages
+        left to list"""
+        with self.__lock:
+            return (
+                not token.cancelled
+                and self.__paused.get(token.job.key) is token.job
+            )
+
+    def prefetch(self, item):
+        """Lists the first page of the folder `item` once no requested
+        listing is waiting, unless it is cached or already listed.
+        Returns True if a listing was queued"""
+        key = (item.endpoint, item.bucket, item.space or '')
+        with self.__lock:
+            if key in self.__jobs:
+                return False
+            job = _Job(self, key, item, wanted=1, speculative=True)
+            self.__jobs[key] = job
+            self.__speculative.append(job)
+            if len(self.__speculative) > PREFETCH_QUEUE:
+                stale = self.__speculative.pop(0)
+                stale.cancelled = True
+                del self.__jobs[stale.key]
+            self.__start_worker()
+        return True
+
+    def discard(self, job):
+        """Forgets the cancelled or finished `job` so it is not started,
+        resumed, or shared"""
+        with self.__lock:
+            if self.__jobs.get(job.key) is job:
+                del self.__jobs[job.key]
+            if self.__paused.get(job.key) is job:
+                del self.__paused[job.key]
+            if job in self.__pending:
+                self.__pending.remove(job)
+            if job in self.__speculative:
+                self.__speculative.remove(job)
+
+    @property
+    def pending(self):
+        with self.__lock:
+            return len(self.__pending) + len(self.__speculative)
+
+    @property
+    def paused(self):
+        with self.__lock:
+            return len(self.__paused)
+
+    def __start_worker(self):
+        # Called with self.__lock held
+        if self.workers < self.max_workers:
+            self.workers += 1
+            threading.Thread(
+                target=self.__work,
+                name=f'fetch-{self.workers}',
+                daemon=True,
+            ).start()
+
+    def __work(self):
+        while True:
+            with self.__lock:
+                if self.__pending:
+                    job = self.__pending.pop()
+                elif self.__speculative:
+                    job = self.__speculative.pop()
+                else:
+                    self.workers -= 1
+                    return
+            self.__run(job)
+
+    def __run(self, job):
+        """Lists pages of `job` until it finishes, is cancelled, or has
+        listed the pages it wants"""
+        if job.steps is None:
+            job.steps = self.__list(job)
+        paused = False
+        try:
+            while True:
+                with self.__lock:
+                    if job.cancelled:
+                        break
+                    if job.wanted is not None and job.listed >= job.wanted:
+                        self.__paused[job.key] = job
+                        paused = True
+                        break
+                next(job.steps)
+        except StopIteration:
+            pass
+        except Exception as e:
+            logging.warn(f'Listing failed for {job.key}: {e!r}')
+            job.publish(FAILED, [])
+        if paused:
+            # Not replayed, as whoever joins next resumes the listing
+            job.publish(PAUSED, [], replay=False)
+            self.__trim()
+            return
+        if job.cancelled:
+            logging.info(f'Cancelled fetch for {job.key}')
+            job.steps.close()
+        self.discard(job)
+
+    def __trim(self):
+        """Drops the oldest paused listings that nobody has requested
+        until they fit in self.prefetch_budget"""
+        with self.__lock:
+            speculative = [
+                job for job in self.__paused.values() if not job.tokens
+            ]
+            held = sum(job.size for job in speculative)
+            for job in speculative:
+                if held <= self.prefetch_budget:
+                    break
+                held -= job.size
+                job.cancelled = True
+                del self.__paused[job.key]
+                del self.__jobs[job.key]
+
+    def __list(self, job):
+        """Lists `job`, yielding before each page after the first"""
+        endpoint, bucket, prefix = job.key
+        if job.speculative:
+            if self.cache.fetched(endpoint, bucket, prefix) is not None:
+                # Expanding it starts from the cache anyway
+                return
+        logging.info(f'Starting fetch for {job.key}')
+        cached = self.cache.get(endpoint, bucket, prefix)
+        if cached is not None:
+            job.publish(CACHED, cached.entries)
+            if not job.refresh and self.cache.fresh(cached):
+                job.publish(FRESH, cached.entries)
+                return
+            # Only a complete listing can be diffed against the cache
+            with self.__lock:
+                job.wanted = None
+        client = job.item.setup_client()
+        client_config = job.item.config.copy()
+        entries = []
+        while True:
+            response = client.list_objects_v2(**client_config)
+            page_start = len(entries)
+            for content in response.get('CommonPrefixes', []):
+                entries.append(cache.entry_from_content(content))
+            for content in response.get('Contents', []):
+                if content['Key'] != prefix:
+                    entries.append(cache.entry_from_content(content))
+            job.listed += 1
+            job.size = len(entries)
+            if cached is None and len(entries) > page_start:
+                job.publish(PAGE, entries[page_start:])
+            if not response.get('IsTruncated'):
+                break
+            client_config['ContinuationToken'] = response[
+                'NextContinuationToken'
+            ]
+            yield
+        self.cache.put(endpoint, bucket, prefix, entries)
+        if settings.search_index_enabled():
+            index.search_index().add_listing(
+                endpoint, f'/{bucket}/{prefix}', entries
+            )
+        job.publish(LISTED, entries, cached is not None)
+        logging.info(f'End fetch for {job.key}')
@@ -0,0 +1,450 @@
+"""Compiles the state of a FileFilters form into a single predicate.
+
+FileFilters.state returns a FilterState of plain values, which
+compile_filters turns into predicate(item) -> bool. Every needle is
+lower-cased and every threshold parsed once, and the conditions run
+cheapest first: size, then dates, then extension and name, so most
+items are rejected before their root is split.
+
+    predicate = compile_filters(dialog.filters.state())
+    results = (item for item in items if predicate(item))
+
+A name or extension needle may hold several comma separated needles,
+e.g., '.jpg, .png, .gif', which are compiled into one set lookup, tuple
+of prefixes or suffixes, or regular expression alternation, so dozens of
+extensions cost one check. MATCHES_GLOB takes comma separated globs and
+MATCHES_REGEX one regular expression, searched for anywhere in the text
+and ignoring case. Names are matched without their extension, except by
+globs and regular expressions, which see the whole file name.
+
+candidates yields the files of a folder that may pass a FilterState,
+listing as little of an S3-like bucket as it can: a name that must start
+with a text narrows the Prefix of a top level listing, and a recursive
+listing skips the prefixes whose cached listings show that none of their
+files can pass.
+
+TopResults keeps only the first `count` results by size or date, in a
+heap, so a search for the largest or newest files holds O(count) results
+however many it scans.
+"""
+import collections
+import datetime
+import fnmatch
+import functools
+import heapq
+import itertools
+import operator
+import os
+import re
+import time
+
+from cirrus import cache
+
+
+CONTAINS = 'contains'
+NOT_CONTAINS = 'not contains'
+EQUALS = 'equals'
+NOT_EQUALS = 'not equals'
+STARTS_WITH = 'starts with'
+ENDS_WITH = 'ends with'
+MATCHES_GLOB = 'matches glob'
+MATCHES_REGEX = 'matches regex'
+# Separates the needles of every option but MATCHES_REGEX
+SEPARATOR = ','
+
+WITHIN_LAST = 'within last'
+BEFORE = 'before'
+AFTER = 'after'
+
+SIZE_OPERATORS = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '=': operator.eq,
+    '>=': operator.ge,
+    '<=': operator.le,
+}
+
+LARGEST = 'largest'
+SMALLEST = 'smallest'
+NEWEST = 'newest'
+OLDEST = 'oldest'
+
+# Most case variants of a name's first characters listed as prefixes
+NAME_PREFIXES = 8
+# Keys per list_objects_v2 request
+PAGE_SIZE = 1_000
+# Seconds the sizes and dates of cached listings are trusted to skip a
+# prefix. Objects are only ever written with a newer date, so a prefix
+# with no file before a date stays that way and needs no such limit
+STATS_FRESH_FOR = 5 * 60
+
+# `name` and `extension` are (option, needle) or None, `ctime` and
+# `mtime` are (option, datetime) or None, and `size` is (operator, bytes)
+# or None
+FilterState = collections.namedtuple(
+    'FilterState',
+    ['name', 'extension', 'ctime', 'mtime', 'size'],
+    defaults=(None, None, None, None, None),
+)
+
+
+def needles(option, needle):
+    """Returns the needles in `needle` for `option`"""
+    if option == MATCHES_REGEX:
+        return [needle]
+    return [part.strip() for part in needle.split(SEPARATOR) if part.strip()]
+
+
+def _text_matcher(option, needle):
+    """Returns match(text) -> bool for `option`, where `text` is already
+    lower-cased. Raises ValueError if `needle` does not compile"""
+    if option == MATCHES_REGEX:
+        try:
+            search = re.compile(needle, re.IGNORECASE).search
+        except re.error as e:
+            raise ValueError(f'Invalid regular expression {needle}: {e}')
+        return lambda text: search(text) is not None
+    parts = [part.lower() for part in needles(option, needle)]
+    if option == MATCHES_GLOB:
+        pattern = '|'.join(fnmatch.translate(part) for part in parts)
+        try:
+            match = re.compile(pattern).match
+        except re.error as e:
+            raise ValueError(f'Invalid glob {needle}: {e}')
+        return lambda text: match(text) is not None
+    if len(parts) == 1:
+        needle = parts[0]
+        if option == CONTAINS:
+            return lambda text: needle in text
+        if option == NOT_CONTAINS:
+            return lambda text: needle not in text
+        if option == EQUALS:
+            return lambda text: text == needle
+        if option == NOT_EQUALS:
+            return lambda text: text != needle
+        if option == STARTS_WITH:
+            return lambda text: text.startswith(needle)
+        if option == ENDS_WITH:
+            return lambda text: text.endswith(needle)
+    elif option in (CONTAINS, NOT_CONTAINS):
+        search = re.compile('|'.join(map(re.escape, parts))).search
+        if option == CONTAINS:
+            return lambda text: search(text) is not None
+        return lambda text: search(text) is None
+    elif option in (EQUALS, NOT_EQUALS):
+        parts = frozenset(parts)
+        if option == EQUALS:
+            return parts.__contains__
+        return lambda text: text not in parts
+    elif option in (STARTS_WITH, ENDS_WITH):
+        parts = tuple(parts)
+        if option == STARTS_WITH:
+            return lambda text: text.startswith(parts)
+        return lambda text: text.endswith(parts)
+    raise ValueError(f'{option} not a valid option')
+
+
+def _timestamp(value):
+    """Returns `value` as epoch seconds, or None if it is not set.
+
+    Naive datetimes, e.g., from os.stat, are taken as local time
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+def _size_check(size):
+    compare, threshold = size
+    if isinstance(compare, str):
+        compare = SIZE_OPERATORS[compare]
+    threshold = int(threshold)
+    return lambda item: compare(item.size, threshold)
+
+
+def _time_check(attribute, time_filter):
+    option, date = time_filter
+    threshold = _timestamp(date)
+    if option in (WITHIN_LAST, AFTER):
+        match = threshold.__le__
+    elif option == BEFORE:
+        match = threshold.__gt__
+    else:
+        raise ValueError(f'{option} not a valid option')
+
+    def check(item):
+        timestamp = _timestamp(getattr(item, attribute))
+        return timestamp is not None and match(timestamp)
+
+    return check
+
+
+def _extension_check(extension):
+    option, needle = extension
+    match = _text_matcher(option, needle)
+    return lambda item: match(os.path.splitext(item.root)[1].lower())
+
+
+def _name_check(name):
+    option, needle = name
+    match = _text_matcher(option, needle)
+    # Patterns may spell out the file type, so they see the whole name
+    whole = option in (MATCHES_GLOB, MATCHES_REGEX)
+
+    def check(item):
+        tail = os.path.basename(item.root.rstrip('/').rstrip('\\')).lower()
+        return match(tail if whole else os.path.splitext(tail)[0])
+
+    return check
+
+
+def compile_filters(state):
+    """Returns predicate(item) -> bool that is True if `item` passes
+    every filter set in the FilterState `state`"""
+    checks = []
+    if state.size is not None:
+        checks.append(_size_check(state.size))
+    if state.mtime is not None:
+        checks.append(_time_check('mtime', state.mtime))
+    if state.ctime is not None:
+        checks.append(_time_check('ctime', state.ctime))
+    if state.extension is not None:
+        checks.append(_extension_check(state.extension))
+    if state.name is not None:
+        checks.append(_name_check(state.name))
+    if not checks:
+        return lambda item: True
+    if len(checks) == 1:
+        return checks[0]
+
+    def predicate(item):
+        for check in checks:
+            if not check(item):
+                return False
+        return True
+
+    return predicate
+
+
+@functools.cache
+def _case_variants():
+    """Returns {ascii character: [(character, whole)]} of every character
+    whose lower case starts with it. `whole` is False if the lower case
+    is longer, e.g., for the dotted capital I"""
+    variants = collections.defaultdict(list)
+    for code in range(0x30000):
+        char = chr(code)
+        lower = char.lower()
+        if lower[0].isascii():
+            variants[lower[0]].append((char, len(lower) == 1))
+    return variants
+
+
+def _case_prefixes(needle, limit):
+    variants = _case_variants()
+    prefixes, ended = [''], []
+    for char in needle.lower():
+        options = variants.get(char) if char.isascii() else None
+        if not options:
+            break
+        if len(prefixes) * len(options) + len(ended) > limit:
+            break
+        grown = []
+        for prefix in prefixes:
+            for option, whole in options:
+                (grown if whole else ended).append(prefix + option)
+        prefixes = grown
+    prefixes.extend(ended)
+    return prefixes
+
+
+def name_prefixes(state, limit=NAME_PREFIXES):
+    """Returns the prefixes that the name of every file passing `state`
+    starts with, in each case, or None if the name may start with
+    anything. At most `limit` prefixes are returned, so only the first
+    few characters are used"""
+    if state.name is None or state.name[0] not in (STARTS_WITH, EQUALS):
+        return None
+    parts = needles(*state.name)
+    if not parts or len(parts) > limit:
+        return None
+    prefixes = set()
+    for part in parts:
+        part_prefixes = _case_prefixes(part, limit // len(parts))
+        if part_prefixes == ['']:
+            return None
+        prefixes.update(part_prefixes)
+    # A prefix that starts with another is already listed under it
+    prefixes = sorted(prefixes)
+    kept = [prefixes[0]]
+    for prefix in prefixes[1:]:
+        if not prefix.startswith(kept[-1]):
+            kept.append(prefix)
+    return kept
+
+
+def _could_match(state, stats, now):
+    """Returns False if no file summed up in the cache.SubtreeStats
+    `stats` can pass `state`"""
+    for time_filter in (state.mtime, state.ctime):
+        if time_filter is None or time_filter[0] != BEFORE:
+            continue
+        threshold = _timestamp(time_filter[1])
+        if stats.fetched >= threshold and (
+            stats.min_mtime is None or stats.min_mtime >= threshold
+        ):
+            return False
+    if now - stats.fetched > STATS_FRESH_FOR:
+        return True
+    if not stats.files:
+        return False
+    if state.size is not None:
+        compare, threshold = state.size
+        if isinstance(compare, str):
+            compare = SIZE_OPERATORS[compare]
+        threshold = int(threshold)
+        low, high = stats.min_size, stats.max_size
+        if compare in (operator.gt, operator.ge):
+            if not compare(high, threshold):
+                return False
+        elif compare in (operator.lt, operator.le):
+            if not compare(low, threshold):
+                return False
+        elif not low <= threshold <= high:
+            return False
+    for time_filter in (state.mtime, state.ctime):
+        if time_filter is None:
+            continue
+        option, date = time_filter
+        threshold = _timestamp(date)
+        if option == BEFORE:
+            if stats.min_mtime is None or stats.min_mtime >= threshold:
+                return False
+        elif stats.max_mtime is None or stats.max_mtime < threshold:
+            return False
+    return True
+
+
+def subtree_pruner(state, stats):
+    """Returns prune(prefix) -> bool, which is True if no file under the
+    prefix can pass `state` according to `stats`, the result of
+    cache.ListingCache.subtree_stats. Returns None if `state` has no
+    size or date filter to prune by"""
+    if state.size is None and state.mtime is None and state.ctime is None:
+        return None
+    now = time.time()
+
+    def prune(prefix):
+        if (prefix_stats := stats.get(prefix)) is None:
+            return False
+        return not _could_match(state, prefix_stats, now)
+
+    return prune
+
+
+def candidates(item, state, *, recursive=True, listing_cache=None):
+    """Yields the files in the folder `item`, and every folder under it
+    if `recursive`, that may pass `state`.
+
+    Local folders are walked as is. The top level of an S3-like folder
+    is only listed under name_prefixes, unless its cached listing shows
+    that listing all of it takes fewer requests, and a recursive listing
+    skips every prefix subtree_pruner prunes
+    """
+    remote = item.type != 'local'
+    if remote and listing_cache is None:
+        listing_cache = cache.listing_cache()
+    if not recursive:
+        prefixes = name_prefixes(state) if remote else None
+        if prefixes is not None:
+            count = listing_cache.count(
+                item.endpoint, item.bucket, item.space or ''
+            )
+            if count is not None and count < len(prefixes) * PAGE_SIZE:
+                prefixes = None
+        if prefixes is None:
+            listings = [item.listdir()]
+        else:
+            listings = (item.listdir(name_prefix=p) for p in prefixes)
+        for listing in listings:
+            for result in listing:
+                if not result.is_dir:
+                    yield result
+        return
+    prune = None
+    if remote:
+        stats = listing_cache.subtree_stats(
+            item.endpoint, item.bucket, item.space or ''
+        )
+        prune = subtree_pruner(state, stats) if stats else None
+    if prune is None:
+        walk = item.walk(flat=True)
+    else:
+        walk = item.walk(flat=True, prune=prune)
+    for _, __, files in walk:
+        yield from files
+
+
+class TopResults:
+    """The first `count` items by `order`, one of LARGEST, SMALLEST,
+    NEWEST, or OLDEST. Items without a date are left out of NEWEST and
+    OLDEST"""
+
+    __slots__ = ('order', 'count', 'heap', 'sequence', 'changed')
+
+    def __init__(self, order, count):
+        if order not in (LARGEST, SMALLEST, NEWEST, OLDEST):
+            raise ValueError(f'{order} not a valid order')
+        self.order = order
+        self.count = count
+        # Min-heap of (key, sequence, item), so the root is the item
+        # dropped first. sequence breaks ties without comparing items
+        self.heap = []
+        self.sequence = itertools.count()
+        self.changed = False
+
+    def __len__(self):
+        return len(self.heap)
+
+    def key(self, item):
+        if self.order == LARGEST:
+            return item.size
+        if self.order == SMALLEST:
+            return -item.size
+        timestamp = _timestamp(item.mtime)
+        if timestamp is None:
+            return None
+        return timestamp if self.order == NEWEST else -timestamp
+
+    def admits(self, item):
+        """Returns False if `item` would not be kept. Safe to call from
+        other threads as a pre-filter, since the heap's root only ever
+        rises"""
+        if (key := self.key(item)) is None:
+            return False
+        heap = self.heap
+        return len(heap) < self.count or key > heap[0][0]
+
+    def add(self, items):
+        """Keeps the items of `items` that are among the first `count`.
+        Returns True if any was kept"""
+        kept = False
+        heap, count = self.heap, self.count
+        for item in items:
+            if (key := self.key(item)) is None:
+                continue
+            if len(heap) < count:
+                heapq.heappush(heap, (key, next(self.sequence), item))
+                kept = True
+            elif key > heap[0][0]:
+                heapq.heapreplace(heap, (key, next(self.sequence), item))
+                kept = True
+        self.changed |= kept
+        return kept
+
+    def results(self):
+        """Returns the items kept, first first"""
+        self.changed = False
+        return [item for *_, item in sorted(self.heap, reverse=True)]
@@ -0,0 +1,563 @@
+"""Persistent index of the files seen by searches and listings.
+
+Each file is stored once per location, the endpoint of an S3-like
+account or 'local', with its path, name, extension, size, and dates.
+Names are also indexed by an FTS5 trigram table, when SQLite has one,
+so "contains" searches do not scan every row.
+
+A folder is covered once every file in it, and under it for recursive
+searches, has been indexed by one complete walk or listing. Searches of
+a covered folder are answered from the index. If the cover is older
+than STALE_AFTER seconds, the answer is still given but the folder is
+walked again in the background, updating the rows that changed and
+dropping those that are gone. Searches of other folders walk them and
+index every file on the way.
+
+Where inotify is available, the INDEX_WATCHES most recently searched
+local folders are watched and every change is written to the index as
+it happens, so their covers do not go stale.
+"""
+import collections
+import datetime
+import logging
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+from cirrus import filters, settings
+from cirrus.watcher import local_watcher
+
+
+# Seconds a folder's cover is used before it is walked again
+STALE_AFTER = 10 * 60
+# Rows written per transaction while a walk is indexed
+WRITE_BATCH = 1_000
+# Local folders kept watched after a search, the least recently searched
+# being unwatched first. The listing panels share the inotify budget
+INDEX_WATCHES = 8
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def search_index():
+    """Returns the shared SearchIndex, creating it on first use"""
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = SearchIndex(watcher=local_watcher())
+        return _INDEX
+
+
+def location_of(item):
+    """Returns the location `item` is indexed under"""
+    return 'local' if item.type == 'local' else item.endpoint
+
+
+def _separator(location):
+    return os.sep if location == 'local' else '/'
+
+
+def _folder_prefix(item):
+    """Returns the path every file under the folder `item` starts with"""
+    sep = _separator(location_of(item))
+    root = item.root.rstrip('/\\')
+    return root + sep
+
+
+class SearchIndex:
+    """SQLite-backed index of files by location and path.
+
+    Every call opens its own connection, so a SearchIndex can be used
+    from any thread.
+    """
+
+    def __init__(self, path=None, *, stale_after=STALE_AFTER, watcher=None):
+        self.path = settings.SEARCH_INDEX if path is None else path
+        self.stale_after = stale_after
+        self.watcher = watcher
+        self.fts = False
+        self.__revalidating = set()
+        # (root, recursive) of the watched folders, oldest search first
+        self.__watched = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.setup()
+        if self.watcher is not None:
+            self.watcher.changed.connect(self.update_local)
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def setup(self):
+        con = self.connect()
+        try:
+            con.execute('PRAGMA journal_mode = WAL')
+            with con:
+                con.execute(
+                    '''CREATE TABLE IF NOT EXISTS files (
+                        pk INTEGER PRIMARY KEY,
+                        location TEXT NOT NULL,
+                        path TEXT NOT NULL,
+                        parent TEXT NOT NULL,
+                        name TEXT NOT NULL,
+                        ext TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        mtime REAL,
+                        ctime REAL,
+                        seen REAL NOT NULL,
+                        UNIQUE (location, path)
+                    )'''
+                )
+                con.execute(
+                    '''CREATE INDEX IF NOT EXISTS files_parent
+                       ON files (location, parent)'''
+                )
+                con.execute(
+                    '''CREATE TABLE IF NOT EXISTS folders (
+                        location TEXT NOT NULL,
+                        path TEXT NOT NULL,
+                        recursive INTEGER NOT NULL,
+                        indexed REAL NOT NULL,
+                        PRIMARY KEY (location, path, recursive)
+                    ) WITHOUT ROWID'''
+                )
+            self.fts = self.__setup_fts(con)
+        except sqlite3.Error as e:
+            logging.warn(f'Search index setup failed: {e}')
+        finally:
+            con.close()
+
+    @staticmethod
+    def __setup_fts(con):
+        try:
+            with con:
+                con.execute(
+                    '''CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(
+                        name,
+                        content='files',
+                        content_rowid='pk',
+                        tokenize='trigram'
+                    )'''
+                )
+                con.execute(
+                    '''CREATE TRIGGER IF NOT EXISTS files_insert
+                       AFTER INSERT ON files BEGIN
+                           INSERT INTO names (rowid, name)
+                           VALUES (new.pk, new.name);
+                       END'''
+                )
+                con.execute(
+                    '''CREATE TRIGGER IF NOT EXISTS files_delete
+                       AFTER DELETE ON files BEGIN
+                           INSERT INTO names (names, rowid, name)
+                           VALUES ('delete', old.pk, old.name);
+                       END'''
+                )
+        except sqlite3.Error as e:
+            logging.info(f'Search index without name index: {e}')
+            return False
+        return True
+
+    # Covers
+
+    def indexed(self, folder, *, recursive):
+        """Returns when the folder `folder` was last covered for a
+        recursive or top level search, or None if it is not"""
+        location = location_of(folder)
+        sep = _separator(location)
+        prefix = _folder_prefix(folder)
+        # A recursive cover of the folder or any folder above it
+        ancestors, end = [], 0
+        while (end := prefix.find(sep, end) + 1) > 0:
+            ancestors.append(prefix[:end])
+        placeholders = ', '.join('?' * len(ancestors))
+        con = self.connect()
+        try:
+            row = con.execute(
+                f'''SELECT MAX(indexed) FROM folders
+                    WHERE location = ? AND (
+                        (recursive AND path IN ({placeholders}))
+                        OR (? AND NOT recursive AND path = ?)
+                    )''',
+                (location, *ancestors, not recursive, prefix)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warn(f'Search index read failed for {prefix}: {e}')
+            return None
+        finally:
+            con.close()
+        return row[0]
+
+    def fresh(self, indexed):
+        return time.time() - indexed < self.stale_after
+
+    def live(self, folder, indexed, *, recursive):
+        """Returns True if every change to `folder` since it was indexed
+        has been written to the index by the watcher"""
+        if self.watcher is None or folder.type != 'local':
+            return False
+        since = self.watcher.live_since(folder.root, recursive=recursive)
+        return since is not None and indexed >= since
+
+    def watch(self, folder, *, recursive):
+        """Watches the local folder `folder` until INDEX_WATCHES other
+        folders have been searched since"""
+        if self.watcher is None or folder.type != 'local':
+            return
+        key = (os.path.abspath(folder.root), recursive)
+        with self.__lock:
+            if key in self.__watched:
+                self.__watched.move_to_end(key)
+                return
+            self.__watched[key] = None
+            released = []
+            while len(self.__watched) > INDEX_WATCHES:
+                released.append(self.__watched.popitem(last=False)[0])
+        for root, root_recursive in released:
+            self.watcher.unwatch(root, recursive=root_recursive)
+        if not self.watcher.watch(folder.root, recursive=recursive):
+            # Nothing is kept of a partial watch, and the next search
+            # tries again
+            with self.__lock:
+                _ = self.__watched.pop(key, None)
+
+    # Searching
+
+    def search(self, folder, state, *, recursive):
+        """Yields the indexed files in `folder` that may pass the
+        filters.FilterState `state`. The sizes, dates, and extension are
+        matched by SQLite and the name is narrowed down by it, so the
+        results still need the compiled predicate"""
+        location = location_of(folder)
+        prefix = _folder_prefix(folder)
+        if recursive:
+            where = ['path >= ?', 'path < ?']
+            params = [prefix, prefix + '\U0010ffff']
+        else:
+            where = ['parent = ?']
+            params = [prefix]
+        self.__narrow(state, where, params)
+        con = self.connect()
+        try:
+            rows = con.execute(
+                f'''SELECT path, size, mtime, ctime FROM files
+                    WHERE location = ? AND {' AND '.join(where)}''',
+                (location, *params)
+            )
+            for path, size, mtime, ctime in rows:
+                yield self.__to_item(folder, path, size, mtime, ctime)
+        except sqlite3.Error as e:
+            logging.warn(f'Search index read failed for {prefix}: {e}')
+        finally:
+            con.close()
+
+    def __narrow(self, state, where, params):
+        if state.size is not None:
+            compare, threshold = state.size
+            where.append(f'size {"==" if compare == "=" else compare} ?')
+            params.append(int(threshold))
+        for column, time_filter in (
+            ('mtime', state.mtime),
+            ('ctime', state.ctime),
+        ):
+            if time_filter is not None:
+                option, date = time_filter
+                where.append(
+                    f'{column} {"<" if option == filters.BEFORE else ">="} ?'
+                )
+                params.append(date.timestamp())
+        if state.extension is not None:
+            option, needle = state.extension
+            extensions = filters.needles(option, needle.lower())
+            if option == filters.EQUALS and extensions:
+                where.append(f'ext IN ({", ".join("?" * len(extensions))})')
+                params.extend(extensions)
+        if state.name is not None:
+            option, needle = state.name
+            # Globs, regular expressions, and several names are matched by
+            # the filters alone
+            if len(parts := filters.needles(option, needle)) != 1:
+                return
+            needle = parts[0]
+            # LIKE and the trigram tokenizer only fold ASCII case
+            if not needle.isascii():
+                return
+            escaped = (
+                needle.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_')
+            )
+            if option == filters.CONTAINS and self.fts and len(needle) >= 3:
+                where.append(
+                    'pk IN (SELECT rowid FROM names WHERE names MATCH ?)'
+                )
+                params.append('"{}"'.format(needle.replace('"', '""')))
+            elif option == filters.CONTAINS:
+                where.append("name LIKE ? ESCAPE '\\'")
+                params.append(f'%{escaped}%')
+            elif option in (filters.EQUALS, filters.STARTS_WITH):
+                where.append("name LIKE ? ESCAPE '\\'")
+                params.append(f'{escaped}%')
+            elif option == filters.ENDS_WITH:
+                where.append("name LIKE ? ESCAPE '\\'")
+                params.append(f'%{escaped}')
+
+    @staticmethod
+    def __to_item(folder, path, size, mtime, ctime):
+        if folder.type == 'local':
+            return folder.create(
+                folder.client,
+                root=path,
+                size=size,
+                mtime=datetime.datetime.fromtimestamp(mtime) if mtime else 0,
+                ctime=datetime.datetime.fromtimestamp(ctime) if ctime else 0,
+            )
+        if mtime:
+            mtime = datetime.datetime.fromtimestamp(
+                mtime, tz=datetime.timezone.utc
+            )
+        client = folder.client.copy()
+        client['Root'] = path
+        return folder.create(client, size=size, mtime=mtime or 0)
+
+    def candidates(self, folder, state, *, recursive=True):
+        """Yields the files in `folder` that may pass `state`, from the
+        index if the folder is covered and otherwise from a walk that is
+        indexed as it goes. A stale cover is revalidated in the
+        background"""
+        # Watched before it is walked, so the walk's cover is live
+        self.watch(folder, recursive=recursive)
+        if (indexed := self.indexed(folder, recursive=recursive)) is None:
+            yield from self.walk(folder, recursive=recursive)
+            return
+        if not self.fresh(indexed) and not self.live(
+            folder, indexed, recursive=recursive
+        ):
+            self.revalidate(folder, recursive=recursive)
+        yield from self.search(folder, state, recursive=recursive)
+
+    # Indexing
+
+    def walk(self, folder, *, recursive=True):
+        """Yields every file in `folder`, indexing each one. The folder is
+        covered once the walk completes"""
+        writer = _Writer(self, folder, recursive=recursive)
+        try:
+            if recursive:
+                for _, __, files in folder.walk(flat=True):
+                    for item in files:
+                        writer.add(item)
+                        yield item
+            else:
+                for item in folder.listdir():
+                    if not item.is_dir:
+                        writer.add(item)
+                        yield item
+        except BaseException:
+            # Stopped or failed, so only what was seen is kept
+            writer.close(complete=False)
+            raise
+        writer.close(complete=True)
+
+    def revalidate(self, folder, *, recursive=True):
+        """Walks `folder` again on a background thread, unless it is
+        already being walked"""
+        key = (location_of(folder), _folder_prefix(folder), recursive)
+        with self.__lock:
+            if key in self.__revalidating:
+                return
+            self.__revalidating.add(key)
+
+        def work():
+            try:
+                for _ in self.walk(folder, recursive=recursive):
+                    pass
+            except Exception as e:
+                logging.warn(f'Revalidating {folder.root} failed: {e!r}')
+            finally:
+                with self.__lock:
+                    self.__revalidating.discard(key)
+
+        threading.Thread(
+            target=work, name='index_revalidate', daemon=True
+        ).start()
+
+    def add_listing(self, location, prefix, entries):
+        """Indexes the files of a listing of the S3-like folder `prefix`,
+        e.g., '/bucket/folder/', as its top level cover. `entries` are
+        cache.Entry objects keyed from the bucket"""
+        bucket = prefix.strip('/').partition('/')[0]
+        seen = time.time()
+        rows = []
+        for entry in entries:
+            if not entry.is_dir:
+                # BaseS3Item uses the mtime as its ctime, and so does row
+                mtime = filters._timestamp(entry.mtime)
+                rows.append(self.__row(
+                    location,
+                    f'/{bucket}/{entry.key}',
+                    entry.size,
+                    mtime,
+                    mtime,
+                    seen,
+                ))
+        con = self.connect()
+        try:
+            with con:
+                self.upsert(con, rows)
+                self.cover(con, location, prefix, False, seen)
+        except sqlite3.Error as e:
+            logging.warn(f'Search index write failed for {prefix}: {e}')
+        finally:
+            con.close()
+
+    def update_local(self, paths):
+        """Writes the current state of the local `paths`, e.g., from
+        LocalWatcher.changed, to the index. Missing paths are dropped
+        with everything under them"""
+        seen = time.time()
+        rows, gone = [], []
+        for path in paths:
+            try:
+                info = os.stat(path)
+            except OSError:
+                gone.append(path)
+                continue
+            if stat.S_ISREG(info.st_mode):
+                rows.append(
+                    self.__row(
+                        'local',
+                        path,
+                        info.st_size,
+                        info.st_mtime,
+                        info.st_ctime,
+                        seen,
+                    )
+                )
+        con = self.connect()
+        try:
+            with con:
+                self.upsert(con, rows)
+                con.executemany(
+                    '''DELETE FROM files
+                       WHERE location = 'local' AND (
+                           path = ? OR (path >= ? AND path < ?)
+                       )''',
+                    [
+                        (path, path + os.sep, path + os.sep + '\U0010ffff')
+                        for path in gone
+                    ]
+                )
+        except sqlite3.Error as e:
+            logging.warn(f'Search index write failed for local changes: {e}')
+        finally:
+            con.close()
+
+    @staticmethod
+    def __row(location, path, size, mtime, ctime, seen):
+        parent, sep, tail = path.rpartition(_separator(location))
+        name, ext = os.path.splitext(tail)
+        return (
+            location,
+            path,
+            parent + sep,
+            name,
+            ext.lower(),
+            size,
+            mtime,
+            ctime,
+            seen,
+        )
+
+    def row(self, location, item, seen):
+        return self.__row(
+            location,
+            item.root,
+            item.size,
+            filters._timestamp(item.mtime),
+            filters._timestamp(item.ctime),
+            seen,
+        )
+
+    @staticmethod
+    def upsert(con, rows):
+        con.executemany(
+            '''INSERT INTO files
+               (location, path, parent, name, ext, size, mtime, ctime, seen)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (location, path) DO UPDATE SET
+                   size = excluded.size,
+                   mtime = excluded.mtime,
+                   ctime = excluded.ctime,
+                   seen = excluded.seen''',
+            rows
+        )
+
+    @staticmethod
+    def cover(con, location, prefix, recursive, seen):
+        """Drops the files under `prefix` not seen since `seen` and marks
+        it covered"""
+        if recursive:
+            con.execute(
+                '''DELETE FROM files
+                   WHERE location = ? AND path >= ? AND path < ?
+                       AND seen < ?''',
+                (location, prefix, prefix + '\U0010ffff', seen)
+            )
+        else:
+            con.execute(
+                '''DELETE FROM files
+                   WHERE location = ? AND parent = ? AND seen < ?''',
+                (location, prefix, seen)
+            )
+        con.execute(
+            '''INSERT OR REPLACE INTO folders
+               (location, path, recursive, indexed) VALUES (?, ?, ?, ?)''',
+            (location, prefix, int(recursive), seen)
+        )
+
+
+class _Writer:
+    """Indexes the files of one walk in batches"""
+
+    __slots__ = ('index', 'location', 'prefix', 'recursive', 'seen', 'rows')
+
+    def __init__(self, index, folder, *, recursive):
+        self.index = index
+        self.location = location_of(folder)
+        self.prefix = _folder_prefix(folder)
+        self.recursive = recursive
+        self.seen = time.time()
+        self.rows = []
+
+    def add(self, item):
+        self.rows.append(self.index.row(self.location, item, self.seen))
+        if len(self.rows) >= WRITE_BATCH:
+            self.flush()
+
+    def flush(self, *, complete=False):
+        con = self.index.connect()
+        try:
+            with con:
+                self.index.upsert(con, self.rows)
+                if complete:
+                    self.index.cover(
+                        con,
+                        self.location,
+                        self.prefix,
+                        self.recursive,
+                        self.seen,
+                    )
+        except sqlite3.Error as e:
+            logging.warn(f'Search index write failed for {self.prefix}: {e}')
+        finally:
+            con.close()
+        self.rows = []
+
+    def close(self, *, complete):
+        """Writes the remaining rows and, if the walk was `complete`,
+        marks the folder covered"""
+        if self.rows or complete:
+            self.flush(complete=complete)
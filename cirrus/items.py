@@ -1,21 +1,29 @@
-import boto3
 import logging
 import mimetypes
 import os
 import shutil
 import threading
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+from functools import partial
 
 from cirrus import utils
 from cirrus.exceptions import CallbackError, ItemIsNotADirectory
 from cirrus.statuses import TransferStatus, TransferPriority
 from cirrus.s3stream import S3StreamingDownload, S3StreamingUpload
 
-import keyring
 
-from botocore.config import Config
-from boto3.s3.transfer import TransferConfig
+# Uploads at least this large are sent in resumable parts
+MULTIPART_THRESHOLD = 8 * utils.files.MB
+MULTIPART_CHUNKSIZE = 8 * utils.files.MB
+MAX_PARTS = 10_000
+# Bytes read from a local file at a time
+READ_SIZE = 1 * utils.files.MB
+# Concurrent prefix listings in BaseS3Item.walk
+WALK_WORKERS = 8
+# Concurrent directory reads in LocalItem.walk
+LOCAL_WALK_WORKERS = 4
 
 
 class TransferItem:
@@ -33,6 +41,8 @@ class TransferItem:
         'started',
         'completed',
         'conflict',
+        'attempts',
+        'error_category',
     )
 
     def __init__(
@@ -48,6 +58,7 @@ class TransferItem:
                 message='Queued',
                 started=None,
                 conflict='skip',
+                attempts=0,
             ):
         self.pk = pk
         self.source = source
@@ -60,6 +71,8 @@ class TransferItem:
         self.priority = priority
         self.completed = None
         self.conflict = conflict
+        self.attempts = attempts
+        self.error_category = None
 
     def __gt__(self, other):
         return self.pk > other.pk
@@ -75,6 +88,7 @@ class TransferItem:
             f'destination="{self.destination}", size={self.size}, '
             f'message="{self.message}", processed={self.processed}, '
             f'priority={self.priority},  status={self.status}, '
+            f'attempts={self.attempts}, '
             f'''started={'"' if self.started else ""}{self.started}'''
             f'''{'"' if self.started else ""}, '''
             f'''completed={'"' if self.completed else ""}{self.completed}'''
@@ -135,8 +149,20 @@ class LocalItem:
 
     __slots__ = ('client', 'root', 'is_dir', 'size', 'mtime', 'ctime')
 
-    def __init__(self, client, *, size=0, is_dir=False, mtime=0, ctime=0):
-        if root := client.get('Root'):
+    def __init__(
+        self,
+        client,
+        *,
+        size=0,
+        is_dir=False,
+        mtime=0,
+        ctime=0,
+        root=None,
+    ):
+        if root is not None:
+            # client is shared with the item that listed this one
+            self.root = root
+        elif root := client.get('Root'):
             self.root = root
         else:
             self.root = os.path.expanduser('~')
@@ -160,17 +186,30 @@ class LocalItem:
         return 'local'
 
     @classmethod
-    def create(cls, client, *, size=0, is_dir=False, mtime=0, ctime=0):
+    def create(
+        cls,
+        client,
+        *,
+        size=0,
+        is_dir=False,
+        mtime=0,
+        ctime=0,
+        root=None,
+    ):
         return cls(
             client,
             size=size,
             is_dir=is_dir,
             mtime=mtime,
             ctime=ctime,
+            root=root,
         )
 
     @property
     def exists(self):
+        return self.object_exists()
+
+    def object_exists(self, client=None):
         try:
             _ = os.stat(self.root)
         except FileNotFoundError:
@@ -186,25 +225,10 @@ class LocalItem:
             raise ItemIsNotADirectory
         if path is None:
             path = self
-        for root, dirs, files in os.walk(path.root):
-            _client = new_client(self.client, root)
-            root_item = self.create(_client, is_dir=True)
-            yield root_item
-            for d in dirs:
-                _client = new_client(self.client, os.path.join(root, d))
-                yield self.create(_client, is_dir=True)
-            for f in files:
-                fname = os.path.join(root, f)
-                _client = new_client(self.client, fname)
-                stat = os.stat(fname)
-                item = self.create(
-                    _client,
-                    size=stat.st_size,
-                    mtime=datetime.fromtimestamp(stat.st_mtime),
-                    ctime=datetime.fromtimestamp(stat.st_ctime),
-                )
-                yield item
-            return
+        root_item, dirs, files, _ = self.__scan(path)
+        yield root_item
+        yield from dirs
+        yield from files
 
     def makedirs(self, exist_ok=True):
         if not self.is_dir:
@@ -214,50 +238,142 @@ class LocalItem:
         except Exception as e:
             raise e
 
-    def walk(self, path=None):
+    def walk(self, path=None, flat=False, workers=LOCAL_WALK_WORKERS):
+        """Yields (root, dirs, files) for every directory under `path`.
+
+        Directories are read with os.scandir, so each file is stat'd at
+        most once. If `workers` is more than 1, that many directories are
+        read concurrently and each is yielded as soon as it is read. dirs
+        is left empty if `flat` is True, as BaseS3Item.walk does.
+        """
         if not self.is_dir:
             raise ItemIsNotADirectory
         if path is None:
             path = self
-        for root, dirs, files in os.walk(path.root):
-            _client = new_client(self.client, root)
-            root_item = self.create(_client, is_dir=True)
-            dir_items = []
-            for d in dirs:
-                _client = new_client(self.client, os.path.join(root, d))
-                dir_items.append(self.create(_client, is_dir=True))
-            file_items = []
-            for f in files:
-                fname = os.path.join(root, f)
-                if os.path.isfile(fname):
-                    _client = new_client(self.client, fname)
-                    stat = os.stat(fname)
-                    item = self.create(
-                        _client,
-                        size=stat.st_size,
-                        mtime=datetime.fromtimestamp(stat.st_mtime),
-                        ctime=datetime.fromtimestamp(stat.st_ctime),
-                    )
-                    file_items.append(item)
-            yield root_item, dir_items, file_items
+        if workers > 1:
+            walker = parallel_walk(
+                self.__scan, path, workers=workers, name='local_walk'
+            )
+        else:
+            walker = self.__walk(path)
+        for root_item, dirs, files in walker:
+            yield root_item, [] if flat else dirs, files
+
+    def __walk(self, path):
+        pending = [path]
+        while pending:
+            root_item, dirs, files, children = self.__scan(pending.pop())
+            yield root_item, dirs, files
+            pending.extend(reversed(children))
+
+    def __scan(self, path):
+        """Returns (path, dirs, files, children) for the entries directly
+        in `path`, where children are the dirs to descend into.
+
+        Symlinked directories are listed in dirs but not followed, like
+        os.walk. Unreadable directories are returned empty.
+        """
+        dirs, files, children = [], [], []
+        try:
+            scanner = os.scandir(path.root)
+        except OSError:
+            return path, dirs, files, children
+        with scanner:
+            for entry in scanner:
+                try:
+                    if entry.is_dir():
+                        item = self.create(
+                            self.client, is_dir=True, root=entry.path
+                        )
+                        dirs.append(item)
+                        if not entry.is_symlink():
+                            children.append(item)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files.append(
+                            self.create(
+                                self.client,
+                                size=stat.st_size,
+                                mtime=datetime.fromtimestamp(stat.st_mtime),
+                                ctime=datetime.fromtimestamp(stat.st_ctime),
+                                root=entry.path,
+                            )
+                        )
+                except OSError:
+                    # Removed or unreadable since it was listed
+                    continue
+        return path, dirs, files, children
 
-    def upload(self, callback=None, buffer_size=4096):
+    def resume_offset(self, checkpoint):
+        """Returns the byte offset a checkpointed upload can resume from.
+
+        The checkpoint is reset if the partially written file is missing
+        or shorter than the recorded offset.
+        """
+        if not checkpoint.offset or checkpoint.target != self.root:
+            return 0
         try:
-            written_amount = 0
+            written = os.stat(self.root).st_size
+        except FileNotFoundError:
+            written = 0
+        if written < checkpoint.offset:
+            logging.info(f'Cannot resume {self.root} from {checkpoint!r}')
+            return 0
+        return checkpoint.offset
+
+    def upload(
+        self,
+        callback=None,
+        buffer_size=4096,
+        checkpoint=None,
+        checkpoint_size=8 * utils.files.MB,
+    ):
+        """Generator that writes the sent chunks to self.root.
+
+        The first value yielded is the offset the source should be read
+        from, which is only non-zero when resuming from `checkpoint`.
+        Send None to flush the remaining buffer.
+        """
+        try:
+            offset = 0
+            if checkpoint is not None:
+                checkpoint.resumable = True
+                offset = self.resume_offset(checkpoint)
+            written_amount = offset
             data = b''
             os.makedirs(os.path.dirname(self.root), exist_ok=True)
-            with open(self.root, 'wb') as f:
-                while True:
-                    chunk = yield written_amount
-                    if chunk is None:
-                        written_amount = f.write(data)
-                    else:
-                        data += chunk
-                        if len(data) >= buffer_size:
+            with open(self.root, 'r+b' if offset else 'wb') as f:
+                if offset:
+                    f.truncate(offset)
+                    f.seek(offset)
+                elif checkpoint is not None:
+                    checkpoint.begin(self.root)
+                last_checkpoint = offset
+                try:
+                    while True:
+                        chunk = yield written_amount
+                        if chunk is None:
                             written_amount = f.write(data)
                             data = b''
                         else:
-                            written_amount = 0
+                            data += chunk
+                            if len(data) >= buffer_size:
+                                written_amount = f.write(data)
+                                data = b''
+                            else:
+                                written_amount = 0
+                        if checkpoint is not None:
+                            if f.tell() - last_checkpoint >= checkpoint_size:
+                                f.flush()
+                                last_checkpoint = f.tell()
+                                checkpoint.update_offset(last_checkpoint)
+                finally:
+                    if checkpoint is not None:
+                        if data:
+                            f.write(data)
+                        f.flush()
+                        if f.tell() != last_checkpoint:
+                            checkpoint.update_offset(f.tell())
         except GeneratorExit:
             if callback:
                 try:
@@ -302,10 +418,27 @@ class LocalItem:
             else:
                 logging.info(response)
 
-    def download(self, callback=None):
+    def read(self, client=None):
+        """Returns the entire contents of self.root. Only meant for
+        small files
+        """
+        with open(self.root, 'rb') as f:
+            return f.read()
+
+    def write(self, data, client=None):
+        """Writes `data` to self.root in one call and returns the number
+        of bytes written. Only meant for small files
+        """
+        os.makedirs(os.path.dirname(self.root), exist_ok=True)
+        with open(self.root, 'wb') as f:
+            return f.write(data)
+
+    def download(self, callback=None, offset=0):
         try:
             with open(self.root, 'rb') as f:
-                for chunk in f:
+                if offset:
+                    f.seek(offset)
+                while chunk := f.read(READ_SIZE):
                     yield chunk
         except Exception as e:
             raise e
@@ -352,6 +485,12 @@ class BaseS3Item:
     def setup_client(self, *args, **kwargs):
         raise NotImplementedError('Must be specified in sub-class')
 
+    @property
+    def endpoint(self):
+        """The host the bucket is served from, used to key cached
+        listings"""
+        raise NotImplementedError('Must be specified in sub-class')
+
     @classmethod
     def create(
         cls,
@@ -408,7 +547,11 @@ class BaseS3Item:
 
     @property
     def exists(self):
-        client = self.setup_client()
+        return self.object_exists()
+
+    def object_exists(self, client=None):
+        if client is None:
+            client = self.setup_client()
         try:
             # client.get_object_attributes was returning hex data?
             _ = client.get_object(Bucket=self.bucket, Key=self.key)
@@ -434,32 +577,159 @@ class BaseS3Item:
             logging.warn(response)
             raise e
 
-    def walk(self, root=None, topdown=True):
+    def walk(
+        self,
+        root=None,
+        topdown=True,
+        workers=WALK_WORKERS,
+        flat=False,
+        prune=None,
+    ):
+        """Yields (root, dirs, files) for every prefix under `root`.
+
+        Up to `workers` prefixes are listed concurrently with one shared
+        client and each listing is yielded as soon as it completes, so a
+        prefix is always yielded before its sub-prefixes but siblings may
+        arrive in any order. workers=1 walks depth-first in order.
+
+        If `flat` is True, every key under `root` is listed without a
+        delimiter, 1,000 keys per request, instead of one request per
+        prefix. Consecutive keys are grouped by their parent, dirs is
+        always empty, and a root may be yielded more than once. Use it
+        when only the files are needed.
+
+        If given, prune(prefix) -> bool is called with the prefix, e.g.,
+        'folder/sub/', of each folder found, and the keys under the
+        folders it returns True for are skipped. A flat walk skips them
+        by starting the next request after the folder.
+        """
         if not self.is_dir:
             raise ItemIsNotADirectory
         if root is None:
             root = self
         client = self.setup_client()
-        yield from self.__walk(client=client, path=root, topdown=topdown)
+        if flat:
+            yield from self.__flat_walk(client=client, path=root, prune=prune)
+        elif workers > 1:
+            yield from parallel_walk(
+                partial(self.__list_path, client, prune=prune),
+                root,
+                workers=workers,
+                name='s3_walk',
+            )
+        else:
+            yield from self.__walk(
+                client=client, path=root, topdown=topdown, prune=prune
+            )
+
+    def __walk(self, *, client, path, topdown=True, prune=None):
+        _, dirs, files, children = self.__list_path(client, path, prune)
+        yield path, dirs, files
+        for child in children:
+            yield from self.__walk(
+                client=client, path=child, topdown=topdown, prune=prune
+            )
 
-    def __walk(self, *, client, path, topdown=True):
+    def __flat_walk(self, *, client, path, prune=None):
+        bucket, *space = path.root.strip('/').split('/')
+        space = '/'.join(space)
+        config = {'Bucket': bucket, 'MaxKeys': 1_000}
+        if space:
+            config['Prefix'] = space.rstrip('/') + '/'
+        top_parent = config.get('Prefix', '').rstrip('/')
+        if prune is not None and prune(config.get('Prefix', '')):
+            yield path, [], []
+            return
+        parent, files = top_parent, []
+        yielded = False
+        # Whether each folder seen is pruned, and the one being skipped
+        pruned, skipped = dict(), None
+        while True:
+            response = client.list_objects_v2(**config)
+            contents = response.get('Contents', [])
+            for content in contents:
+                key = content['Key']
+                if skipped is not None and key.startswith(skipped):
+                    continue
+                if key.endswith('/'):
+                    # Folder placeholder created by makedirs
+                    continue
+                key_parent = key.rpartition('/')[0]
+                if key_parent != parent:
+                    if prune is not None:
+                        skipped = self.__pruned_folder(
+                            prune, pruned, top_parent, key_parent
+                        )
+                        if skipped is not None:
+                            continue
+                    if files or (not yielded and parent == top_parent):
+                        yield self.__flat_root(path, bucket, parent), [], files
+                        yielded = True
+                    parent, files = key_parent, []
+                files.append(
+                    self.create(
+                        new_client(self.client, f'{bucket}/{key}'),
+                        size=content.get('Size', 0),
+                        mtime=content.get('LastModified', 0),
+                    )
+                )
+            if not response.get('IsTruncated'):
+                break
+            if skipped is not None and contents[-1]['Key'].startswith(skipped):
+                # Jumps past the rest of the skipped folder, which may
+                # take any number of pages
+                config.pop('ContinuationToken', None)
+                config['StartAfter'] = skipped + '\U0010ffff'
+            else:
+                config['ContinuationToken'] = response[
+                    'NextContinuationToken'
+                ]
+        if files or not yielded:
+            yield self.__flat_root(path, bucket, parent), [], files
+
+    @staticmethod
+    def __pruned_folder(prune, pruned, top_parent, key_parent):
+        """Returns the outermost folder between `top_parent` and
+        `key_parent` that prune returns True for, or None. Results are
+        kept in `pruned`"""
+        folder = top_parent
+        for name in key_parent[len(top_parent):].strip('/').split('/'):
+            folder = f'{folder}/{name}' if folder else name
+            prefix = folder + '/'
+            if prefix not in pruned:
+                pruned[prefix] = prune(prefix)
+            if pruned[prefix]:
+                return prefix
+        return None
+
+    def __flat_root(self, path, bucket, parent):
+        if parent == path.root.strip('/').partition('/')[2].rstrip('/'):
+            return path
+        _client = new_client(self.client, f'/{bucket}/{parent}/')
+        return self.create(_client, is_dir=True)
+
+    def __list_path(self, client, path, prune=None):
         dirs, files = [], []
         for item in self.listdir(client=client, path=path.root.lstrip('/')):
             if item.is_dir:
                 dirs.append(item)
             else:
                 files.append(item)
-        yield path, dirs, files
-        for dir_item in dirs:
-            dir_name = dir_item.root.strip('/').split('/')[-1]
-            out_path = f'{path.root.rstrip("/")}/{dir_name}/'
-            _client = new_client(self.client, out_path)
-            out_item = self.create(_client, is_dir=True)
-            yield from self.__walk(
-                client=client, path=out_item, topdown=topdown
-            )
-
-    def listdir(self, *, client=None, path=None):
+        children = [self.__child_dir(path, dir_item) for dir_item in dirs]
+        if prune is not None:
+            children = [child for child in children if not prune(child.space)]
+        return path, dirs, files, children
+
+    def __child_dir(self, path, dir_item):
+        dir_name = dir_item.root.strip('/').split('/')[-1]
+        out_path = f'{path.root.rstrip("/")}/{dir_name}/'
+        _client = new_client(self.client, out_path)
+        return self.create(_client, is_dir=True)
+
+    def listdir(self, *, client=None, path=None, name_prefix=None):
+        """Yields the folders and files directly in `path`, or in this
+        folder. If `name_prefix` is given, only names starting with it
+        are listed"""
         if not self.is_dir:
             raise ItemIsNotADirectory
         if client is None:
@@ -477,6 +747,10 @@ class BaseS3Item:
             del client_config['Prefix']
         elif space != client_config.get('Prefix'):
             client_config['Prefix'] = space.rstrip('/') + '/'
+        if name_prefix:
+            client_config['Prefix'] = (
+                client_config.get('Prefix', '') + name_prefix
+            )
         response = client.list_objects_v2(**client_config)
         for content in response.get('CommonPrefixes', []):
             yield self.create_from_content(
@@ -500,7 +774,7 @@ class BaseS3Item:
                     self.client, bucket=bucket, content=content
                 )
 
-    def upload(self, callback=None, buffer_size=4096):
+    def upload_args(self):
         c_type, _ = mimetypes.guess_type(self.key)
         if c_type is None:
             c_type = 'application/octet-stream'
@@ -508,10 +782,32 @@ class BaseS3Item:
                 (f'No guessable ContenType found for {self.key}. '
                  'Using "application/octet-stream" instead.')
             )
-        extra_args = {
+        return {
             'ACL': 'public-read',
             'ContentType': c_type,
         }
+
+    def upload(self, callback=None, buffer_size=4096, checkpoint=None):
+        """Generator that uploads the sent chunks to self.key.
+
+        The first value yielded is the offset the source should be read
+        from, which is only non-zero when resuming from `checkpoint`.
+        Send None to complete the upload.
+
+        Files of at least MULTIPART_THRESHOLD bytes with a `checkpoint`
+        are uploaded part by part so the upload can be resumed.
+        """
+        extra_args = self.upload_args()
+        if checkpoint is not None and self.size >= MULTIPART_THRESHOLD:
+            try:
+                yield from self.__multipart_upload(checkpoint, extra_args)
+            except GeneratorExit:
+                if callback:
+                    try:
+                        callback()
+                    except CallbackError as e:
+                        raise CallbackError('Callback failed') from e
+            return
         file_obj = S3StreamingUpload(self.size)
         t = threading.Thread(
             target=self.__upload,
@@ -556,6 +852,7 @@ class BaseS3Item:
 
     def __upload(self, file_obj, extra_args):
         client = self.setup_client()
+        from boto3.s3.transfer import TransferConfig
         transfer_config = TransferConfig(use_threads=False)
         try:
             client.upload_fileobj(
@@ -571,6 +868,126 @@ class BaseS3Item:
             logging.info(f'Error in __upload: {str(e)}')
             file_obj.error = e
 
+    def resume_upload_id(self, client, checkpoint):
+        """Returns the checkpoint's UploadId if the multipart upload still
+        exists; else, None.
+
+        Only the leading parts that S3 still has are kept in the checkpoint.
+        """
+        if not checkpoint.upload_id or checkpoint.target != self.root:
+            return
+        uploaded = dict()
+        config = {
+            'Bucket': self.bucket,
+            'Key': self.key,
+            'UploadId': checkpoint.upload_id,
+        }
+        try:
+            while True:
+                response = client.list_parts(**config)
+                for part in response.get('Parts', []):
+                    uploaded[part['PartNumber']] = part['ETag']
+                if not response.get('IsTruncated'):
+                    break
+                config['PartNumberMarker'] = response['NextPartNumberMarker']
+        except client.exceptions.NoSuchUpload:
+            logging.info(f'Cannot resume {self.root} from {checkpoint!r}')
+            # Nothing is left on S3 to abort
+            checkpoint.upload_id = None
+            return
+        count = 0
+        for part_number, etag, _ in checkpoint.parts:
+            if uploaded.get(part_number) != etag:
+                break
+            count += 1
+        checkpoint.keep_parts(count)
+        return checkpoint.upload_id
+
+    def __multipart_upload(self, checkpoint, extra_args):
+        client = self.setup_client()
+        part_size = max(MULTIPART_CHUNKSIZE, -(-self.size // MAX_PARTS))
+        upload_id = self.resume_upload_id(client, checkpoint)
+        if upload_id is None and checkpoint.upload_id:
+            # The checkpointed upload is of another target. If it cannot be
+            # aborted now, begin leaves it to be aborted later
+            previous = self.create(new_client(self.client, checkpoint.target))
+            if previous.abort_upload(checkpoint.upload_id, client=client):
+                checkpoint.upload_id = None
+        if upload_id is None:
+            response = client.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                **extra_args,
+            )
+            upload_id = response['UploadId']
+            checkpoint.begin(self.root, upload_id=upload_id)
+        checkpoint.resumable = True
+        part_number = len(checkpoint.parts) + 1
+        written_amount = checkpoint.offset
+        # Appended to in place, as the chunks may be as small as a line
+        data = bytearray()
+        completed = False
+        while True:
+            chunk = yield written_amount
+            if completed:
+                written_amount = 0
+                continue
+            if chunk is None:
+                written_amount = 0
+            else:
+                data += chunk
+                written_amount = len(chunk)
+            start = 0
+            while (
+                len(data) - start >= part_size
+                or (chunk is None and start < len(data))
+            ):
+                with memoryview(data) as view:
+                    body = bytes(view[start:start + part_size])
+                response = client.upload_part(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body,
+                )
+                checkpoint.add_part(part_number, response['ETag'], len(body))
+                part_number += 1
+                start += len(body)
+            if start:
+                del data[:start]
+            if chunk is None:
+                client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=upload_id,
+                    MultipartUpload={
+                        'Parts': [
+                            {'ETag': etag, 'PartNumber': number}
+                            for number, etag, _ in checkpoint.parts
+                        ]
+                    },
+                )
+                completed = True
+
+    def abort_upload(self, upload_id, client=None):
+        """Aborts the multipart upload `upload_id` to self.key so its parts
+        are deleted. Returns False if it could not be aborted"""
+        if client is None:
+            client = self.setup_client()
+        try:
+            client.abort_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=upload_id,
+            )
+        except client.exceptions.NoSuchUpload:
+            pass
+        except Exception as e:
+            logging.warn(f'Failed to abort the upload to {self.root}: {e!r}')
+            return False
+        return True
+
     def remove(self, callback=None):
         client = self.setup_client()
         try:
@@ -593,7 +1010,42 @@ class BaseS3Item:
         else:
             logging.info(f'{response!r}')
 
-    def download(self, callback=None):
+    def read(self, client=None):
+        """Returns the entire object in one request. Only meant for
+        small objects
+        """
+        if client is None:
+            client = self.setup_client()
+        response = client.get_object(Bucket=self.bucket, Key=self.key)
+        body = response['Body']
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def write(self, data, client=None):
+        """Puts `data` to self.key in one request and returns the number
+        of bytes written. Only meant for small objects
+        """
+        if client is None:
+            client = self.setup_client()
+        client.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=data,
+            **self.upload_args(),
+        )
+        return len(data)
+
+    def download(self, callback=None, offset=0):
+        if offset:
+            yield from self.__ranged_download(offset)
+            if callback:
+                try:
+                    callback()
+                except CallbackError as e:
+                    raise CallbackError('Callback failed') from e
+            return
         file_obj = S3StreamingDownload(self.size)
         t = threading.Thread(
             target=self.__download,
@@ -616,6 +1068,7 @@ class BaseS3Item:
 
     def __download(self, file_obj):
         client = self.setup_client()
+        from boto3.s3.transfer import TransferConfig
         transfer_config = TransferConfig(use_threads=False)
         try:
             client.download_fileobj(
@@ -629,6 +1082,19 @@ class BaseS3Item:
             logging.info(f'Error in __download: {str(e)}')
             file_obj.error = e
 
+    def __ranged_download(self, offset, chunk_size=1024 * 1024):
+        client = self.setup_client()
+        response = client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f'bytes={offset}-',
+        )
+        body = response['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
 
 class S3Item(BaseS3Item):
 
@@ -647,10 +1113,11 @@ class S3Item(BaseS3Item):
     def type(self):
         return 's3'
 
+    @property
+    def endpoint(self):
+        return f's3.{self.client["Region"]}.amazonaws.com'
+
     def setup_client(self, max_keys=1_000):
-        retry_config = Config(
-            retries={'max_attempts': 10, 'mode': 'standard'}
-        )
         self.config = {
                 'Bucket': self.bucket,
                 'MaxKeys': max_keys,
@@ -658,15 +1125,12 @@ class S3Item(BaseS3Item):
             }
         if self.space is not None:
             self.config['Prefix'] = self.space
-        session = boto3.session.Session()
-        return session.client(
+        return new_session().client(
                 's3',
                 region_name=self.client['Region'],
                 aws_access_key_id=self.client['Access Key'],
-                aws_secret_access_key=keyring.get_password(
-                    'system', f'_s3_{self.client["Access Key"]}_secret_key'
-                ),
-                config=retry_config,
+                aws_secret_access_key=secret_key(self.client['Access Key']),
+                config=retry_config(),
             )
 
 
@@ -687,10 +1151,11 @@ class DigitalOceanItem(BaseS3Item):
     def type(self):
         return 'digital ocean'
 
+    @property
+    def endpoint(self):
+        return self.client['Endpoint URL']
+
     def setup_client(self, max_keys=1_000):
-        retry_config = Config(
-            retries={'max_attempts': 10, 'mode': 'standard'}
-        )
         self.config = {
                 'Bucket': self.bucket,
                 'MaxKeys': max_keys,
@@ -698,19 +1163,65 @@ class DigitalOceanItem(BaseS3Item):
             }
         if self.space is not None:
             self.config['Prefix'] = self.space
-        session = boto3.session.Session()
-        return session.client(
+        return new_session().client(
                 's3',
                 region_name=self.client['Region'],
                 endpoint_url=self.client['Endpoint URL'],
                 aws_access_key_id=self.client['Access Key'],
-                aws_secret_access_key=keyring.get_password(
-                    'system', f'_s3_{self.client["Access Key"]}_secret_key'
-                ),
-                config=retry_config,
+                aws_secret_access_key=secret_key(self.client['Access Key']),
+                config=retry_config(),
             )
 
 
+# boto3, botocore, and keyring are slow to import and are not needed
+# by local-only transfers, so they are imported on first use
+
+
+def new_session():
+    import boto3
+    return boto3.session.Session()
+
+
+def retry_config():
+    from botocore.config import Config
+    return Config(retries={'max_attempts': 10, 'mode': 'standard'})
+
+
+def secret_key(access_key):
+    import keyring
+    return keyring.get_password('system', f'_s3_{access_key}_secret_key')
+
+
+def set_secret_key(access_key, secret):
+    import keyring
+    keyring.set_password('system', f'_s3_{access_key}_secret_key', secret)
+
+
+def parallel_walk(scan, path, *, workers, name='walk'):
+    """Yields (root, dirs, files) for `path` and everything below it.
+
+    scan(item) must return (item, dirs, files, children), where children
+    are the items to scan next. Up to `workers` scans run at once and
+    each is yielded as soon as it completes, so a root always comes
+    before its children but siblings may arrive in any order.
+    """
+    # Popping from the end keeps the frontier small for wide trees
+    pending = [path]
+    running = set()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                running.add(pool.submit(scan, pending.pop()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                root, dirs, files, children = future.result()
+                yield root, dirs, files
+                pending.extend(reversed(children))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 def new_client(client, root):
     _client = client.copy()
     _client['Root'] = root
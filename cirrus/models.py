@@ -1,23 +1,29 @@
+import collections
+import datetime
 import logging
-import threading
 import os
 
-from cirrus import database, settings, utils
+from array import array
+from functools import partial
+
+from cirrus import cache, database, fetcher, filters, settings, utils
 from cirrus.items import DigitalOceanItem, LocalItem, S3Item
 from cirrus.statuses import TransferPriority, TransferStatus
 
 from PySide6.QtCore import (
+    QAbstractItemModel,
     QAbstractListModel,
     QAbstractTableModel,
     QByteArray,
+    QDir,
     QMimeData,
     QModelIndex,
     Qt,
+    QTimer,
     QUrl,
     Signal,
     Slot,
 )
-from PySide6.QtGui import QStandardItemModel, QStandardItem
 from PySide6.QtSql import (
     QSqlDatabase,
     QSqlQuery,
@@ -457,6 +463,25 @@ class LocalFileSystemModel(QFileSystemModel):
     def __init__(self, parent=None):
         super().__init__(parent)
 
+    def refresh_directories(self, paths):
+        """Lists each loaded folder in `paths` again, which inserts,
+        removes, and updates only the rows that changed.
+
+        QFileSystemModel only lists a loaded folder again once it has
+        stopped being the root path, so each is made the root path in
+        turn before the root path is restored.
+        """
+        root = self.rootPath()
+        switched = [path for path in paths if path != root]
+        if len(switched) < len(paths):
+            parent = os.path.dirname(root)
+            switched.append(parent if parent != root else QDir.homePath())
+        for path in switched:
+            self.setRootPath(path)
+        self.setRootPath(root)
+        for path in paths:
+            self.fetchMore(self.index(path))
+
     @Slot(list)
     def remove_rows(self, items):
         for item in items:
@@ -485,32 +510,277 @@ class LocalFileSystemModel(QFileSystemModel):
             )
 
 
-class BaseS3FilesTreeModel(QStandardItemModel):
-    new_folder_item = Signal(object, str, dict)
-    new_file_item = Signal(object, tuple, dict)
-    all_items_loaded = Signal(object)
-    no_children = Signal(object)
-    loading_row = Signal(QStandardItem)
+class _ListingNode:
+    """The rows listed under one prefix of a BaseS3FilesTreeModel.
+
+    Rows are stored column-wise: names, sizes and mtimes (epoch seconds)
+    are parallel arrays and is_dir is one byte per row. Only the rows
+    that have been expanded get a child _ListingNode. `pending` holds
+    listed entries that have not been inserted yet and `token` is the
+    fetcher.FetchToken of the latest listing.
+    """
+
+    __slots__ = (
+        'pk',
+        'parent',
+        'root',
+        'row',
+        'names',
+        'sizes',
+        'mtimes',
+        'dirs',
+        'children',
+        'pending',
+        'token',
+        'placeholder',
+        'collapsed',
+        'removed',
+    )
+
+    def __init__(self, pk, root, *, parent=None, row=0):
+        self.pk = pk
+        self.parent = parent
+        self.root = root
+        self.row = row
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.dirs = bytearray()
+        self.children = dict()
+        self.pending = []
+        self.token = None
+        self.placeholder = None
+        self.collapsed = parent is not None
+        self.removed = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def relative(self, row):
+        """Returns the row's path relative to self.root. Folders end in
+        '/' so a folder and a file may share a name"""
+        return self.names[row] + ('/' if self.dirs[row] else '')
+
+
+class BaseS3FilesTreeModel(QAbstractItemModel):
+    """Tree model of an S3-like bucket that stores each listed key as a
+    few array entries rather than QStandardItems.
+
+    S3Items are only created on demand through item_from_index.
+    """
+    # Every signal carries the node and the FetchToken of its listing so
+    # events queued before a node was fetched again are ignored
+    new_rows = Signal(object, object, str, list)
+    all_items_loaded = Signal(object, object)
+    no_children = Signal(object, object)
+    listing_loaded = Signal(object, object, str, list)
+    item_class = None
+    headers = ('Name', 'Size', 'Last Modified')
+    FETCHING = 'Fetching...'
+    EMPTY = '(Empty)'
+
+    # index, flags, and hasChildren run per row whenever the view lays
+    # out, so they avoid anything but list lookups
+    DIR_FLAGS = (
+        Qt.ItemIsSelectable
+        | Qt.ItemIsEnabled
+        | Qt.ItemIsDragEnabled
+        | Qt.ItemIsDropEnabled
+    )
+    FILE_FLAGS = DIR_FLAGS | Qt.ItemNeverHasChildren
+    PLACEHOLDER_FLAGS = Qt.ItemIsEnabled | Qt.ItemNeverHasChildren
+    ROOT_FLAGS = Qt.ItemIsDropEnabled
 
-    def __init__(self, parent=None):
+    def __init__(self, *, client, parent=None, max_keys=1_000):
         super().__init__(parent)
         self._stopped = False
+        self.client = client.copy()
+        self.max_keys = max_keys
+        self.cache = cache.listing_cache()
+        self.fetcher = fetcher.fetch_manager()
+        # Rows listed later are inserted where this sort puts them
+        self.sort_column = 0
+        self.sort_order = Qt.AscendingOrder
+        # Queued, as replayed listings are sent from fetch_children
+        # before the node's token is set
+        self.new_rows.connect(self.insert_rows, Qt.QueuedConnection)
+        self.listing_loaded.connect(self.apply_listing, Qt.QueuedConnection)
+        self.all_items_loaded.connect(
+            self.remove_loading_row, Qt.QueuedConnection
+        )
+        self.no_children.connect(self.no_items_found, Qt.QueuedConnection)
+        root_item = self.item_class(self.client, is_dir=True)
+        self.__nodes = dict()
+        self.__next_pk = 0
+        self.root_node = self.__new_node(
+            f'/{root_item.bucket}/{root_item.space or ""}'
+        )
+        self.fetch_children(root_item)
+
+    def __new_node(self, root, *, parent=None, row=0):
+        node = _ListingNode(self.__next_pk, root, parent=parent, row=row)
+        self.__nodes[node.pk] = node
+        self.__next_pk += 1
+        return node
+
+    def __drop_node(self, node):
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            node.removed = True
+            if node.token is not None:
+                node.token.cancel()
+            _ = self.__nodes.pop(node.pk, None)
+            pending.extend(node.children.values())
+
+    def node_from_index(self, index):
+        """Returns the _ListingNode holding the rows under `index`, or
+        None if the folder has not been expanded"""
+        if not index.isValid():
+            return self.root_node
+        parent = self.__nodes.get(index.internalId())
+        if parent is None or index.row() >= len(parent):
+            return None
+        return parent.children.get(parent.relative(index.row()))
+
+    def __child_node(self, index):
+        node = self.node_from_index(index)
+        if node is None:
+            parent = self.__nodes[index.internalId()]
+            relative = parent.relative(index.row())
+            node = self.__new_node(
+                parent.root + relative, parent=parent, row=index.row()
+            )
+            parent.children[relative] = node
+        return node
+
+    def __index_of(self, node):
+        if node.parent is None:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node.parent.pk)
+
+    # QAbstractItemModel
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid():
+            if (node := self.node_from_index(parent)) is None:
+                return QModelIndex()
+        else:
+            node = self.root_node
+        if 0 <= row < self.__row_count(node) and 0 <= column < 3:
+            return self.createIndex(row, column, node.pk)
+        return QModelIndex()
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        if (node := self.__nodes.get(index.internalId())) is None:
+            return QModelIndex()
+        return self.__index_of(node)
+
+    @staticmethod
+    def __row_count(node):
+        return len(node.names) + (node.placeholder is not None)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        if (node := self.node_from_index(parent)) is None:
+            return 0
+        return self.__row_count(node)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 3
+
+    def hasChildren(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return True
+        try:
+            return self.__nodes[parent.internalId()].dirs[parent.row()] == 1
+        except (KeyError, IndexError):
+            return False
+
+    def flags(self, index):
+        if not index.isValid():
+            return self.ROOT_FLAGS
+        try:
+            is_dir = self.__nodes[index.internalId()].dirs[index.row()]
+        except (KeyError, IndexError):
+            return self.PLACEHOLDER_FLAGS
+        return self.DIR_FLAGS if is_dir else self.FILE_FLAGS
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        node = self.__nodes.get(index.internalId())
+        if node is None:
+            return None
+        row, column = index.row(), index.column()
+        if row >= len(node):
+            return node.placeholder if column == 0 else None
+        if column == 0:
+            return node.names[row]
+        if node.dirs[row]:
+            return None
+        if column == 1:
+            return f'{node.sizes[row]:,}'
+        return utils.date.to_iso(self.__to_datetime(node.mtimes[row]))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sorts the rows of every listed folder by `column`, folders
+        first. Rows listed later are inserted in the same order"""
+        self.sort_column, self.sort_order = column, order
+        reverse = order == Qt.DescendingOrder
+        self.layoutAboutToBeChanged.emit()
+        moved = dict()
+        for node in self.__nodes.values():
+            rows = sorted(
+                range(len(node)),
+                key=partial(self.__row_key, node),
+                reverse=reverse,
+            )
+            rows.sort(key=lambda row: not node.dirs[row])
+            if rows == list(range(len(node))):
+                continue
+            node.names = [node.names[row] for row in rows]
+            node.sizes = array('q', (node.sizes[row] for row in rows))
+            node.mtimes = array('q', (node.mtimes[row] for row in rows))
+            node.dirs = bytearray(node.dirs[row] for row in rows)
+            new_rows = {old: new for new, old in enumerate(rows)}
+            for child in node.children.values():
+                child.row = new_rows[child.row]
+            moved[node.pk] = new_rows
+        old_indexes = self.persistentIndexList()
+        new_indexes = []
+        for index in old_indexes:
+            new_rows = moved.get(index.internalId())
+            if new_rows is None or index.row() not in new_rows:
+                new_indexes.append(index)
+                continue
+            new_indexes.append(
+                self.createIndex(
+                    new_rows[index.row()], index.column(), index.internalId()
+                )
+            )
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
 
     def filePath(self, index):
         # compatability helper function for QFileSystemModel
-        if item := self.itemFromIndex(index):
-            if data := item.data():
-                return data.root
+        if not index.isValid():
+            return self.root_node.root
+        node = self.__nodes.get(index.internalId())
+        if node is not None and index.row() < len(node):
+            return node.root + node.relative(index.row())
 
     def supportedDropActions(self):
         return Qt.CopyAction | Qt.MoveAction
 
-    def flags(self, index):
-        default_flags = super().flags(index)
-        if index.isValid():
-            return Qt.ItemIsDragEnabled | Qt.ItemIsDropEnabled | default_flags
-        return Qt.ItemIsDropEnabled | default_flags
-
     def mimeTypes(self):
         return ['text/uri-list']
 
@@ -519,362 +789,460 @@ class BaseS3FilesTreeModel(QStandardItemModel):
         encoded_data = QByteArray()
         for index in indexes:
             if index.isValid() and index.column() == 0:
-                if item := self.itemFromIndex(index):
-                    if data := item.data():
-                        url = QUrl()
-                        url.setScheme('S3')
-                        url.setPath(data.root)
-                        encoded_data.append(url.toEncoded())
+                if root := self.filePath(index):
+                    url = QUrl()
+                    url.setScheme('S3')
+                    url.setPath(root)
+                    encoded_data.append(url.toEncoded())
         mime_data.setData('text/uri-list', encoded_data)
         return mime_data
 
-    def hasChildren(self, parent=QModelIndex()):
-        if not parent.isValid():
+    @Slot(QModelIndex)
+    def item_from_index(self, index):
+        """Returns a new item_class for the row at `index`"""
+        if not index.isValid():
+            return None
+        node = self.__nodes.get(index.internalId())
+        if node is None or index.row() >= len(node):
+            return None
+        row = index.row()
+        _client = self.client.copy()
+        _client['Root'] = node.root + node.relative(row)
+        if node.dirs[row]:
+            item = self.item_class(_client, is_dir=True)
+            if (child := node.children.get(node.relative(row))) is not None:
+                item.collapsed = child.collapsed
+            return item
+        return self.item_class(
+            _client,
+            size=node.sizes[row],
+            mtime=self.__to_datetime(node.mtimes[row]),
+        )
+
+    @staticmethod
+    def __to_datetime(mtime):
+        return datetime.datetime.fromtimestamp(mtime, tz=datetime.timezone.utc)
+
+    @staticmethod
+    def __to_timestamp(mtime):
+        return int(mtime.timestamp()) if mtime else 0
+
+    # Fetching
+
+    def fetch_children(self, item, node=None, refresh=False):
+        """Lists the children of `item` into `node` through the shared
+        fetcher.FetchManager, cancelling the node's previous listing.
+
+        If `node` already has rows or the listing is cached, the listing
+        is applied as a diff through apply_listing instead of inserting
+        every row. Otherwise it pauses after fetcher.INITIAL_PAGES and
+        the view asks for the rest through list_more. `refresh` skips the
+        cache's freshness check
+        """
+        node = self.root_node if node is None else node
+        self.__set_placeholder(node, self.FETCHING)
+        previous = node.token
+        as_diff = bool(len(node)) or refresh
+        # Subscribing first lets a listing still in flight be shared
+        node.token = self.fetcher.list_prefix(
+            item,
+            partial(self.__listing_event, node, item.space or '', as_diff),
+            refresh=refresh,
+            pages=None if as_diff else fetcher.INITIAL_PAGES,
+        )
+        if previous is not None:
+            previous.cancel()
+
+    def refresh(self):
+        """Lists the root and every expanded folder again and applies the
+        differences in place, keeping the view's expansion and selection
+        """
+        pending = [self.root_node]
+        while pending:
+            node = pending.pop()
+            if node.collapsed:
+                continue
+            _client = self.client.copy()
+            _client['Root'] = node.root
+            self.fetch_children(
+                self.item_class(_client, is_dir=True), node, refresh=True
+            )
+            pending.extend(node.children.values())
+
+    def __listing_event(self, node, prefix, as_diff, token, event):
+        """Turns a fetcher.ListingEvent for `node` into signals"""
+        if self._stopped or self.__collapsed(node):
+            return
+        if event.kind == fetcher.CACHED:
+            self.listing_loaded.emit(node, token, prefix, event.entries)
+        elif event.kind == fetcher.PAGE:
+            if not as_diff:
+                # One signal and one insert per page of keys
+                self.new_rows.emit(node, token, prefix, event.entries)
+        elif event.kind == fetcher.LISTED:
+            if as_diff or event.cached:
+                self.listing_loaded.emit(node, token, prefix, event.entries)
+            self.__loaded(node, token, found=bool(event.entries))
+        elif event.kind == fetcher.PAUSED:
+            if self.fetcher.has_more(token):
+                self.all_items_loaded.emit(node, token)
+        elif event.kind == fetcher.FRESH:
+            self.__loaded(node, token, found=bool(event.entries))
+        else:
+            self.all_items_loaded.emit(node, token)
+
+    def __collapsed(self, node):
+        if node.removed or node.collapsed:
+            logging.info(f'{node.root} exited due to collapse.')
             return True
-        if item := self.itemFromIndex(parent):
-            if data := item.data():
-                if data.is_dir:
-                    return True
         return False
 
-    def canFetchMore(self, parent=QModelIndex()):
-        if parent.isValid():
+    def __loaded(self, node, token, *, found):
+        if not found:
+            self.no_children.emit(node, token)
+        else:
+            self.all_items_loaded.emit(node, token)
+
+    def __set_placeholder(self, node, text):
+        """Shows `text` as the last row of `node`, or removes the
+        placeholder row if `text` is None"""
+        row = len(node)
+        parent = self.__index_of(node)
+        if node.placeholder is None and text is not None:
+            self.beginInsertRows(parent, row, row)
+            node.placeholder = text
+            self.endInsertRows()
+        elif node.placeholder is not None and text is None:
+            self.beginRemoveRows(parent, row, row)
+            node.placeholder = None
+            self.endRemoveRows()
+        elif node.placeholder != text:
+            node.placeholder = text
+            index = self.createIndex(row, 0, node.pk)
+            self.dataChanged.emit(index, index)
+
+    @Slot(object, object)
+    def remove_loading_row(self, node, token=None):
+        if self.__current(node, token):
+            self.__flush(node)
+            if node.placeholder == self.FETCHING:
+                self.__set_placeholder(node, None)
+
+    @Slot(object, object)
+    def no_items_found(self, node, token=None):
+        if self.__current(node, token):
+            self.__flush(node)
+            self.__set_placeholder(node, self.EMPTY)
+
+    # Changing rows
+
+    def __columns(self, prefix, entries):
+        names, sizes, mtimes, dirs = [], array('q'), array('q'), bytearray()
+        for entry in entries:
+            names.append(entry.key[len(prefix):].rstrip('/'))
+            sizes.append(entry.size)
+            mtimes.append(self.__to_timestamp(entry.mtime))
+            dirs.append(entry.is_dir)
+        return names, sizes, mtimes, dirs
+
+    def __sort_key(self, name, size, mtime):
+        """Returns the key of a row under the current sort, names
+        breaking ties"""
+        return ((name, size, mtime)[self.sort_column], name)
+
+    def __row_key(self, node, row):
+        return self.__sort_key(
+            node.names[row], node.sizes[row], node.mtimes[row]
+        )
+
+    def __entry_key(self, prefix, entry):
+        return self.__sort_key(
+            entry.key[len(prefix):].rstrip('/'),
+            entry.size,
+            self.__to_timestamp(entry.mtime),
+        )
+
+    def __sorted_row(self, node, is_dir, key):
+        """Returns the row of `node` that a new row sorted by `key` is
+        inserted at, after any rows it ties with"""
+        reverse = self.sort_order == Qt.DescendingOrder
+        low, high = 0, len(node)
+        while low < high:
+            middle = (low + high) // 2
+            if bool(is_dir) != bool(node.dirs[middle]):
+                # Folders go first whatever the sort
+                before = bool(is_dir)
+            else:
+                other = self.__row_key(node, middle)
+                before = key > other if reverse else key < other
+            if before:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def __insert_sorted(self, node, prefix, entries):
+        """Inserts `entries` into `node` where the current sort puts
+        them, with one rowsInserted per run of new rows"""
+        keys = [self.__entry_key(prefix, entry) for entry in entries]
+        rows = sorted(
+            range(len(entries)),
+            key=keys.__getitem__,
+            reverse=self.sort_order == Qt.DescendingOrder,
+        )
+        rows.sort(key=lambda i: not entries[i].is_dir)
+        insertions = collections.defaultdict(list)
+        for i in rows:
+            row = self.__sorted_row(node, entries[i].is_dir, keys[i])
+            insertions[row].append(entries[i])
+        for row in sorted(insertions, reverse=True):
+            self.__insert(node, row, prefix, insertions[row])
+
+    def __insert(self, node, row, prefix, entries):
+        """Inserts `entries` at `row` of `node` with one rowsInserted"""
+        names, sizes, mtimes, dirs = self.__columns(prefix, entries)
+        self.beginInsertRows(
+            self.__index_of(node), row, row + len(entries) - 1
+        )
+        node.names[row:row] = names
+        node.sizes[row:row] = sizes
+        node.mtimes[row:row] = mtimes
+        node.dirs[row:row] = dirs
+        for child in node.children.values():
+            if child.row >= row:
+                child.row += len(entries)
+        self.endInsertRows()
+
+    def __remove(self, node, row, count):
+        """Removes `count` rows from `row` of `node` with one
+        rowsRemoved"""
+        self.beginRemoveRows(self.__index_of(node), row, row + count - 1)
+        for offset in range(row, row + count):
+            relative = node.relative(offset)
+            if (child := node.children.pop(relative, None)) is not None:
+                self.__drop_node(child)
+        del node.names[row:row + count]
+        del node.sizes[row:row + count]
+        del node.mtimes[row:row + count]
+        del node.dirs[row:row + count]
+        for child in node.children.values():
+            if child.row >= row + count:
+                child.row -= count
+        self.endRemoveRows()
+
+    def __current(self, node, token):
+        """Returns True if `token` is from the latest listing of `node`"""
+        return not (self._stopped or node.removed) and node.token is token
+
+    @Slot(object, object, str, list)
+    def insert_rows(self, node, token, prefix, entries):
+        """Appends a page of `entries` to `node`.
+
+        The view lays out every row of `node` after each insert, so pages
+        are held back until there are at least as many as are shown. The
+        rest are inserted by __flush once the listing ends.
+        """
+        if not self.__current(node, token) or not entries:
+            return
+        if self.__collapsed(node):
+            return
+        node.pending.extend(entries)
+        if len(node.pending) >= max(self.max_keys, len(node)):
+            self.__flush(node, prefix)
+
+    def __flush(self, node, prefix=None):
+        """Inserts the pending entries of `node`"""
+        if node.pending and not node.removed:
+            if prefix is None:
+                prefix = node.root.lstrip('/').partition('/')[2]
+            entries, node.pending = node.pending, []
+            self.__insert_sorted(node, prefix, entries)
+
+    @Slot(object, object, str, list)
+    def apply_listing(self, node, token, prefix, entries):
+        """Makes the rows of `node` match `entries` with as few changes
+        as possible.
+
+        Rows whose key is gone are removed, rows whose size or date
+        changed are updated in place, and new keys are inserted where the
+        current sort puts them. Each contiguous run of rows is a single
+        remove, insert, or dataChanged, so the view keeps its state.
+        """
+        if not self.__current(node, token) or self.__collapsed(node):
+            return
+        self.__flush(node, prefix)
+        entries = {entry.key[len(prefix):]: entry for entry in entries}
+        removed = [
+            row for row in range(len(node))
+            if node.relative(row) not in entries
+        ]
+        for start, count in reversed(list(self.__runs(removed))):
+            self.__remove(node, start, count)
+        changed = []
+        for row in range(len(node)):
+            entry = entries.pop(node.relative(row))
+            if entry.is_dir:
+                continue
+            mtime = self.__to_timestamp(entry.mtime)
+            if (node.sizes[row], node.mtimes[row]) != (entry.size, mtime):
+                node.sizes[row], node.mtimes[row] = entry.size, mtime
+                changed.append(row)
+        for start, count in self.__runs(changed):
+            self.dataChanged.emit(
+                self.createIndex(start, 1, node.pk),
+                self.createIndex(start + count - 1, 2, node.pk),
+            )
+        if not entries:
+            return
+        self.__insert_sorted(node, prefix, list(entries.values()))
+
+    @staticmethod
+    def __runs(rows):
+        """Yields (start, count) for each run of consecutive `rows`"""
+        start = count = None
+        for row in rows:
+            if start is not None and row == start + count:
+                count += 1
+                continue
+            if start is not None:
+                yield start, count
+            start, count = row, 1
+        if start is not None:
+            yield start, count
+
+    # Not canFetchMore and fetchMore, as QAbstractItemView calls those
+    # whenever its layout is pending, not only at the end of the rows
+
+    def has_more(self, parent=QModelIndex()):
+        """Returns True if the listing of `parent` is paused with pages
+        left to list"""
+        if (node := self.node_from_index(parent)) is None:
+            return False
+        if node.token is None or node.collapsed:
             return False
-        return self.valid_last_row
+        return self.fetcher.has_more(node.token)
 
-    def fetchMore(self, parent=QModelIndex()):
-        if parent.isValid():
+    def list_more(self, parent=QModelIndex()):
+        """Lists the next page of `parent` if its listing is paused"""
+        if (node := self.node_from_index(parent)) is None:
             return
-        new_current_row = self.current_row + self.max_keys
-        self.beginInsertRows(parent, self.current_row, new_current_row)
-        self.current_row = new_current_row
-        self.endInsertRows()
-        if not self.data(self.index(self.current_row, 0)):
-            last_row = self.current_row - 1
-            while last_row > 0:
-                if self.data(self.index(last_row, 0)):
-                    break
-                last_row -= 1
-            self.current_row = last_row + 1
-            self.valid_last_row = False
-
-    def fetch_children(self, item, parent=None):
-        parent = self.invisibleRootItem() if parent is None else parent
-        self.loading_row.emit(parent)
-        t = threading.Thread(
-            args=(item, parent),
-            target=self.__fetch_children,
-            daemon=True
-        )
-        t.start()
-
-    def __fetch_children(self, item, parent):
-        client = item.setup_client()
-        client_config = item.config.copy()
-        found = False
-        logging.info(f'Starting fetch for {client_config} | {parent}')
-        response = client.list_objects_v2(**client_config)
-        for content in response.get('CommonPrefixes', []):
-            if self._stopped:
-                return
-            fname = content['Prefix'].strip('/').split('/')[-1]
-            root = f'{client_config["Bucket"]}/{content["Prefix"]}'
-            item_data = {
-                'root': root,
-                'mtime': content.get('LastModified', 0),
-            }
-            # TODO: This causes a runtime error if parent is deleted
-            #       before we get to this point
-            #       Should do a is_alive style check and return otherwise
-            # TODO: Just make it a helper func so it can be shared everywhere
-            #       parent == QStandardItem
-            if parent_data := parent.data():
-                if parent_data.collapsed:
-                    logging.info(f'{parent} exited due to collapse.')
-                    return
-            self.new_folder_item.emit(parent, fname, item_data)
-            if not found:
-                found = True
-        for content in response.get('Contents', []):
-            if self._stopped:
-                return
-            if (key := content['Key']) != client_config['Prefix']:
-                fname = key.split('/')[-1]
-                file_path = f'/{client_config["Bucket"]}/{key}'
-                item_data = {
-                    'root': file_path,
-                    'size': content['Size'],
-                    'mtime': content.get('LastModified', 0),
-                }
-                if parent_data := parent.data():
-                    if parent_data.collapsed:
-                        logging.info(f'{parent} exited due to collapse.')
-                        return
-                self.new_file_item.emit(
-                    parent,
-                    (
-                        fname,
-                        f'{content["Size"]:,}',
-                        utils.date.to_iso(content['LastModified']),
-                    ),
-                    item_data
-                )
-                if not found:
-                    found = True
-        while response.get('IsTruncated'):
-            if self._stopped:
-                return
-            client_config['ContinuationToken'] = response[
-                'NextContinuationToken'
-            ]
-            response = client.list_objects_v2(**client_config)
-            for content in response.get('CommonPrefixes', []):
-                if self._stopped:
-                    return
-                fname = content['Prefix'].strip('/').split('/')[-1]
-                root = f'{client_config["Bucket"]}/{content["Prefix"]}'
-                item_data = {
-                    'root': root,
-                    'mtime': content.get('LastModified', 0),
-                }
-                if parent_data := parent.data():
-                    if parent_data.collapsed:
-                        logging.info(f'{parent} exited due to collapse.')
-                        return
-                self.new_folder_item.emit(parent, fname, item_data)
-                if not found:
-                    found = True
-            for content in response.get('Contents', []):
-                if self._stopped:
-                    return
-                if (key := content['Key']) != client_config['Prefix']:
-                    fname = key.split('/')[-1]
-                    file_path = f'/{client_config["Bucket"]}/{key}'
-                    item_data = {
-                        'root': file_path,
-                        'size': content['Size'],
-                        'mtime': content.get('LastModified', 0),
-                    }
-                    if parent_data := parent.data():
-                        if parent_data.collapsed:
-                            logging.info(f'{parent} exited due to collapse.')
-                            return
-                    self.new_file_item.emit(
-                        parent,
-                        (
-                            fname,
-                            f'{content["Size"]:,}',
-                            utils.date.to_iso(content['LastModified']),
-                        ),
-                        item_data
-                    )
-                    if not found:
-                        found = True
-        if not found:
-            # Will segfault without assigning index() to a value
-            self.no_children.emit(parent)
-        else:
-            self.all_items_loaded.emit(parent)
-        logging.info(f'End fetch for {client_config} | {parent}')
-
-    @Slot(QStandardItem)
-    def create_loading_row(self, parent):
-        if not self._stopped:
-            item = QStandardItem('Fetching...')
-            parent.appendRow(item)
-
-    @Slot(QStandardItem)
-    def remove_loading_row(self, parent):
-        if not self._stopped:
-            parent.removeRow(parent.rowCount() - 1)
-
-    @Slot(QStandardItem)
-    def no_items_found(self, parent):
-        if not self._stopped:
-            parent.removeRow(parent.rowCount() - 1)
-            parent.appendRow(QStandardItem('(Empty)'))
+        if node.token is not None and self.fetcher.more(node.token):
+            self.__set_placeholder(node, self.FETCHING)
+
+    def prefetch(self, indexes):
+        """Lists the first page of each folder in `indexes` that has not
+        been expanded, so expanding it starts from that page"""
+        for index in indexes:
+            node = self.node_from_index(index)
+            if node is not None and node.token is not None:
+                continue
+            if (item := self.item_from_index(index)) and item.is_dir:
+                self.fetcher.prefetch(item)
+
+    # View slots
 
     @Slot(QModelIndex)
     def view_collapsed(self, index):
-        """Removes all rows starting from `index`. The rows cannot be
-        gauranteed to exist on the next expand, so they need to be removed
-        from the tree.
+        """Marks `index` as collapsed, which stops its fetch. The rows are
+        kept and the next expand applies a fresh listing to them as a diff
         """
-        item = self.itemFromIndex(index)
-        data = item.data()
-        if data.is_dir:
-            data.collapsed = True
-            item.setData(data)
-            item.removeRows(0, item.rowCount())
+        if (node := self.node_from_index(index)) is not None:
+            node.collapsed = True
+            if node.token is not None:
+                node.token.cancel()
+            self.__flush(node)
+            if node.placeholder == self.FETCHING:
+                self.__set_placeholder(node, None)
 
     @Slot(QModelIndex)
     def view_expanded(self, index):
-        if item := self.itemFromIndex(index):
-            if data := item.data():
-                if data.is_dir:
-                    if data.collapsed:
-                        data.collapsed = False
-                        item.setData(data)
-                    self.fetch_children(data, item)
-                    return
+        if item := self.item_from_index(index.siblingAtColumn(0)):
+            if item.is_dir:
+                node = self.__child_node(index.siblingAtColumn(0))
+                node.collapsed = False
+                self.fetch_children(item, node)
+                return
         logging.warn(f'No item/data for {index} in view_expanded')
 
     @Slot(list)
     def remove_rows(self, items):
+        nodes = {node.root: node for node in self.__nodes.values()}
         for item in items:
-            text = os.path.basename(item.root.strip('/').strip('\\'))
-            for result in self.findItems(
-                text, Qt.MatchRecursive | Qt.MatchExactly | Qt.MatchWrap, 0
-            ):
-                if data := result.data():
-                    if data.root == item.root:
-                        index = self.indexFromItem(result)
-                        result_parent = index.parent()
-                        self.removeRow(index.row(), result_parent)
-
-    @Slot(QModelIndex)
-    def item_from_index(self, index):
-        if index.isValid():
-            if index.column() != 0:
-                index = index.siblingAtColumn(0)
-            if item := self.itemFromIndex(index):
-                if data := item.data():
-                    return data
-
-
-class S3FilesTreeModel(BaseS3FilesTreeModel):
-
-    def __init__(self, *, client, parent=None, max_keys=1_000):
-        super().__init__(parent)
-        self.client = client.copy()
-        self.new_folder_item.connect(self.create_folder_item)
-        self.new_file_item.connect(self.create_file_item)
-        self.all_items_loaded.connect(self.remove_loading_row)
-        self.no_children.connect(self.no_items_found)
-        self.loading_row.connect(self.create_loading_row)
-        self.setHorizontalHeaderLabels(['Name', 'Size', 'Last Modified'])
-        self.max_keys = max_keys
-        self.current_row = 0
-        # TODO: connect to any row add slots to reset this
-        self.valid_last_row = True
-        # TODO: Cancel specific threads
-        self.fetch_children(S3Item(self.client, is_dir=True))
-
-    @Slot(QStandardItem, str, dict)
-    def create_folder_item(self, parent, fname, data):
-        if not self._stopped:
-            if parent_data := parent.data():
-                if parent_data.collapsed:
-                    logging.info(f'{parent} exited due to collapse.')
-                    return
-            loading_row = parent.rowCount()
-            _client = self.client.copy()
-            _client['Root'] = data['root']
-            item = S3Item(
-                _client,
-                mtime=data.get('mtime', 0),
-                is_dir=True
+            key = item.root.lstrip('/').partition('/')[2]
+            prefix = key.rstrip('/').rpartition('/')[0]
+            self.cache.invalidate(
+                item.endpoint, item.bucket, f'{prefix}/' if prefix else ''
             )
-            display_item = QStandardItem(fname)
-            display_item.setData(item)
-            parent.insertRow(loading_row - 1, [display_item])
-            self.valid_last_row = True
-
-    @Slot(QStandardItem, tuple, dict)
-    def create_file_item(self, parent, items, data):
-        if not self._stopped:
-            if parent_data := parent.data():
-                if parent_data.collapsed:
-                    logging.info(f'{parent} exited due to collapse.')
-                    return
-            loading_row = parent.rowCount()
-            display_items = [QStandardItem(item_str) for item_str in items]
-            _client = self.client.copy()
-            _client['Root'] = data['root']
-            item = S3Item(
-                _client,
-                mtime=data.get('mtime', 0),
-                size=data['size'],
+            if item.is_dir:
+                self.cache.invalidate(item.endpoint, item.bucket, item.space)
+            parent_root = f'/{item.bucket}/{prefix}/' if prefix else (
+                f'/{item.bucket}/'
             )
-            display_items[0].setData(item)
-            parent.insertRow(loading_row - 1, display_items)
-            self.valid_last_row = True
+            if (node := nodes.get(parent_root)) is None:
+                continue
+            relative = item.root[len(parent_root):]
+            for row in range(len(node)):
+                if node.relative(row).rstrip('/') == relative.rstrip('/'):
+                    if bool(node.dirs[row]) == bool(item.is_dir):
+                        self.__remove(node, row, 1)
+                        break
 
-    @Slot(QModelIndex)
-    def item_from_index(self, index):
-        if index.isValid():
-            if index.column() != 0:
-                index = index.siblingAtColumn(0)
-            if item := self.itemFromIndex(index):
-                if data := item.data():
-                    return data
 
+class S3FilesTreeModel(BaseS3FilesTreeModel):
+    item_class = S3Item
 
-class DigitalOceanFilesTreeModel(BaseS3FilesTreeModel):
 
-    def __init__(self, *, client, parent=None, max_keys=1_000):
-        super().__init__(parent)
-        self.client = client.copy()
-        self.new_folder_item.connect(self.create_folder_item)
-        self.new_file_item.connect(self.create_file_item)
-        self.all_items_loaded.connect(self.remove_loading_row)
-        self.no_children.connect(self.no_items_found)
-        self.loading_row.connect(self.create_loading_row)
-        self.setHorizontalHeaderLabels(['Name', 'Size', 'Last Modified'])
-        self.max_keys = max_keys
-        self.current_row = 0
-        # TODO: connect to any row add slots to reset this
-        self.valid_last_row = True
-        # TODO: Cancel specific threads
-        self.fetch_children(DigitalOceanItem(self.client, is_dir=True))
-
-    @Slot(QStandardItem, str, dict)
-    def create_folder_item(self, parent, fname, data):
-        if not self._stopped:
-            if parent_data := parent.data():
-                if parent_data.collapsed:
-                    logging.info(f'{parent} exited due to collapse.')
-                    return
-            loading_row = parent.rowCount()
-            _client = self.client.copy()
-            _client['Root'] = data['root']
-            item = DigitalOceanItem(
-                _client,
-                mtime=data.get('mtime', 0),
-                is_dir=True
-            )
-            display_item = QStandardItem(fname)
-            display_item.setData(item)
-            parent.insertRow(loading_row - 1, [display_item])
-            self.valid_last_row = True
-
-    @Slot(QStandardItem, tuple, dict)
-    def create_file_item(self, parent, items, data):
-        if not self._stopped:
-            if parent_data := parent.data():
-                if parent_data.collapsed:
-                    logging.info(f'{parent} exited due to collapse.')
-                    return
-            loading_row = parent.rowCount()
-            display_items = [QStandardItem(item_str) for item_str in items]
-            _client = self.client.copy()
-            _client['Root'] = data['root']
-            item = DigitalOceanItem(
-                _client,
-                mtime=data.get('mtime', 0),
-                size=data['size'],
-            )
-            display_items[0].setData(item)
-            parent.insertRow(loading_row - 1, display_items)
-            self.valid_last_row = True
+class DigitalOceanFilesTreeModel(BaseS3FilesTreeModel):
+    item_class = DigitalOceanItem
 
 
 class SearchResultsModel(QAbstractTableModel):
+    """The results of a search, stored column-wise.
+
+    A row is its folder's index in `folders`, which holds every folder
+    once, its name, size, and mtime (epoch seconds, 0 if unknown), and
+    one bit of `checked`, whose set bits are counted in `checked_count`.
+
+    Results are appended by add_results and shown by flush, which runs at
+    most every FLUSH_INTERVAL milliseconds. QTreeView lays out every row
+    after each insert, so past the first FETCH_SIZE rows only FETCH_SIZE
+    more are shown at a time, when the view scrolls to the end.
+    """
+    # Milliseconds between inserting the rows added since the last insert
+    FLUSH_INTERVAL = 100
+    # Rows shown at once
+    FETCH_SIZE = 1_000
+    # The view asks for the flags of every row on each layout, so they
+    # are combined once
+    RESULT_FLAGS = (
+        Qt.ItemIsEnabled | Qt.ItemNeverHasChildren | Qt.ItemIsSelectable
+    )
+    CHECKBOX_FLAGS = RESULT_FLAGS | Qt.ItemIsUserCheckable
+    MESSAGE_FLAGS = Qt.ItemIsEnabled | Qt.ItemNeverHasChildren
 
     def __init__(self, parent=None, items=None):
         super().__init__(parent)
-        self.items = list(items) if items is not None else []
-        self.current_row = 0
+        self.folders = []
+        self.folder_ids = dict()
+        self.parents = array('L')
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.checked = bytearray()
+        self.checked_count = 0
+        # Rows shown in the view, the rest are waiting for flush
+        self.row_count = 0
+        # Set when the view wants more rows than have been added
+        self.wanted = False
+        self.finished = False
+        self.message = None
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(self.FLUSH_INTERVAL)
+        self.flush_timer.timeout.connect(self.flush)
+        if items is not None:
+            self.add_results(items)
+            self.flush()
 
     def columnCount(self, parent=QModelIndex()):
         return 4
@@ -882,38 +1250,120 @@ class SearchResultsModel(QAbstractTableModel):
     def rowCount(self, parent=QModelIndex()):
         if parent.isValid():
             return 0
-        return len(self.items)
+        if self.message is not None:
+            return 1
+        return self.row_count
 
     def canFetchMore(self, parent=QModelIndex()):
         if parent.isValid():
             return False
-        return self.current_row < len(self.items)
+        return self.row_count < len(self.names) or not self.finished
 
     def fetchMore(self, parent=QModelIndex()):
         if parent.isValid():
             return
-        items_to_fetch = min(256, len(self.items) - self.current_row)
-        if items_to_fetch <= 0:
-            return
-        self.beginInsertRows(
-            parent,
-            self.current_row,
-            self.current_row + items_to_fetch - 1
-        )
-        self.current_row += items_to_fetch
-        self.endInsertRows()
+        if not self.reveal():
+            self.wanted = True
+
+    def reveal(self):
+        """Shows up to FETCH_SIZE of the rows waiting. Returns False if no
+        row is waiting"""
+        count = min(self.FETCH_SIZE, len(self.names) - self.row_count)
+        if count <= 0:
+            return False
+        self.wanted = False
+        return self.insertRows(self.row_count, count)
+
+    def path(self, row):
+        return self.folders[self.parents[row]] + self.names[row]
+
+    def is_checked(self, row):
+        return bool(self.checked[row >> 3] & (1 << (row & 7)))
+
+    def set_checked(self, row, checked):
+        """Returns 1 if the check state of `row` changed, otherwise 0"""
+        byte, bit = row >> 3, 1 << (row & 7)
+        if bool(self.checked[byte] & bit) == checked:
+            return 0
+        self.checked[byte] ^= bit
+        self.checked_count += 1 if checked else -1
+        return 1
+
+    def set_range_checked(self, first, last, checked):
+        """Checks or unchecks the rows from `first` to `last`, a whole byte
+        of the bitset at a time, and emits one dataChanged. Returns the
+        number of rows whose state changed"""
+        stop = last + 1
+        # Bytes entirely within the range
+        low, high = (first + 7) >> 3, stop >> 3
+        changed = 0
+        if low >= high:
+            for row in range(first, stop):
+                changed += self.set_checked(row, checked)
+        else:
+            for row in range(first, low << 3):
+                changed += self.set_checked(row, checked)
+            for row in range(high << 3, stop):
+                changed += self.set_checked(row, checked)
+            set_bits = int.from_bytes(
+                self.checked[low:high], 'little'
+            ).bit_count()
+            self.checked[low:high] = (b'\xff' if checked else b'\0') * (
+                high - low
+            )
+            if checked:
+                delta = (high - low) * 8 - set_bits
+                self.checked_count += delta
+            else:
+                delta = set_bits
+                self.checked_count -= delta
+            changed += delta
+        if changed:
+            self.dataChanged.emit(
+                self.index(first, 0),
+                self.index(last, 0),
+                [Qt.CheckStateRole],
+            )
+        return changed
+
+    def all_checked(self):
+        return self.message is None and self.checked_count == self.row_count
+
+    def checked_rows(self, checked=None):
+        """Yields the checked rows in order, optionally of a `checked`
+        snapshot of self.checked"""
+        if checked is None:
+            checked = self.checked
+        for byte_index, byte in enumerate(checked):
+            if byte:
+                row = byte_index << 3
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield row + bit
 
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid():
             return
-        if 0 > index.row() or index.row() > self.rowCount():
+        row, column = index.row(), index.column()
+        if not 0 <= row < self.rowCount():
             return
-        if role == Qt.DisplayRole:
-            return self.items[index.row()][index.column()]
-        if role == Qt.CheckStateRole and index.column() == 0:
-            if self.items[index.row()][index.column()] == Qt.Checked:
-                return Qt.Checked
-            return Qt.Unchecked
+        if self.message is not None:
+            if role == Qt.DisplayRole and column == 1:
+                return self.message
+            return
+        if column == 0:
+            if role in (Qt.DisplayRole, Qt.CheckStateRole):
+                return Qt.Checked if self.is_checked(row) else Qt.Unchecked
+        elif role == Qt.DisplayRole:
+            if column == 1:
+                return self.path(row)
+            if column == 2:
+                return self.sizes[row]
+            if mtime := self.mtimes[row]:
+                return utils.date.to_iso(
+                    datetime.datetime.fromtimestamp(mtime).astimezone()
+                )
+            return ''
 
     def headerData(self, section, orientation, role=Qt.DisplayRole):
         if orientation == Qt.Horizontal and role == Qt.DisplayRole:
@@ -926,48 +1376,47 @@ class SearchResultsModel(QAbstractTableModel):
             elif section == 3:
                 return 'Last Modified'
 
-    @Slot(QModelIndex)
     def flags(self, index):
         if index.isValid():
+            if self.message is not None:
+                return self.MESSAGE_FLAGS
             if index.column() == 0:
-                return Qt.ItemNeverHasChildren | \
-                       Qt.ItemIsEnabled | \
-                       Qt.ItemIsUserCheckable | \
-                       Qt.ItemIsSelectable
-            return Qt.ItemIsEnabled | \
-                Qt.ItemNeverHasChildren | \
-                Qt.ItemIsSelectable
+                return self.CHECKBOX_FLAGS
+            return self.RESULT_FLAGS
         return Qt.NoItemFlags
 
     def insertRows(self, row, count, parent=QModelIndex()):
+        """Shows `count` rows that were already added, from `row`"""
         try:
-            self.beginInsertRows(parent, row, count)
+            self.beginInsertRows(parent, row, row + count - 1)
+            self.row_count += count
             self.endInsertRows()
         except Exception as e:
             cls_name = self.__class__.__name__
             logging.warn(
                 (f'Could not add {count} new '
-                 f'rows starting from {row} to {cls_name}: {e:!r}')
+                 f'rows starting from {row} to {cls_name}: {e!r}')
             )
             return False
         else:
             return True
 
     def setData(self, index, value, role=Qt.EditRole):
+        if (
+            not index.isValid()
+            or index.column() != 0
+            or role != Qt.CheckStateRole
+            or self.message is not None
+        ):
+            return False
         try:
-            if index.column() == 0:
-                if role == Qt.CheckStateRole:
-                    if value == Qt.Checked.value or value == Qt.Checked:
-                        value = Qt.Checked
-                    else:
-                        value = Qt.Unchecked
-                else:
-                    return False
-            self.items[index.row()][index.column()] = value
+            self.set_checked(
+                index.row(), value == Qt.Checked.value or value == Qt.Checked
+            )
         except Exception as e:
             cls_name = self.__class__.__name__
             logging.warn(
-                f'Could not setData {value} on {index} in {cls_name}: {e:!r}'
+                f'Could not setData {value} on {index} in {cls_name}: {e!r}'
             )
             return False
         else:
@@ -975,55 +1424,89 @@ class SearchResultsModel(QAbstractTableModel):
             return True
 
     def bulkSetData(self, indexes, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or self.message is not None:
+            return False
+        checked = value == Qt.Checked.value or value == Qt.Checked
         try:
             for index in indexes:
                 if index.column() == 0:
-                    if role != Qt.CheckStateRole:
-                        continue
-                    if value == Qt.Checked.value or value == Qt.Checked:
-                        value = Qt.Checked
-                    else:
-                        value = Qt.Unchecked
-                self.items[index.row()][index.column()] = value
+                    self.set_checked(index.row(), checked)
         except Exception as e:
             cls_name = self.__class__.__name__
             logging.warn(
-                f'Could not setData {value} on {index} in {cls_name}: {e:!r}'
+                f'Could not setData {value} on {index} in {cls_name}: {e!r}'
             )
             return False
         else:
             self.dataChanged.emit(indexes[0], indexes[-1])
             return True
 
+    @Slot()
+    def flush(self):
+        self.flush_timer.stop()
+        if self.wanted or self.row_count < self.FETCH_SIZE:
+            self.reveal()
+
     def completed(self):
-        if not self.rowCount():
-            self.items = [['', 'No items found', '', '']]
-            self.insertRows(0, 1)
+        self.finished = True
+        self.flush()
+        if not self.names:
+            self.beginInsertRows(QModelIndex(), 0, 0)
+            self.message = 'No items found'
+            self.endInsertRows()
 
     @Slot(list)
     def add_results(self, items):
+        folder_ids = self.folder_ids
         for item in items:
-            self.items.append(
-                [
-                    Qt.Unchecked,
-                    item.root,
-                    item.size,
-                    utils.date.to_iso(item.mtime) if item.mtime else ''
-                ]
+            folder, sep, name = item.root.rpartition('/')
+            if os.sep != '/' and os.sep in name:
+                folder, sep, name = item.root.rpartition(os.sep)
+            folder += sep
+            if (folder_id := folder_ids.get(folder)) is None:
+                folder_id = folder_ids[folder] = len(self.folders)
+                self.folders.append(folder)
+            self.parents.append(folder_id)
+            self.names.append(name)
+            self.sizes.append(item.size or 0)
+            self.mtimes.append(filters._timestamp(item.mtime) or 0)
+        if len(self.checked) * 8 < len(self.names):
+            self.checked.extend(
+                bytes((len(self.names) + 7) // 8 - len(self.checked))
             )
-        return self.insertRows(self.rowCount(), len(items))
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+        return True
 
     @Slot(object)
     def add_result(self, item):
-        self.items.append(
-            [
-                Qt.Unchecked,
-                item.root,
-                item.size,
-                utils.date.to_iso(item.mtime) if item.mtime else ''
-            ]
-        )
-        return self.insertRows(self.rowCount(), 1)
+        return self.add_results([item])
+
+    @Slot(list)
+    def set_results(self, items):
+        """Replaces every result with `items`, e.g., the current top
+        results of a search. Results that were checked stay checked"""
+        checked = {self.path(row) for row in self.checked_rows()}
+        self.beginResetModel()
+        self.folders.clear()
+        self.folder_ids.clear()
+        del self.parents[:]
+        self.names.clear()
+        del self.sizes[:]
+        del self.mtimes[:]
+        self.checked.clear()
+        self.checked_count = 0
+        self.row_count = 0
+        self.wanted = False
+        self.message = None
+        self.endResetModel()
+        self.add_results(items)
+        if checked:
+            for row in range(len(self.names)):
+                if self.path(row) in checked:
+                    self.set_checked(row, True)
+        self.flush()
+        return True
 
 
 class ListModel(QAbstractListModel):
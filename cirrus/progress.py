@@ -0,0 +1,147 @@
+import collections
+import threading
+
+
+Snapshot = collections.namedtuple(
+    'Snapshot',
+    ['rows', 'started', 'finished', 'retrying', 'stopped']
+)
+
+
+class _Bucket:
+
+    __slots__ = (
+        'thread',
+        'lock',
+        'active',
+        'started',
+        'finished',
+        'retrying',
+        'stopped',
+    )
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.lock = threading.Lock()
+        self.active = dict()
+        self.started = []
+        self.finished = []
+        self.retrying = []
+        self.stopped = []
+
+    def drain(self):
+        with self.lock:
+            output = (
+                list(self.active.values()),
+                self.started,
+                self.finished,
+                self.retrying,
+                self.stopped,
+            )
+            self.started, self.finished = [], []
+            self.retrying, self.stopped = [], []
+        return output
+
+    @property
+    def idle(self):
+        return not (
+            self.active
+            or self.started
+            or self.finished
+            or self.retrying
+            or self.stopped
+        )
+
+
+class ProgressBus:
+    """Collects the transfer events from the Executor's worker threads so
+    the GUI can consume them once per tick instead of receiving a
+    cross-thread signal per TransferItem.
+
+    Every worker thread records into its own bucket, so workers never
+    contend with each other and only briefly with the reader. Call
+    snapshot() from the consuming thread to take everything recorded
+    since the previous call.
+    """
+
+    def __init__(self):
+        self.__local = threading.local()
+        self.__buckets = []
+        self.__lock = threading.Lock()
+
+    def __bucket(self):
+        try:
+            return self.__local.bucket
+        except AttributeError:
+            bucket = _Bucket()
+            with self.__lock:
+                self.__buckets.append(bucket)
+            self.__local.bucket = bucket
+            return bucket
+
+    def started(self, *transfer_items):
+        bucket = self.__bucket()
+        with bucket.lock:
+            for item in transfer_items:
+                bucket.active[item.pk] = item
+                bucket.started.append(item)
+
+    def finished(self, *transfer_items):
+        bucket = self.__bucket()
+        with bucket.lock:
+            for item in transfer_items:
+                _ = bucket.active.pop(item.pk, None)
+                bucket.finished.append(item)
+
+    def retrying(self, *transfer_items):
+        bucket = self.__bucket()
+        with bucket.lock:
+            for item in transfer_items:
+                _ = bucket.active.pop(item.pk, None)
+                bucket.retrying.append(item)
+
+    def stopped(self, *transfer_items):
+        bucket = self.__bucket()
+        with bucket.lock:
+            for item in transfer_items:
+                _ = bucket.active.pop(item.pk, None)
+                bucket.stopped.append(item)
+
+    def snapshot(self):
+        """Returns a Snapshot of everything recorded since the last call.
+
+        Snapshot.rows is a list of (pk, processed, status) for every
+        TransferItem that is transferring or changed state since the last
+        snapshot. The remaining fields are the TransferItems that
+        started, finished, will be retried, or were stopped, in the order
+        they were recorded per worker.
+        """
+        rows = []
+        started, finished, retrying, stopped = [], [], [], []
+        with self.__lock:
+            buckets = list(self.__buckets)
+        for bucket in buckets:
+            active, b_started, b_finished, b_retrying, b_stopped = (
+                bucket.drain()
+            )
+            started.extend(b_started)
+            finished.extend(b_finished)
+            retrying.extend(b_retrying)
+            stopped.extend(b_stopped)
+            for item in active:
+                rows.append((item.pk, item.processed, item.status))
+        for item in finished + retrying + stopped:
+            rows.append((item.pk, item.processed, item.status))
+        with self.__lock:
+            # Buckets of exited worker threads are dropped once drained
+            self.__buckets = [
+                bucket for bucket in self.__buckets
+                if bucket.thread.is_alive() or not bucket.idle
+            ]
+        return Snapshot(
+            rows=rows,
+            started=started,
+            finished=finished,
+            retrying=retrying,
+            stopped=stopped,
+        )
@@ -0,0 +1,214 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from cirrus.statuses import ErrorCategory
+
+
+THROTTLING_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'SlowDown',
+    'TooManyRequests',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+}
+AUTH_CODES = {
+    'AccessDenied',
+    'AllAccessDisabled',
+    'AuthorizationHeaderMalformed',
+    'ExpiredToken',
+    'InvalidAccessKeyId',
+    'InvalidToken',
+    'SignatureDoesNotMatch',
+}
+NOT_FOUND_CODES = {
+    '404',
+    'NoSuchBucket',
+    'NoSuchKey',
+    'NoSuchUpload',
+    'NotFound',
+}
+SERVER_CODES = {
+    'InternalError',
+    'RequestTimeout',
+    'ServiceUnavailable',
+}
+# botocore's connection errors are matched by name so botocore
+# does not need to be imported to classify them
+CONNECTION_ERRORS = {
+    'ConnectionClosedError',
+    'ConnectTimeoutError',
+    'EndpointConnectionError',
+    'IncompleteReadError',
+    'ReadTimeoutError',
+    'ResponseStreamingError',
+}
+
+
+def classify(error):
+    """Returns the ErrorCategory for `error`, checking the chain of
+    causes if the error itself cannot be classified
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        category = _classify(error)
+        if category != ErrorCategory.UNKNOWN:
+            return category
+        error = error.__cause__ or error.__context__
+    return ErrorCategory.UNKNOWN
+
+
+def _classify(error):
+    if isinstance(response := getattr(error, 'response', None), dict):
+        code = str(response.get('Error', {}).get('Code', ''))
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        status = status if isinstance(status, int) else 0
+        if code in THROTTLING_CODES or status == 429:
+            return ErrorCategory.THROTTLING
+        if code in AUTH_CODES or status in {401, 403}:
+            return ErrorCategory.AUTH
+        if code in NOT_FOUND_CODES or status == 404:
+            return ErrorCategory.NOT_FOUND
+        if code in SERVER_CODES or status >= 500:
+            return ErrorCategory.SERVER
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & CONNECTION_ERRORS:
+        return ErrorCategory.CONNECTION
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return ErrorCategory.CONNECTION
+    if isinstance(error, FileNotFoundError):
+        return ErrorCategory.NOT_FOUND
+    if isinstance(error, PermissionError):
+        return ErrorCategory.AUTH
+    return ErrorCategory.UNKNOWN
+
+
+class RetryPolicy:
+    """Decides if, and when, a failed transfer should be retried.
+
+    Only throttling, server, and connection errors are retried. The delay
+    uses "full jitter" exponential backoff, i.e., a random delay between 0
+    and base_delay * 2 ** (attempt - 1), capped at max_delay. Throttling
+    errors back off throttle_factor times as fast.
+
+    :type max_attempts: int
+    :param max_attempts: The total number of attempts, including the first
+    :type base_delay: float
+    :param base_delay: The backoff, in seconds, after the first failure
+    :type max_delay: float
+    :param max_delay: The maximum backoff in seconds
+    :type throttle_factor: float
+    :param throttle_factor: The base_delay multiplier for throttling errors
+    """
+
+    def __init__(
+        self,
+        *,
+        max_attempts=5,
+        base_delay=1.0,
+        max_delay=300.0,
+        throttle_factor=4.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_factor = throttle_factor
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}('
+                f'max_attempts={self.max_attempts}, '
+                f'base_delay={self.base_delay}, '
+                f'max_delay={self.max_delay}, '
+                f'throttle_factor={self.throttle_factor})')
+
+    def should_retry(self, category, attempts):
+        return category.retryable and attempts < self.max_attempts
+
+    def delay(self, category, attempts):
+        base_delay = self.base_delay
+        if category == ErrorCategory.THROTTLING:
+            base_delay *= self.throttle_factor
+        ceiling = min(self.max_delay, base_delay * 2 ** (attempts - 1))
+        return random.uniform(0, ceiling)
+
+
+class DelayedRetryQueue:
+    """Holds items until their retry time and then passes them to `release`.
+
+    A single daemon thread sleeps until the earliest item is due, so
+    waiting items never hold a worker thread.
+
+    :type release: callable
+    :param release: Called with each item once its delay has passed
+    """
+
+    def __init__(self, release):
+        self.release = release
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__condition = threading.Condition()
+        self.__releasing = 0
+        self.__thread = None
+
+    def __len__(self):
+        with self.__condition:
+            return len(self.__heap) + self.__releasing
+
+    @property
+    def pending(self):
+        return len(self) > 0
+
+    def put(self, item, delay):
+        with self.__condition:
+            due = time.monotonic() + max(delay, 0)
+            heapq.heappush(self.__heap, (due, next(self.__counter), item))
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(
+                    target=self.__run,
+                    name='retry_queue_thread',
+                    daemon=True,
+                )
+                self.__thread.start()
+            self.__condition.notify()
+
+    def clear(self):
+        """Drops every waiting item and returns them"""
+        with self.__condition:
+            waiting = [item for _, __, item in self.__heap]
+            self.__heap.clear()
+            self.__condition.notify()
+        return waiting
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while True:
+                    if not self.__heap:
+                        # Exits when idle. put() restarts the thread
+                        if not self.__condition.wait(timeout=30):
+                            if not self.__heap:
+                                self.__thread = None
+                                return
+                        continue
+                    due, _, item = self.__heap[0]
+                    if (remaining := due - time.monotonic()) <= 0:
+                        heapq.heappop(self.__heap)
+                        self.__releasing += 1
+                        break
+                    self.__condition.wait(timeout=remaining)
+            try:
+                self.release(item)
+            except Exception as e:
+                logging.warning(f'Failed to release {item!r} for retry: {e}')
+            finally:
+                with self.__condition:
+                    self.__releasing -= 1
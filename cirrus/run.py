@@ -0,0 +1,212 @@
+"""Drains the transfers queue without a display.
+
+    python -m cirrus.run [--workers 10] [--interval 1.0] [--json]
+
+Progress is written to stdout as text, or as one JSON object per line
+with --json. The exit status is 0 if every transfer finished, 1 if any
+transfer ended in an error during the run, 2 if the database could not be
+opened, and 130 if the run was interrupted.
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+
+from cirrus import settings, utils
+from cirrus.core import store
+from cirrus.core.executor import Executor
+from cirrus.core.scheduler import TransferQueue
+from cirrus.statuses import TransferStatus
+
+
+EXIT_OK = 0
+EXIT_ERRORS = 1
+EXIT_FAILED = 2
+EXIT_INTERRUPTED = 130
+
+
+class Runner:
+    """Drives an Executor and TransferQueue from a plain polling loop.
+
+    Every `interval` seconds the executor's progress snapshot is written
+    to the database in batches and reported to `output`.
+    """
+
+    def __init__(
+        self,
+        *,
+        workers=10,
+        interval=1.0,
+        as_json=False,
+        output=sys.stdout,
+    ):
+        self.database_queue = TransferQueue(max_workers=workers)
+        self.executor = Executor(self.database_queue, max_workers=workers)
+        self.interval = interval
+        self.as_json = as_json
+        self.output = output
+        self.completed = 0
+        self.errors = 0
+        self.retrying = 0
+        self.processed = 0
+        self.active = 0
+
+    @property
+    def running(self):
+        return (
+            any(thread.is_alive() for thread in self.executor.threads)
+            or self.database_queue.retry_queue.pending
+        )
+
+    def run(self):
+        started = utils.date.now()
+        exit_code = EXIT_OK
+        store.restart_queued_transfers()
+        self.executor.start()
+        try:
+            while self.running:
+                time.sleep(self.interval)
+                self.consume_progress()
+                self.report()
+        except KeyboardInterrupt:
+            exit_code = EXIT_INTERRUPTED
+            self.executor.shutdown()
+        self.consume_progress()
+        errors = store.count_transfers(TransferStatus.ERROR, since=started)
+        if exit_code == EXIT_OK and errors:
+            exit_code = EXIT_ERRORS
+        self.summarize(started, errors, exit_code)
+        return exit_code
+
+    def consume_progress(self):
+        snapshot = self.executor.progress.snapshot()
+        if snapshot.started:
+            store.started_batch_update(snapshot.started)
+        failed, completed = [], []
+        for item in snapshot.finished:
+            if item.status == TransferStatus.ERROR:
+                failed.append(item)
+            else:
+                completed.append(item)
+            self.processed += item.processed
+            self.report_item(item)
+        if failed:
+            store.error_batch_update(failed)
+        if completed:
+            store.completed_batch_update(completed)
+        if snapshot.retrying:
+            store.retry_batch_update(snapshot.retrying)
+            for item in snapshot.retrying:
+                self.report_item(item)
+        self.completed += len(completed)
+        self.errors += len(failed)
+        self.retrying += len(snapshot.retrying)
+        finished = {item.pk for item in snapshot.finished}
+        finished.update(item.pk for item in snapshot.retrying)
+        finished.update(item.pk for item in snapshot.stopped)
+        self.active = sum(1 for pk, *_ in snapshot.rows if pk not in finished)
+
+    def write(self, message):
+        if self.as_json:
+            message = json.dumps(message)
+        print(message, file=self.output, flush=True)
+
+    def report_item(self, item):
+        if self.as_json:
+            self.write({
+                'event': 'transfer',
+                'pk': item.pk,
+                'source': item.source.root,
+                'destination': item.destination.root,
+                'size': item.size,
+                'status': item.status.name.lower(),
+                'attempts': item.attempts,
+                'message': item.message,
+            })
+        elif item.status != TransferStatus.COMPLETED:
+            self.write(
+                f'{item.status.name.title()}: {item.source.root} -> '
+                f'{item.destination.root} | {item.message}'
+            )
+
+    def report(self):
+        if self.as_json:
+            self.write({
+                'event': 'progress',
+                'active': self.active,
+                'completed': self.completed,
+                'errors': self.errors,
+                'retrying': self.retrying,
+                'processed': self.processed,
+            })
+        else:
+            self.write(
+                f'{utils.date.now():%H:%M:%S} | Active: {self.active} | '
+                f'Completed: {self.completed:,} | Errors: {self.errors:,} | '
+                f'Retrying: {self.retrying:,} | '
+                f'{utils.files.bytes_to_human(self.processed)}'
+            )
+
+    def summarize(self, started, errors, exit_code):
+        elapsed = (utils.date.now() - started).total_seconds()
+        if self.as_json:
+            self.write({
+                'event': 'summary',
+                'completed': self.completed,
+                'errors': errors,
+                'processed': self.processed,
+                'seconds': round(elapsed, 3),
+                'exit_code': exit_code,
+            })
+        else:
+            self.write(
+                f'Finished in {elapsed:.1f}s | '
+                f'Completed: {self.completed:,} | Errors: {errors:,} | '
+                f'{utils.files.bytes_to_human(self.processed)}'
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m cirrus.run',
+        description='Transfers every pending item in the transfers queue',
+    )
+    parser.add_argument(
+        '--workers', type=int, default=10,
+        help='The number of concurrent transfers (default: 10)',
+    )
+    parser.add_argument(
+        '--interval', type=float, default=1.0,
+        help='Seconds between progress reports (default: 1.0)',
+    )
+    parser.add_argument(
+        '--json', action='store_true',
+        help='Write progress as one JSON object per line',
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S %p',
+        filename=settings.LOG,
+        encoding='utf-8',
+        filemode='a',
+        level=logging.INFO,
+    )
+    try:
+        store.setup()
+    except sqlite3.Error as e:
+        store.critical_msg('setup', str(e))
+        return EXIT_FAILED
+    runner = Runner(
+        workers=max(args.workers, 1),
+        interval=args.interval,
+        as_json=args.json,
+    )
+    return runner.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
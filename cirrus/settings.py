@@ -2,9 +2,9 @@ import json
 import logging
 import os
 
-from PySide6.QtCore import QReadWriteLock
+from cirrus.utils.threads import ReadWriteLock
 
-RW_LOCK = QReadWriteLock()
+RW_LOCK = ReadWriteLock()
 
 ROOT = os.path.abspath(os.path.dirname(__file__))
 DATA_DIR = os.path.join(ROOT, 'data')
@@ -13,6 +13,8 @@ ICON_DIR = os.path.join(ROOT, 'icons')
 os.makedirs(ICON_DIR, exist_ok=True)
 SETUP = os.path.join(DATA_DIR, 'setup.json')
 DATABASE = os.path.join(DATA_DIR, 'cirrus.db')
+LISTING_CACHE = os.path.join(DATA_DIR, 'listings.db')
+SEARCH_INDEX = os.path.join(DATA_DIR, 'search.db')
 LOG = os.path.join(ROOT, 'logs', 'cirrus.log')
 os.makedirs(os.path.dirname(LOG), exist_ok=True)
 SESSION_DATA = dict()  # TODO: switch to protected class approach
@@ -57,6 +59,20 @@ def update_transfer_window_status(status):
     RW_LOCK.unlock()
 
 
+def search_index_enabled():
+    data = read_settings_data()
+    return data.get('Use Search Index', True)
+
+
+def update_search_index_status(status):
+    RW_LOCK.lockForWrite()
+    data = read_settings_data(no_lock=True)
+    data['Use Search Index'] = bool(status)
+    with open(SETUP, 'w', encoding='utf8') as f:
+        json.dump(data, f)
+    RW_LOCK.unlock()
+
+
 def append_panel(panel):
     RW_LOCK.lockForWrite()
     data = read_settings_data(no_lock=True)
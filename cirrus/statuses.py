@@ -32,3 +32,25 @@ class TransferPriority(Enum):
 
 class FileStatus(Enum):
     pass
+
+
+class ErrorCategory(Enum):
+    THROTTLING = 1
+    SERVER = 2
+    CONNECTION = 3
+    AUTH = 4
+    NOT_FOUND = 5
+    UNKNOWN = 6
+
+    @property
+    def retryable(self):
+        return self in {
+            ErrorCategory.THROTTLING,
+            ErrorCategory.SERVER,
+            ErrorCategory.CONNECTION,
+        }
+
+    @property
+    def label(self):
+        """The category as shown in transfer messages, e.g., 'Not Found'"""
+        return self.name.replace('_', ' ').title()
@@ -1,7 +1,5 @@
 import datetime
 
-from PySide6.QtCore import Qt
-
 
 TIMEZONE = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
 
@@ -23,6 +21,7 @@ def to_iso(timestamp):
 
 
 def qdatetime_to_iso(timestamp):
+    from PySide6.QtCore import Qt
     return datetime.datetime.fromisoformat(
         timestamp.toString(Qt.ISODate)
     )
@@ -19,7 +19,7 @@ def bytes_to_human(size):
 
 
 def human_to_bytes(num_size):
-    size_re = re.compile(r'^([\d\.]*)\s?([A-Z]*)', re.IGNORCASE)
+    size_re = re.compile(r'^([\d\.]*)\s?([A-Z]*)', re.IGNORECASE)
     if search := size_re.search(num_size):
         num, size = search.groups()
         num = float(num)
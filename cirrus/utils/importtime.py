@@ -0,0 +1,144 @@
+"""Checks that the core modules stay light to import.
+
+    python -m cirrus.utils.importtime [--runs 3]
+
+Each module is imported in a fresh interpreter with `python -X importtime`
+and the best cumulative time of --runs attempts is reported. The times
+vary too much between machines and runs to fail on, so they are only
+printed.
+
+Modules in NO_QT must not import PySide6, boto3, botocore, or keyring at
+all. Exits with 1 if one of them does or if any module fails to import.
+The only exception is a module outside NO_QT that fails because an
+OPTIONAL dependency is not installed, e.g., PySide6 on a headless
+machine. It is skipped.
+"""
+import argparse
+import re
+import subprocess
+import sys
+
+
+MODULES = (
+    'cirrus.settings',
+    'cirrus.items',
+    'cirrus.cache',
+    'cirrus.fetcher',
+    'cirrus.filters',
+    'cirrus.index',
+    'cirrus.watcher',
+    'cirrus.core.store',
+    'cirrus.core.pipeline',
+    'cirrus.core.scheduler',
+    'cirrus.core.executor',
+    'cirrus.run',
+    'cirrus.database',
+    'cirrus.executor',
+)
+NO_QT = {
+    'cirrus.settings',
+    'cirrus.items',
+    'cirrus.cache',
+    'cirrus.fetcher',
+    'cirrus.filters',
+    'cirrus.index',
+    'cirrus.watcher',
+    'cirrus.core.store',
+    'cirrus.core.pipeline',
+    'cirrus.core.scheduler',
+    'cirrus.core.executor',
+    'cirrus.run',
+}
+HEAVY_MODULES = ('PySide6', 'boto3', 'botocore', 'keyring')
+# Packages whose absence skips the modules outside NO_QT
+OPTIONAL = ('PySide6',)
+MISSING = re.compile(r"ModuleNotFoundError: No module named '([\w.]+)'")
+
+
+def import_time(module):
+    """Returns the cumulative import time of `module` in milliseconds,
+    the set of every module it imported, and None. If it could not be
+    imported, returns None, an empty set, and the error
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode:
+        lines = process.stderr.strip().splitlines()
+        return None, set(), lines[-1] if lines else (
+            f'exit status {process.returncode}'
+        )
+    imported = set()
+    cumulative = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            _, cumulative_us, name = line.split('|')
+            cumulative_us = int(cumulative_us)
+        except ValueError:
+            # Header line
+            continue
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            cumulative = cumulative_us
+    return cumulative / 1_000, imported, None
+
+
+def optional_missing(module, error):
+    """Returns the OPTIONAL package `module` failed to import with
+    `error` for, or None if the failure counts"""
+    if module in NO_QT or (match := MISSING.search(error)) is None:
+        return None
+    package = match.group(1).split('.')[0]
+    return package if package in OPTIONAL else None
+
+
+def check(modules, *, runs=3):
+    """Prints a report for `modules` and returns True if every module
+    could be imported and none in NO_QT imports a HEAVY_MODULES package
+    """
+    passed = True
+    for module in modules:
+        times = []
+        imported, error = set(), None
+        for _ in range(runs):
+            elapsed, imported, error = import_time(module)
+            if elapsed is None:
+                break
+            times.append(elapsed)
+        if not times:
+            if package := optional_missing(module, error):
+                print(f'{module:<24} needs {package}. Skipped')
+                continue
+            passed = False
+            print(f'{module:<24} could not be imported FAIL')
+            print(f'{"":<24} {error}')
+            continue
+        heavy = sorted(
+            name for name in imported
+            if name.split('.')[0] in HEAVY_MODULES
+        )
+        ok = not (module in NO_QT and heavy)
+        passed = passed and ok
+        print(f'{module:<24} {min(times):8.1f} ms {"OK" if ok else "FAIL"}')
+        if not ok:
+            print(f'{"":<24} imports {", ".join(heavy[:5])}')
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m cirrus.utils.importtime')
+    parser.add_argument(
+        'modules', nargs='*', default=list(MODULES),
+        help='Modules to check (default: every module in MODULES)',
+    )
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+    unknown = set(args.modules) - set(MODULES)
+    if unknown:
+        parser.error(f'Not checked: {", ".join(sorted(unknown))}')
+    sys.exit(0 if check(args.modules, runs=args.runs) else 1)
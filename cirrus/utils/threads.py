@@ -1,5 +1,8 @@
-from functools import wraps
+import collections
 import threading
+import time
+
+from functools import wraps
 
 
 def assert_is_main_thread():
@@ -13,3 +16,111 @@ def decorator_assert_is_main_thread(func):
         result = func(*args, **kwargs)
         return result
     return cb
+
+
+class ReadWriteLock:
+    """A threading based lock with the QReadWriteLock API used by
+    cirrus.settings. Many readers or a single writer may hold the lock.
+    Waiting writers block new readers. The lock is not recursive.
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__readers = 0
+        self.__writer = False
+        self.__writers_waiting = 0
+
+    def lockForRead(self):
+        with self.__condition:
+            while self.__writer or self.__writers_waiting:
+                self.__condition.wait()
+            self.__readers += 1
+
+    def lockForWrite(self):
+        with self.__condition:
+            self.__writers_waiting += 1
+            try:
+                while self.__writer or self.__readers:
+                    self.__condition.wait()
+            finally:
+                self.__writers_waiting -= 1
+            self.__writer = True
+
+    def unlock(self):
+        with self.__condition:
+            if self.__writer:
+                self.__writer = False
+            elif self.__readers:
+                self.__readers -= 1
+            else:
+                raise RuntimeError('unlock() called on an unlocked lock')
+            self.__condition.notify_all()
+
+
+class BatchQueue:
+    """A queue that `producers` threads put items into and one consumer
+    takes out in batches.
+
+    put blocks while `maxsize` items are waiting. The queue closes once
+    every producer has called done, or when close is called, after which
+    put drops its item and returns False.
+    """
+
+    def __init__(self, *, producers=1, batch_size=100, maxsize=10_000):
+        self.batch_size = batch_size
+        self.maxsize = maxsize
+        self.__condition = threading.Condition()
+        self.__items = collections.deque()
+        self.__producers = producers
+        self.__closed = producers <= 0
+
+    @property
+    def closed(self):
+        with self.__condition:
+            return self.__closed
+
+    def put(self, item):
+        with self.__condition:
+            while not self.__closed and len(self.__items) >= self.maxsize:
+                self.__condition.wait()
+            if self.__closed:
+                return False
+            self.__items.append(item)
+            if len(self.__items) >= self.batch_size:
+                self.__condition.notify_all()
+            return True
+
+    def done(self):
+        """Marks one producer as finished"""
+        with self.__condition:
+            self.__producers -= 1
+            if self.__producers <= 0:
+                self.__closed = True
+                self.__condition.notify_all()
+
+    def close(self):
+        """Closes the queue early, waking every blocked thread. Items
+        already queued can still be taken"""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def get_batch(self, timeout=None):
+        """Returns up to batch_size items once that many are queued,
+        `timeout` seconds have passed, or the queue is closed. Returns
+        None once the queue is closed and empty"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            while not self.__closed and len(self.__items) < self.batch_size:
+                if deadline is None:
+                    self.__condition.wait()
+                elif (remaining := deadline - time.monotonic()) > 0:
+                    self.__condition.wait(remaining)
+                else:
+                    break
+            if self.__closed and not self.__items:
+                return None
+            count = min(self.batch_size, len(self.__items))
+            batch = [self.__items.popleft() for _ in range(count)]
+            self.__condition.notify_all()
+            return batch
@@ -13,6 +13,7 @@ from cirrus.models import (
 )
 from cirrus.widgets import NavBarLineEdit
 from cirrus.validators import LocalPathValidator
+from cirrus.watcher import local_watcher
 
 from PySide6.QtCore import (
     Qt,
@@ -20,7 +21,9 @@ from PySide6.QtCore import (
     QItemSelection,
     QItemSelectionModel,
     QModelIndex,
+    QPoint,
     QThreadPool,
+    QTimer,
     Signal,
     Slot,
 )
@@ -32,6 +35,7 @@ from PySide6.QtGui import (
 )
 from PySide6.QtWidgets import (
     QAbstractItemView,
+    QFileSystemModel,
     QHBoxLayout,
     QHeaderView,
     QLabel,
@@ -271,8 +275,19 @@ class FileListingTreeView(QTreeView):
         raise NotImplementedError('Must specificy refrresh() in a subclass')
 
 
+def _release_watches(watcher, emit, watched):
+    """Undoes the watches of a LocalFileListingView once it is deleted"""
+    watcher.changed.disconnect(emit)
+    for path in watched:
+        watcher.unwatch(path, recursive=False)
+    watched.clear()
+
+
 class LocalFileListingView(FileListingTreeView):
-    # TODO: Turn off auto updating. It's very slow
+    # Folders are watched with a LocalWatcher where inotify is available,
+    # which coalesces bursts of changes, instead of QFileSystemModel's
+    # own watcher. Only the changed folders are listed again
+    paths_changed = Signal(list)
 
     def __init__(self, client, parent=None):
         super().__init__(parent)
@@ -284,11 +299,17 @@ class LocalFileListingView(FileListingTreeView):
         self.client = client
         self.location_bar = None
         self.info_bar = None
-        model = LocalFileSystemModel()
-        model.setFilter(
-            QDir.AllEntries | QDir.NoDotAndDotDot | QDir.AllDirs | QDir.Hidden
-        )
-        model.setRootPath(self.root)
+        # Folders loaded by the model and watched for it
+        self.watched = set()
+        self.watcher = local_watcher()
+        if self.watcher is not None:
+            emit = self.paths_changed.emit
+            self.watcher.changed.connect(emit)
+            self.paths_changed.connect(self.apply_changes)
+            self.destroyed.connect(
+                partial(_release_watches, self.watcher, emit, self.watched)
+            )
+        model = self.create_model()
         self.setModel(model)
         self.setRootIndex(model.index(self.root))
         self.setup_header()
@@ -302,12 +323,23 @@ class LocalFileListingView(FileListingTreeView):
     def clone(cls, client, parent):
         return cls(client, parent=parent)
 
-    def refresh(self):
+    def create_model(self):
         model = LocalFileSystemModel()
         model.setFilter(
             QDir.AllEntries | QDir.NoDotAndDotDot | QDir.AllDirs | QDir.Hidden
         )
+        if self.watcher is not None:
+            model.setOption(QFileSystemModel.Option.DontWatchForChanges)
+            model.directoryLoaded.connect(self.directory_loaded)
         model.setRootPath(self.root)
+        return model
+
+    def refresh(self):
+        if self.watcher is not None:
+            for path in self.watched:
+                self.watcher.unwatch(path, recursive=False)
+            self.watched.clear()
+        model = self.create_model()
         prev_model = self.model()
         prev_selection_model = self.selectionModel()
         self.setModel(model)
@@ -320,6 +352,24 @@ class LocalFileListingView(FileListingTreeView):
         if prev_selection_model:
             prev_selection_model.deleteLater()
 
+    @Slot(str)
+    def directory_loaded(self, path):
+        if path not in self.watched:
+            self.watched.add(path)
+            self.watcher.watch(path, recursive=False)
+
+    @Slot(list)
+    def apply_changes(self, paths):
+        """Lists the folders the view shows that `paths` changed again,
+        updating only the rows that differ"""
+        folders = set()
+        for path in paths:
+            for folder in (path, os.path.dirname(path)):
+                if folder in self.watched:
+                    folders.add(folder)
+        if folders:
+            self.model().refresh_directories(sorted(folders))
+
     @Slot()
     def change_dir(self):
         if (location := self.location_bar.text()) != self.root:
@@ -393,7 +443,8 @@ class LocalFileListingView(FileListingTreeView):
 
 
 class BaseS3FileListingView(FileListingTreeView):
-    # TODO: On-hover starting fetch_children w/ tracking for start/stop
+    # Milliseconds without scrolling or new rows before prefetching
+    PREFETCH_DELAY = 150
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -401,6 +452,60 @@ class BaseS3FileListingView(FileListingTreeView):
         self.info_bar = None
         self.client = None
         self.root = None
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(self.PREFETCH_DELAY)
+        self.prefetch_timer.timeout.connect(self.prefetch_visible)
+        self.verticalScrollBar().valueChanged.connect(self.schedule_prefetch)
+
+    def setModel(self, model):
+        super().setModel(model)
+        if model is not None:
+            model.rowsInserted.connect(self.schedule_prefetch)
+
+    def rowsAboutToBeRemoved(self, parent, start, end):
+        # Rows are inserted above the "Fetching..." row, so if it was
+        # current, removing it would make the last row current and
+        # scroll to it
+        current = self.currentIndex()
+        if (
+            current.parent() == parent
+            and start <= current.row() <= end
+            and not current.flags() & Qt.ItemIsSelectable
+        ):
+            self.selectionModel().setCurrentIndex(
+                current.siblingAtRow(0), QItemSelectionModel.NoUpdate
+            )
+        super().rowsAboutToBeRemoved(parent, start, end)
+
+    @Slot()
+    def schedule_prefetch(self):
+        self.prefetch_timer.start()
+
+    @Slot()
+    def prefetch_visible(self):
+        """Prefetches the unexpanded folders in view and, once fewer than
+        a page of rows are left below the view, the next page of the
+        folder at the bottom"""
+        if (model := self.model()) is None:
+            return
+        bottom = self.viewport().height()
+        index = self.indexAt(QPoint(0, 0))
+        folders = []
+        last = None
+        while index.isValid() and self.visualRect(index).top() < bottom:
+            if model.hasChildren(index) and not self.isExpanded(index):
+                folders.append(index)
+            last = index
+            index = self.indexBelow(index)
+        model.prefetch(folders)
+        while last is not None and last.isValid():
+            parent = last.parent()
+            if model.has_more(parent):
+                if model.rowCount(parent) - last.row() <= model.max_keys:
+                    model.list_more(parent)
+                break
+            last = parent
 
     @classmethod
     def clone(cls, client, parent):
@@ -408,16 +513,15 @@ class BaseS3FileListingView(FileListingTreeView):
 
     @Slot(QModelIndex)
     def item_double_clicked(self, index):
-        if item := index.model().itemFromIndex(index):
-            if data := item.data():
-                if data.is_dir:
-                    self.location_bar_change.emit(data.root)
+        if item := index.model().item_from_index(index):
+            if item.is_dir:
+                self.location_bar_change.emit(item.root)
 
     def contextMenuEvent(self, event):
         files, folders = [], []
         for index in self.selectedIndexes():
             if index.column() == 0:
-                if item := index.model().itemFromIndex(index).data():
+                if item := index.model().item_from_index(index):
                     if item.is_dir:
                         folders.append(item)
                     else:
@@ -434,13 +538,12 @@ class BaseS3FileListingView(FileListingTreeView):
             if index.column() == 0:
                 if model is None:
                     model = index.model()
-                if item := model.itemFromIndex(index):
-                    if data := item.data():
-                        if data.is_dir:
-                            folders.append(item)
-                        else:
-                            files.append(data.key)
-                            filesize_selected += data.size
+                if item := model.item_from_index(index):
+                    if item.is_dir:
+                        folders.append(item)
+                    else:
+                        files.append(item.key)
+                        filesize_selected += item.size
         output = ''
         if files:
             filesize_selected = utils.files.bytes_to_human(filesize_selected)
@@ -495,6 +598,10 @@ class S3FileListingView(BaseS3FileListingView):
         return 's3'
 
     def refresh(self):
+        if (model := self.model()) and model.client['Root'] == self.root:
+            # Same location, so the listing is diffed into the tree
+            model.refresh()
+            return
         self.collapsed.disconnect()
         self.expanded.disconnect()
         model = S3FilesTreeModel(client=self.client)
@@ -535,6 +642,10 @@ class DigitalOceanFileListingView(BaseS3FileListingView):
         return 'digital ocean'
 
     def refresh(self):
+        if (model := self.model()) and model.client['Root'] == self.root:
+            # Same location, so the listing is diffed into the tree
+            model.refresh()
+            return
         self.collapsed.disconnect()
         self.expanded.disconnect()
         model = DigitalOceanFilesTreeModel(client=self.client)
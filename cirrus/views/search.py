@@ -3,7 +3,6 @@ from cirrus.delegates import CheckBoxDelegate
 from PySide6.QtCore import (
     Qt,
     QModelIndex,
-    QItemSelectionModel,
     Signal,
     Slot,
 )
@@ -11,6 +10,8 @@ from PySide6.QtGui import QKeyEvent
 from PySide6.QtWidgets import (
     QAbstractItemView,
     QHeaderView,
+    QStyle,
+    QStyleOptionViewItem,
     QTreeView,
 )
 
@@ -25,6 +26,9 @@ class SearchResultsTreeView(QTreeView):
         super().__init__()
         self.shift_down = False
         self.last_checked_index = QModelIndex()
+        # Rows hidden by setRowHidden, so they need not be looked up one
+        # row at a time
+        self.hidden_rows = set()
         self.setExpandsOnDoubleClick(False)
         self.setUniformRowHeights(True)
         self.setAnimated(False)
@@ -62,64 +66,79 @@ class SearchResultsTreeView(QTreeView):
 
     @Slot(QModelIndex)
     def toggle_checkbox(self, index):
-        if index.isValid() and index.column() == 0:
-            indexes = [index]
-            if self.shift_down and self.last_checked_index.isValid():
-                data = self.last_checked_index.data()
-                if index.row() > self.last_checked_index.row():
-                    indexes_range = range(
-                        self.last_checked_index.row(), index.row()
-                    )
-                else:
-                    indexes_range = range(
-                        index.row(), self.last_checked_index.row()
-                    )
-                for row in indexes_range:
-                    indexes.append(self.model().index(row, 0))
-            else:
-                data = index.data()
-            if data == Qt.Checked.value:
-                check = Qt.Checked
-            else:
-                check = Qt.Unchecked
-            self.last_checked_index = index
-            top = None
-            bottom = None
-            for index in indexes:
-                if index.model().setData(index, check, role=Qt.CheckStateRole):
-                    if check == Qt.Checked:
-                        self.checked.emit()
-                        self.selectionModel().select(
-                            index,
-                            QItemSelectionModel.Rows |
-                            QItemSelectionModel.Select
-                        )
-                    else:
-                        self.unchecked.emit()
-                        self.selectionModel().select(
-                            index,
-                            QItemSelectionModel.Rows |
-                            QItemSelectionModel.Deselect
-                        )
-                    if top is None or top.row() > index.row():
-                        top = index
-                    if bottom is None or bottom.row() < index.row():
-                        bottom = index
-            index.model().dataChanged.emit(top, bottom)
-            index = index.siblingAtRow(0)
-            if check == Qt.Unchecked:
-                if not self.model().match(
-                    index,
-                    Qt.CheckStateRole,
-                    Qt.Checked.value,
-                    flags=Qt.MatchExactly
-                ):
-                    self.all_unchecked.emit()
+        # The delegate has already toggled the clicked checkbox, so with
+        # shift held its new state is given to the rows up to the last
+        # one clicked
+        model = self.model()
+        if not index.isValid() or index.column() != 0:
+            return
+        if model.message is not None:
+            return
+        check = model.is_checked(index.row())
+        first = last = index.row()
+        if self.shift_down and self.last_checked_index.isValid():
+            first = min(first, self.last_checked_index.row())
+            last = max(last, self.last_checked_index.row())
+        self.last_checked_index = index
+        self.check_rows([(first, last)], check)
+
+    def dataChanged(self, top_left, bottom_right, roles=()):
+        # Only the checkboxes changed, so the rows are repainted without
+        # QTreeView going over every row in the range for children
+        if list(roles) == [Qt.CheckStateRole]:
+            self.viewport().update()
+            return
+        super().dataChanged(top_left, bottom_right, roles)
+
+    def drawRow(self, painter, option, index):
+        # Checked rows are drawn as selected instead of selecting them,
+        # which is linear in the rows selected
+        model = self.model()
+        if model.message is None and model.is_checked(index.row()):
+            option = QStyleOptionViewItem(option)
+            option.state |= QStyle.State_Selected
+        super().drawRow(painter, option, index)
+
+    def setModel(self, model):
+        self.hidden_rows.clear()
+        super().setModel(model)
+
+    def reset(self):
+        self.hidden_rows.clear()
+        super().reset()
+
+    def setRowHidden(self, row, parent, hide):
+        if not parent.isValid():
+            if hide:
+                self.hidden_rows.add(row)
             else:
-                if not self.model().match(
-                    index,
-                    Qt.CheckStateRole,
-                    Qt.Unchecked.value,
-                    flags=Qt.MatchExactly
-                ):
-                    self.all_checked.emit()
+                self.hidden_rows.discard(row)
+        super().setRowHidden(row, parent, hide)
+
+    def visible_ranges(self):
+        """Returns the (first, last) ranges of the rows that are not
+        hidden"""
+        ranges, first = [], 0
+        for row in sorted(self.hidden_rows):
+            if row > first:
+                ranges.append((first, row - 1))
+            first = row + 1
+        if first < (rows := self.model().rowCount()):
+            ranges.append((first, rows - 1))
+        return ranges
+
+    def check_rows(self, ranges, check):
+        """Checks or unchecks the (first, last) `ranges` of rows"""
+        model = self.model()
+        if model.message is not None:
+            return
+        for first, last in ranges:
+            model.set_range_checked(first, last, check)
+        if check:
+            self.checked.emit()
+            if model.all_checked():
+                self.all_checked.emit()
+        else:
+            self.unchecked.emit()
+            if not model.checked_count:
+                self.all_unchecked.emit()
@@ -0,0 +1,390 @@
+"""Watches local folders for changes with Linux inotify.
+
+    watcher = local_watcher()
+    if watcher is not None:
+        watcher.changed.connect(print)
+        watcher.watch('/home/me/Documents')
+
+A folder is watched by itself or, if `recursive`, with every folder under
+it, including those created or moved in later. Events are read on one
+thread and coalesced: the changed paths are collected until no event has
+arrived for COALESCE_DELAY seconds, or for at most COALESCE_MAX seconds
+during a long burst, and `changed` is emitted once with all of them. If
+the kernel drops events, `lost` is emitted with the roots that may have
+missed changes.
+
+local_watcher returns None where inotify is not available.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from cirrus.core.events import Event
+
+
+# Seconds without events before the changes are emitted, and the most
+# seconds a burst of events is held
+COALESCE_DELAY = 0.2
+COALESCE_MAX = 1.0
+# Most folders watched under one recursive root. inotify watches are a
+# per-user kernel resource, so larger trees are not kept live
+MAX_WATCHES = 50_000
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+# struct inotify_event without its name
+EVENT = struct.Struct('iIII')
+
+_WATCHER = None
+_WATCHER_LOCK = threading.Lock()
+
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def local_watcher():
+    """Returns the shared LocalWatcher, or None if inotify is not
+    available"""
+    global _WATCHER
+    with _WATCHER_LOCK:
+        if _WATCHER is None:
+            if (libc := _libc()) is None:
+                _WATCHER = False
+            else:
+                try:
+                    _WATCHER = LocalWatcher(libc=libc)
+                except OSError as e:
+                    logging.warn(f'Local folders will not be watched: {e}')
+                    _WATCHER = False
+        return _WATCHER or None
+
+
+def _under(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class LocalWatcher:
+    """Watches local folders with one inotify instance.
+
+    Folders are reference counted by (root, recursive), so every watch
+    must be matched by an unwatch.
+    """
+
+    def __init__(
+        self,
+        *,
+        libc=None,
+        delay=COALESCE_DELAY,
+        max_delay=COALESCE_MAX,
+        max_watches=MAX_WATCHES,
+    ):
+        self.libc = _libc() if libc is None else libc
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_watches = max_watches
+        self.changed = Event()
+        self.lost = Event()
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.__lock = threading.RLock()
+        # Watched folders by watch descriptor and the reverse
+        self.__paths = dict()
+        self.__wds = dict()
+        # Reference counts by (root, recursive)
+        self.__roots = dict()
+        # When each root was completely watched, or None if it is not
+        self.__since = dict()
+        self.__pending = set()
+        self.__first = self.__last = 0
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__read_events, name='local_watcher', daemon=True
+        )
+        self.__thread.start()
+
+    def watch(self, root, *, recursive=True):
+        """Starts watching `root`, and every folder under it if
+        `recursive`. Returns False if it could not be watched
+        completely, in which case none of it is watched.
+
+        The folders are scanned without holding the lock, so events are
+        still read meanwhile.
+        """
+        root = os.path.abspath(root)
+        key = (root, recursive)
+        with self.__lock:
+            if key in self.__roots:
+                self.__roots[key] += 1
+                return self.__since[key] is not None
+            self.__roots[key] = 1
+            self.__since[key] = None
+        complete, added = self.__add(root, recursive=recursive, key=key)
+        with self.__lock:
+            if key not in self.__roots:
+                # Unwatched while it was being added
+                complete = False
+            elif complete:
+                self.__since[key] = time.time()
+            else:
+                # A partial watch would only use up the per-user budget
+                del self.__roots[key]
+                del self.__since[key]
+            if not complete:
+                for path in added:
+                    if not self.__covered(path):
+                        self.__remove(path)
+        return complete
+
+    def unwatch(self, root, *, recursive=True):
+        """Stops watching `root` once every watch of it is undone"""
+        root = os.path.abspath(root)
+        with self.__lock:
+            key = (root, recursive)
+            if key not in self.__roots:
+                return
+            self.__roots[key] -= 1
+            if self.__roots[key]:
+                return
+            del self.__roots[key]
+            del self.__since[key]
+            for path in [p for p in self.__wds if _under(p, root)]:
+                if not self.__covered(path):
+                    self.__remove(path)
+
+    def live_since(self, path, *, recursive=True):
+        """Returns since when every change to `path`, and everything under
+        it if `recursive`, has been seen, or None if not all of them
+        are"""
+        path = os.path.abspath(path)
+        times = []
+        with self.__lock:
+            for (root, root_recursive), since in self.__since.items():
+                if since is None:
+                    continue
+                if root_recursive and _under(path, root):
+                    times.append(since)
+                elif not recursive and root == path:
+                    times.append(since)
+        return min(times) if times else None
+
+    def close(self):
+        self.__stopped.set()
+        self.__thread.join()
+        os.close(self.fd)
+
+    def __covered(self, path):
+        for root, recursive in self.__roots:
+            if root == path or (recursive and _under(path, root)):
+                return True
+        return False
+
+    def __recursive(self, path):
+        return any(
+            recursive and _under(path, root)
+            for root, recursive in self.__roots
+        )
+
+    def __add(self, top, *, recursive, changes=None, key=None):
+        """Watches `top`, and the folders under it if `recursive`. The
+        files found are added to `changes`. Returns whether every folder
+        was watched and the folders watched by this call.
+
+        The lock is only held while a watch is added. If `key` stops
+        being watched meanwhile, no more folders are.
+        """
+        complete, added = True, []
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            with self.__lock:
+                if key is not None and key not in self.__roots:
+                    return False, added
+                if path not in self.__wds:
+                    if len(added) >= self.max_watches:
+                        logging.warn(
+                            f'Not watching every folder under {top}'
+                        )
+                        return False, added
+                    wd = self.libc.inotify_add_watch(
+                        self.fd, os.fsencode(path), MASK
+                    )
+                    if wd < 0:
+                        code = ctypes.get_errno()
+                        if code == errno.ENOSPC:
+                            logging.warn(
+                                f'Out of inotify watches while watching '
+                                f'{top}'
+                            )
+                            return False, added
+                        if code not in (errno.ENOENT, errno.ENOTDIR):
+                            logging.warn(
+                                f'Failed to watch {path}: '
+                                f'{os.strerror(code)}'
+                            )
+                        complete = False
+                        continue
+                    self.__paths[wd] = path
+                    self.__wds[path] = wd
+                    added.append(path)
+            if not recursive and changes is None:
+                continue
+            try:
+                with os.scandir(path) as scanner:
+                    for entry in scanner:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if recursive:
+                                    stack.append(entry.path)
+                            elif changes is not None:
+                                changes.add(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return complete, added
+
+    def __remove(self, path):
+        if (wd := self.__wds.pop(path, None)) is not None:
+            self.__paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def __forget(self, top):
+        """Drops the watches of `top` and every folder under it, e.g.,
+        after it was moved away"""
+        for path in [p for p in self.__wds if _under(p, top)]:
+            self.__remove(path)
+
+    def __read_events(self):
+        while not self.__stopped.is_set():
+            with self.__lock:
+                pending = bool(self.__pending)
+                first, last = self.__first, self.__last
+            timeout = 0.5
+            if pending:
+                due = min(last + self.delay, first + self.max_delay)
+                timeout = max(0, min(timeout, due - time.monotonic()))
+            try:
+                ready, _, _ = select.select([self.fd], [], [], timeout)
+            except (OSError, ValueError):
+                break
+            if ready:
+                self.__read()
+            self.__flush()
+
+    def __read(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logging.warn(f'Failed to read inotify events: {e}')
+            return
+        now = time.monotonic()
+        overflowed = False
+        with self.__lock:
+            changes = set()
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+                if (folder := self.__paths.get(wd)) is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self.__paths.pop(wd, None)
+                    self.__wds.pop(folder, None)
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    changes.add(folder)
+                    continue
+                path = os.path.join(folder, os.fsdecode(name))
+                changes.add(path)
+                if mask & IN_ISDIR:
+                    if mask & IN_MOVED_FROM:
+                        self.__forget(path)
+                    elif mask & (IN_CREATE | IN_MOVED_TO) and (
+                        self.__recursive(path)
+                    ):
+                        # Files may be written before its watch is added
+                        _ = self.__add(
+                            path, recursive=True, changes=changes
+                        )
+            if changes:
+                if not self.__pending:
+                    self.__first = now
+                self.__last = now
+                self.__pending.update(changes)
+            if overflowed:
+                logging.warn('inotify queue overflowed, changes were lost')
+                roots = sorted({root for root, _ in self.__roots})
+                restarted = time.time()
+                for key, since in self.__since.items():
+                    if since is not None:
+                        self.__since[key] = restarted
+        if overflowed:
+            self.lost.emit(roots)
+
+    def __flush(self):
+        with self.__lock:
+            if not self.__pending:
+                return
+            now = time.monotonic()
+            if (
+                now - self.__last < self.delay
+                and now - self.__first < self.max_delay
+            ):
+                return
+            changes = sorted(self.__pending)
+            self.__pending.clear()
+        self.changed.emit(changes)
@@ -1,7 +1,8 @@
+import datetime
 import logging
 import os
 
-from cirrus import utils, windows
+from cirrus import filters, utils, windows
 from cirrus.models import ListModel
 
 from PySide6.QtCore import (
@@ -31,10 +32,13 @@ from PySide6.QtWidgets import (
 
 
 class FileFilters(QWidget):
+    # Emitted with False while a glob or regex does not compile
+    validity_changed = Signal(bool)
 
     def __init__(self, *, parent=None, window=None):
         super().__init__(parent)
         self.window = window
+        self.valid = True
 
         # Name Field
         __name = self.setup_name_selection()
@@ -45,6 +49,10 @@ class FileFilters(QWidget):
         self.file_types = __ftypes[0]
         self.file_types_option = __ftypes[1]
         self.file_types_layout = __ftypes[2]
+        for field in (self.name, self.file_types):
+            field.textChanged.connect(self.check_patterns)
+        for option in (self.name_option, self.file_types_option):
+            option.currentIndexChanged.connect(self.check_patterns)
 
         # Creation Time Field
         __ctime = self.setup_ctime_selection()
@@ -95,19 +103,23 @@ class FileFilters(QWidget):
     def setup_name_selection(self):
         layout = QHBoxLayout()
         options = [
-            ('Contains', name_contains),
-            ('Does Not Contain', name_does_not_contain),
-            ('Equals', name_equals),
-            ('Starts with', name_starts_with),
-            ('Ends with', name_ends_with),
+            ('Contains', filters.CONTAINS),
+            ('Does Not Contain', filters.NOT_CONTAINS),
+            ('Equals', filters.EQUALS),
+            ('Starts with', filters.STARTS_WITH),
+            ('Ends with', filters.ENDS_WITH),
+            ('Matches Glob', filters.MATCHES_GLOB),
+            ('Matches Regex', filters.MATCHES_REGEX),
         ]
         name_option = QComboBox()
         for index, option in enumerate(options):
-            text, func = option
+            text, key = option
             name_option.addItem(text)
-            name_option.setItemData(index, func)
+            name_option.setItemData(index, key)
         name = QLineEdit()
-        name.setPlaceholderText('File types will be ignored')
+        name.setPlaceholderText(
+            'File types are ignored, except by globs and regexes'
+        )
         layout.addWidget(name_option)
         layout.addWidget(name)
         return name, name_option, layout
@@ -116,20 +128,22 @@ class FileFilters(QWidget):
         layout = QHBoxLayout()
         file_types_option = QComboBox()
         options = [
-            ('Equals', extension_equals),
-            ('Not Equal', extension_not_equals),
-            ('Contains', extension_contains),
-            ('Does Not Contain', extension_does_not_contain),
-            ('Starts with', extension_starts_with),
-            ('Ends with', extension_ends_with),
+            ('Equals', filters.EQUALS),
+            ('Not Equal', filters.NOT_EQUALS),
+            ('Contains', filters.CONTAINS),
+            ('Does Not Contain', filters.NOT_CONTAINS),
+            ('Starts with', filters.STARTS_WITH),
+            ('Ends with', filters.ENDS_WITH),
+            ('Matches Glob', filters.MATCHES_GLOB),
+            ('Matches Regex', filters.MATCHES_REGEX),
         ]
         for index, option in enumerate(options):
-            text, func = option
+            text, key = option
             file_types_option.addItem(text)
-            file_types_option.setItemData(index, func)
+            file_types_option.setItemData(index, key)
         file_types = QLineEdit()
         file_types.setPlaceholderText(
-            'Seperated by commas, e.g., .jpg,png. Case insensitive.'
+            'Separated by commas, e.g., .jpg,png. Case insensitive.'
         )
         layout.addWidget(file_types_option)
         layout.addWidget(file_types)
@@ -144,14 +158,14 @@ class FileFilters(QWidget):
         }
         ctime_option = QComboBox()
         options = [
-            ('Within Last', within_last_ctime),
-            ('Before', before_ctime),
-            ('After', after_ctime),
+            ('Within Last', filters.WITHIN_LAST),
+            ('Before', filters.BEFORE),
+            ('After', filters.AFTER),
         ]
         for index, option in enumerate(options):
-            text, func = option
+            text, key = option
             ctime_option.addItem(text)
-            ctime_option.setItemData(index, func)
+            ctime_option.setItemData(index, key)
         ctime = QSpinBox()
         ctime.setMinimum(0)
         ctime.setMaximum(999)
@@ -173,14 +187,14 @@ class FileFilters(QWidget):
         }
         mtime_option = QComboBox()
         options = [
-            ('Within Last', within_last_mtime),
-            ('Before', before_mtime),
-            ('After', after_mtime),
+            ('Within Last', filters.WITHIN_LAST),
+            ('Before', filters.BEFORE),
+            ('After', filters.AFTER),
         ]
         for index, option in enumerate(options):
-            text, func = option
+            text, key = option
             mtime_option.addItem(text)
-            mtime_option.setItemData(index, func)
+            mtime_option.setItemData(index, key)
         mtime = QSpinBox()
         mtime.setMinimum(0)
         mtime.setMaximum(999)
@@ -196,17 +210,8 @@ class FileFilters(QWidget):
     def setup_size_selection(self):
         size_layout = QHBoxLayout()
         size_option = QComboBox()
-        options = [
-            ('>', greater_than),
-            ('<', less_than),
-            ('=', equals),
-            ('>=', greater_equal_to),
-            ('<=', lesser_equal_to),
-        ]
-        for index, option in enumerate(options):
-            text, func = option
+        for text in filters.SIZE_OPERATORS:
             size_option.addItem(text)
-            size_option.setItemData(index, func)
         size = QSpinBox()
         size.setMinimum(0)
         size.setMaximum(9999)
@@ -269,6 +274,89 @@ class FileFilters(QWidget):
             self.mtime = None
             self.mtime = QLineEdit()
 
+    @Slot()
+    def check_patterns(self):
+        """Marks the name and file type fields whose patterns do not
+        compile and emits validity_changed if that changed"""
+        state = self.state()
+        valid = True
+        for field, field_state in (
+            (self.name, filters.FilterState(name=state.name)),
+            (self.file_types, filters.FilterState(extension=state.extension)),
+        ):
+            try:
+                filters.compile_filters(field_state)
+            except ValueError as e:
+                field.setToolTip(str(e))
+                field.setStyleSheet('color: red;')
+                valid = False
+            else:
+                field.setToolTip('')
+                field.setStyleSheet('')
+        if valid != self.valid:
+            self.valid = valid
+            self.validity_changed.emit(valid)
+
+    def state(self):
+        """Returns the filters set in the form as a filters.FilterState"""
+        name = extension = size = None
+        if text := self.name.text():
+            option = self.name_option.currentData()
+            if option not in (filters.MATCHES_GLOB, filters.MATCHES_REGEX):
+                text = filters.SEPARATOR.join(
+                    os.path.splitext(part)[0]
+                    for part in filters.needles(option, text)
+                )
+            name = (option, text)
+        if text := self.file_types.text():
+            option = self.file_types_option.currentData()
+            if option in (
+                filters.EQUALS, filters.NOT_EQUALS, filters.STARTS_WITH
+            ):
+                text = filters.SEPARATOR.join(
+                    '.' + part.lstrip('.')
+                    for part in filters.needles(option, text)
+                )
+            extension = (option, text)
+        if value := self.size.value():
+            increment = self.size_option_increment.currentText()
+            size = (
+                self.size_option.currentText(),
+                utils.files.human_to_bytes(f'{value}{increment}'),
+            )
+        return filters.FilterState(
+            name=name,
+            extension=extension,
+            ctime=self.__time_state(
+                self.ctime, self.ctime_option, self.ctime_option_increment
+            ),
+            mtime=self.__time_state(
+                self.mtime, self.mtime_option, self.mtime_option_increment
+            ),
+            size=size,
+        )
+
+    @staticmethod
+    def __time_state(field, option, increment):
+        option = option.currentData()
+        if isinstance(field, QDateEdit):
+            date = field.date()
+            date = datetime.datetime(
+                date.year(),
+                date.month(),
+                date.day(),
+                tzinfo=utils.date.TIMEZONE,
+            )
+            if option == filters.AFTER:
+                # After the whole of the selected day
+                date += datetime.timedelta(days=1)
+            return option, date
+        if isinstance(field, QSpinBox) and (value := field.value()):
+            return option, utils.date.subtract_period(
+                increment.currentText(), value
+            )
+        return None
+
     def date_edit_today(self):
         today = utils.date.now()
         date = QDate(today.year, today.month, today.day)
@@ -427,131 +515,3 @@ class NavBarListView(QListView):
         if not index.isValid():
             return
         self.setCurrentIndex(index)
-
-
-def name_equals(value, item, icase=True):
-    tail = os.path.split(item.root.rstrip('/').rstrip('\\'))[1]
-    tail = os.path.splitext(tail)[0]
-    if icase:
-        return tail.lower() == str(value).lower()
-    return tail == str(value)
-
-
-def extension_equals(value, item, icase=True):
-    ext = os.path.splitext(item.root)[1]
-    if icase:
-        return ext.lower() == str(value).lower()
-    return ext == str(value)
-
-
-def name_not_equals(value, item, icase=True):
-    return not name_equals(value, item, icase=icase)
-
-
-def extension_not_equals(value, item, icase=True):
-    return not extension_equals(value, item, icase=icase)
-
-
-def name_contains(value, item, icase=True):
-    tail = os.path.split(item.root.rstrip('/').rstrip('\\'))[1]
-    tail = os.path.splitext(tail)[0]
-    if icase:
-        return str(value).lower() in tail.lower()
-    return str(value) in tail
-
-
-def extension_contains(value, item, icase=True):
-    ext = os.path.splitext(item.root)[1]
-    if icase:
-        return str(value).lower() in ext.lower()
-    return str(value) in ext
-
-
-def name_does_not_contain(value, item, icase=True):
-    return not name_contains(value, item, icase=icase)
-
-
-def extension_does_not_contain(value, item, icase=True):
-    return not extension_contains(value, item, icase=icase)
-
-
-def name_ends_with(value, item, icase=True):
-    tail = os.path.split(item.root.rstrip('/').rstrip('\\'))[1]
-    tail = os.path.splitext(tail)[0]
-    if icase:
-        return tail.lower().endswith(str(value).lower())
-    return tail.endswith(str(value))
-
-
-def extension_ends_with(value, item, icase=True):
-    ext = os.path.splitext(item.root)[1]
-    if icase:
-        return ext.lower().endswith(str(value).lower())
-    return ext.endswith(str(value))
-
-
-def name_starts_with(value, item, icase=True):
-    tail = os.path.split(item.root.rstrip('/').rstrip('\\'))[1]
-    tail = os.path.splitext(tail)[0]
-    if icase:
-        return tail.lower().startswith(str(value).lower())
-    return tail.startswith(str(value))
-
-
-def extension_starts_with(value, item, icase=True):
-    ext = os.path.splitext(item.root)[1]
-    if icase:
-        return ext.lower().startswith(str(value).lower())
-    return ext.startswith(str(value))
-
-
-def equals(value, item):
-    return item.size == int(value)
-
-
-def greater_than(value, item):
-    return item.size > int(value)
-
-
-def less_than(value, item):
-    return item.size < int(value)
-
-
-def greater_equal_to(value, item):
-    return item.size >= int(value)
-
-
-def lesser_equal_to(value, item):
-    return item.size <= int(value)
-
-
-def within_last_ctime(item, compare_date, seconds):
-    if start_date := item.ctime:
-        if start_date > compare_date:
-            if (start_date - compare_date).seconds <= seconds:
-                return True
-    return False
-
-
-def within_last_mtime(item, compare_date, seconds):
-    if start_date := item.mtime:
-        if start_date > compare_date:
-            if (start_date - compare_date).seconds <= seconds:
-                return True
-    return False
-
-
-def before_ctime(item, compare_date):
-    return item.ctime < compare_date
-
-
-def before_mtime(item, compare_date):
-    return item.mtime < compare_date
-
-
-def after_ctime(item, compare_date):
-    return item.ctime > compare_date
-
-
-def after_mtime(item, compare_date):
-    return item.mtime > compare_date
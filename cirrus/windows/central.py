@@ -37,7 +37,9 @@ class CentralWidgetWindow(QWidget):  # Terrible name
         self.num_current_transfers = 0
         self.__started_transfers_to_update = []
         self.__error_transfers_to_update = []
+        self.__retry_transfers_to_update = []
         self.__completed_transfers_to_update = []
+        self.__last_progress = dict()
 
         # setup DB names
         # Terrible name. Need to re-evaluate
@@ -86,17 +88,10 @@ class CentralWidgetWindow(QWidget):  # Terrible name
             self.database_queue, max_workers=self.max_workers
         )
         self.executor.started.connect(database.restart_queued_transfers)
-        self.executor.transfer_started.connect(
-            self.transfers_window.attach_transfer_item
-        )
-        self.executor.transfer_started.connect(self.transfer_started)
-        self.executor.finished.connect(self.transfer_finished)
-        self.executor.stopped.connect(
-            self.transfers_window.remove_transfer_item
-        )
         self.executor.completed.connect(
             self.transfers_window.transfers.model().transfer_items.clear
         )
+        self.executor.completed.connect(self.update_transfering_rows)
         self.executor.completed.connect(
             self.transfers_window.select_current_tab_model
         )
@@ -165,7 +160,7 @@ class CentralWidgetWindow(QWidget):  # Terrible name
         runnable = action.runnable()
         runnable.signals.aborted.connect(partial(print, 'Aborted!'))
         runnable.signals.update.connect(print)
-        runnable.signals.process_queue.connect(self.start_queue_tmp)
+        runnable.signals.process_queue.connect(self.start_queue)
         if model is not None:
             runnable.signals.select.connect(model.select)
         runnable.signals.ss_callback.connect(utils.execute_ss_callback)
@@ -181,10 +176,12 @@ class CentralWidgetWindow(QWidget):  # Terrible name
         context.triggered.connect(self.menu_item_selected)
         context.popup(pos)
 
-    def start_queue_tmp(self, start):
-        print('start_queue_tmp called:', start)
-        if start:
-            pass
+    @Slot()
+    def start_queue(self):
+        # Transfers added while the executor runs are picked up by building
+        # the queue again, which does nothing while it is being built
+        if any(thread.is_alive() for thread in self.executor.threads):
+            self.database_queue.build_queue()
 
     def setup_initial_splitter_panels(self):
         last_open_panels = [p for p in settings.saved_panels()]
@@ -292,6 +289,8 @@ class CentralWidgetWindow(QWidget):  # Terrible name
             self.update_timer.stop()
 
     def __update_transfering_rows(self):
+        if not self.consume_progress():
+            return
         if self.current_transfers:
             current_widget = self.transfers_window.tabs.currentWidget()
             transfers = self.transfers_window.transfers
@@ -307,6 +306,29 @@ class CentralWidgetWindow(QWidget):  # Terrible name
                     )
                 )
 
+    def consume_progress(self):
+        """Applies the executor's progress snapshot since the last tick.
+
+        Returns True if any transfer started, finished, or made progress
+        """
+        snapshot = self.executor.progress.snapshot()
+        for item in snapshot.started:
+            self.transfers_window.attach_transfer_item(item)
+            self.transfer_started(item)
+        for item in snapshot.finished:
+            self.transfer_finished(item)
+        for item in snapshot.retrying:
+            self.transfer_retrying(item)
+        for item in snapshot.stopped:
+            self.transfers_window.remove_transfer_item(item)
+        progress = {
+            pk: (processed, status)
+            for pk, processed, status in snapshot.rows
+        }
+        changed = progress != self.__last_progress
+        self.__last_progress = progress
+        return changed
+
     @Slot()
     def toggle_transfer_window(self):
         if self.transfers_window.isVisible():
@@ -332,6 +354,13 @@ class CentralWidgetWindow(QWidget):  # Terrible name
         else:
             self.__completed_transfers_to_update.append(item)
 
+    @Slot(items.TransferItem)
+    def transfer_retrying(self, item):
+        self.num_current_transfers -= 1
+        if item in self.current_transfers:
+            _ = self.current_transfers.remove(item)
+        self.__retry_transfers_to_update.append(item)
+
     def batch_started_db_update(self):
         if self.__started_transfers_to_update:
             response = database.started_batch_update(
@@ -361,6 +390,18 @@ class CentralWidgetWindow(QWidget):  # Terrible name
                      'to `database.error_batch_update`')
                 )
             self.__error_transfers_to_update.clear()
+        if self.__retry_transfers_to_update:
+            output.extend(self.__retry_transfers_to_update)
+            response = database.retry_batch_update(
+                self.__retry_transfers_to_update
+            )
+            if not response:
+                logging.warn(
+                    ('Failed to send '
+                     f'{len(self.__retry_transfers_to_update)} '
+                     'to `database.retry_batch_update`')
+                )
+            self.__retry_transfers_to_update.clear()
         if self.__completed_transfers_to_update:
             output.extend(self.__completed_transfers_to_update)
             response = database.completed_batch_update(
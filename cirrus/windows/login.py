@@ -1,10 +1,12 @@
 from functools import partial
 
-import boto3
-import keyring
-
 from cirrus import settings
-from cirrus.items import DigitalOceanItem, S3Item
+from cirrus.items import (
+    DigitalOceanItem,
+    S3Item,
+    new_session,
+    set_secret_key,
+)
 from cirrus.utils import HLine
 
 from PySide6.QtCore import Qt, Signal
@@ -253,7 +255,7 @@ class LoginWindow(QDialog):
                 endpoint_url=endpoint,
                 root=root,
             )
-            session = boto3.session.Session()
+            session = new_session()
             s3_client = session.client(
                 's3',
                 region_name=region,
@@ -295,7 +297,7 @@ class LoginWindow(QDialog):
         else:
             # Keyring
             settings.update_saved_clients(client)
-            keyring.set_password('system', f'_s3_{key}_secret_key', secret_key)
+            set_secret_key(key, secret_key)
             self.accounts.append(client)
             self.close()
 
@@ -321,7 +323,7 @@ class LoginWindow(QDialog):
                 region=region,
                 root=root,
             )
-            session = boto3.session.Session()
+            session = new_session()
             client = session.client(
                 's3',
                 region_name=region,
@@ -360,7 +362,7 @@ class LoginWindow(QDialog):
         else:
             # Keyring
             settings.update_saved_clients(client)
-            keyring.set_password('system', f'_s3_{key}_secret_key', secret_key)
+            set_secret_key(key, secret_key)
             self.accounts.append(client)
             self.close()
 
@@ -1,5 +1,4 @@
-import heapq
-import itertools
+import os
 
 from functools import partial
 
@@ -10,8 +9,6 @@ from cirrus.widgets import FlowLayout
 
 from PySide6.QtCore import (
     Qt,
-    QItemSelectionModel,
-    QItemSelection,
     QModelIndex,
     QTimer,
     Slot,
@@ -19,6 +16,7 @@ from PySide6.QtCore import (
 )
 from PySide6.QtGui import QAction, QKeySequence
 from PySide6.QtWidgets import (
+    QFileDialog,
     QHBoxLayout,
     QLabel,
     QPushButton,
@@ -31,6 +29,8 @@ from PySide6.QtWidgets import (
 class SearchResultsWindow(QWidget):
     aborted = Signal()
     closed = Signal()
+    # The local folder to download the checked results to
+    download_requested = Signal(str)
 
     def __init__(self, labels):
         super().__init__()
@@ -151,11 +151,6 @@ class SearchResultsWindow(QWidget):
                     self.view.model().setData(
                         row_sibling, Qt.Unchecked, role=Qt.CheckStateRole
                     )
-                    self.view.selectionModel().select(
-                        row,
-                        QItemSelectionModel.Rows |
-                        QItemSelectionModel.Deselect
-                    )
             if all(
                 self.view.isRowHidden(row, parent)
                 for row in range(self.view.model().rowCount())
@@ -176,100 +171,24 @@ class SearchResultsWindow(QWidget):
     def clear_selection(self):
         self.disable_action_btns()
         self.select_all_btn.setEnabled(True)
-        index = self.view.model().index(0, 0)
-        checkboxes_heap = []
-        for checkbox in self.view.model().match(
-            index,
-            Qt.CheckStateRole,
-            Qt.Checked.value,
-            flags=Qt.MatchExactly,
-            hits=-1,
-        ):
-            heapq.heappush(checkboxes_heap, (checkbox.row(), checkbox))
-        if checkboxes_heap:
-            batch_size = 100
-            g_checkboxes = (
-                heapq.heappop(checkboxes_heap)[1]
-                for _ in range(len(checkboxes_heap))
-            )
-            group = list(itertools.islice(g_checkboxes, 0, batch_size))
-            while group:
-                QTimer.singleShot(
-                    0,
-                    partial(
-                        self.view.model().bulkSetData,
-                        group,
-                        Qt.Unchecked,
-                        Qt.CheckStateRole
-                    )
-                )
-                QTimer.singleShot(
-                    0,
-                    partial(
-                        self.view.selectionModel().select,
-                        QItemSelection(group[0], group[-1]),
-                        QItemSelectionModel.Rows | QItemSelectionModel.Deselect
-                    )
-                )
-                group = list(itertools.islice(g_checkboxes, 0, batch_size))
+        if rows := self.view.model().rowCount():
+            self.view.check_rows([(0, rows - 1)], False)
 
     @utils.long_running_action()
     @Slot()
     def select_all(self):
         self.select_all_btn.setEnabled(False)
-        index = self.view.model().index(0, 0)
-        parent = QModelIndex()
-        checkboxes_heap = []
-        for checkbox in self.view.model().match(
-            index,
-            Qt.CheckStateRole,
-            Qt.Unchecked.value,
-            flags=Qt.MatchExactly,
-            hits=-1,
-        ):
-            if not self.view.isRowHidden(checkbox.row(), parent):
-                heapq.heappush(checkboxes_heap, (checkbox.row(), checkbox))
-        if checkboxes_heap:
-            batch_size = 100
-            g_checkboxes = (
-                heapq.heappop(checkboxes_heap)[1]
-                for _ in range(len(checkboxes_heap))
-            )
-            group = list(itertools.islice(g_checkboxes, 0, batch_size))
-            while group:
-                QTimer.singleShot(
-                    0,
-                    partial(
-                        self.view.model().bulkSetData,
-                        group,
-                        Qt.Checked,
-                        Qt.CheckStateRole
-                    )
-                )
-                QTimer.singleShot(
-                    0,
-                    partial(
-                        self.view.selectionModel().select,
-                        QItemSelection(group[0], group[-1]),
-                        QItemSelectionModel.Rows | QItemSelectionModel.Select
-                    )
-                )
-                group = list(itertools.islice(g_checkboxes, 0, batch_size))
+        if ranges := self.view.visible_ranges():
+            self.view.check_rows(ranges, True)
         QTimer.singleShot(0, self.enable_action_btns)
 
     @Slot(bool)
-    def download(self, checked, *, parent=QModelIndex()):
-        # TODO: This will be an action instead
-        index = self.view.model().index(0, 0)
-        for row in self.view.model().match(
-            index,
-            Qt.CheckStateRole,
-            Qt.Checked.value,
-            flags=Qt.MatchExactly,
-            hits=-1,
-        ):
-            if not self.view.isRowHidden(row.row(), parent):
-                print(row.siblingAtColumn(1).data())
+    def download(self, checked):
+        destination = QFileDialog.getExistingDirectory(
+            self, 'Download To', os.path.expanduser('~')
+        )
+        if destination:
+            self.download_requested.emit(destination)
 
     @Slot(str)
     def search_completed(self, msg):
@@ -277,7 +196,9 @@ class SearchResultsWindow(QWidget):
         self.view.model().completed()
         if self.view.model().rowCount():
             self.select_all_btn.setEnabled(True)
-        if msg in {'Stopped', 'Aborted', 'Completed'}:
+        if self.view.model().checked_count:
+            self.enable_action_btns()
+        if msg.startswith(('Stopped', 'Aborted', 'Completed')):
             self.setWindowTitle(f'Search Results - {msg}')
             index = self.view.model().index(0, 1)
             for label in self.label_actions:
@@ -325,7 +246,9 @@ class SearchResultsWindow(QWidget):
     def enable_action_btns(self):
         if not self.delete_btn.isEnabled():
             self.delete_btn.setEnabled(True)
-        if not self.download_btn.isEnabled():
+        # The results are read by the download on another thread, so they
+        # must be final
+        if self.view.model().finished and not self.download_btn.isEnabled():
             self.download_btn.setEnabled(True)
         if not self.clear_selection_btn.isEnabled():
             self.clear_selection_btn.setEnabled(True)
@@ -345,12 +268,6 @@ class SearchResultsWindow(QWidget):
         elif self.view.isRowHidden(index.row(), QModelIndex()):
             if self.select_all_btn.isEnabled():
                 self.select_all_btn.setEnabled(False)
-        else:
-            if not self.view.model().match(
-                index,
-                Qt.CheckStateRole,
-                Qt.Unchecked.value,
-                flags=Qt.MatchExactly
-            ):
-                if self.select_all_btn.isEnabled():
-                    self.select_all_btn.setEnabled(False)
+        elif self.view.model().all_checked():
+            if self.select_all_btn.isEnabled():
+                self.select_all_btn.setEnabled(False)
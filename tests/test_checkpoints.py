@@ -0,0 +1,274 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from cirrus import items, settings
+from cirrus.core import store
+from cirrus.core.scheduler import TransferQueue
+
+
+PART_SIZE = 10
+
+
+class NoSuchUpload(Exception):
+    pass
+
+
+class FakeS3Client:
+    """Keeps multipart uploads in memory, like S3 would"""
+
+    class exceptions:
+        NoSuchUpload = NoSuchUpload
+
+    def __init__(self):
+        self.uploads = dict()
+        self.completed = dict()
+        self.aborted = []
+        self.next_id = 0
+
+    def create_multipart_upload(self, *, Bucket, Key, **kwargs):
+        self.next_id += 1
+        upload_id = f'upload-{self.next_id}'
+        self.uploads[upload_id] = (Key, dict())
+        return {'UploadId': upload_id}
+
+    def upload_part(self, *, Bucket, Key, UploadId, PartNumber, Body):
+        etag = f'"{UploadId}-{PartNumber}"'
+        self.uploads[UploadId][1][PartNumber] = (etag, Body)
+        return {'ETag': etag}
+
+    def list_parts(self, *, Bucket, Key, UploadId, **kwargs):
+        if UploadId not in self.uploads:
+            raise NoSuchUpload(UploadId)
+        parts = self.uploads[UploadId][1]
+        return {
+            'Parts': [
+                {'PartNumber': number, 'ETag': etag}
+                for number, (etag, _) in sorted(parts.items())
+            ],
+        }
+
+    def complete_multipart_upload(
+        self, *, Bucket, Key, UploadId, MultipartUpload
+    ):
+        _, parts = self.uploads.pop(UploadId)
+        self.completed[Key] = b''.join(
+            parts[part['PartNumber']][1]
+            for part in MultipartUpload['Parts']
+        )
+
+    def abort_multipart_upload(self, *, Bucket, Key, UploadId):
+        if self.uploads.pop(UploadId, None) is None:
+            raise NoSuchUpload(UploadId)
+        self.aborted.append(UploadId)
+
+
+class FakeS3Item(items.S3Item):
+    fake_client = None
+
+    def upload_args(self):
+        return {}
+
+    def setup_client(self, max_keys=1_000):
+        return self.fake_client
+
+
+def s3_item(root, size=0):
+    return FakeS3Item({'Root': root, 'Region': 'test'}, size=size)
+
+
+def transfer_item(pk, data, root='/bucket/file.bin'):
+    source = items.LocalItem({'Root': '/tmp/file.bin'}, size=len(data))
+    return items.TransferItem(pk, source, s3_item(root, len(data)), len(data))
+
+
+def send(upload, data):
+    """Sends `data` to the started `upload` in PART_SIZE - 1 byte
+    chunks"""
+    for start in range(0, len(data), PART_SIZE - 1):
+        upload.send(data[start:start + PART_SIZE - 1])
+
+
+class CheckpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patches = [
+            mock.patch.object(
+                settings, 'DATABASE', os.path.join(folder.name, 'cirrus.db')
+            ),
+            mock.patch.object(items, 'MULTIPART_THRESHOLD', PART_SIZE),
+            mock.patch.object(items, 'MULTIPART_CHUNKSIZE', PART_SIZE),
+            mock.patch.object(FakeS3Item, 'fake_client', FakeS3Client()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = FakeS3Item.fake_client
+        store.setup()
+
+    def add_transfer(self, transfer):
+        self.assertTrue(store.insert_transfers([(
+            transfer.source.root,
+            transfer.destination.root,
+            transfer.size,
+            transfer.source.type,
+            transfer.destination.type,
+            'overwrite',
+        )]))
+
+
+class TestResume(CheckpointTestCase):
+
+    def test_resumes_after_completed_parts(self):
+        data = bytes(range(45))
+        transfer = transfer_item(1, data)
+        self.add_transfer(transfer)
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        upload = transfer.destination.upload(checkpoint=checkpoint)
+        self.assertEqual(next(upload), 0)
+        send(upload, data[:27])
+        upload.close()
+
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        self.assertEqual(len(checkpoint.parts), 2)
+        self.assertEqual(checkpoint.offset, 2 * PART_SIZE)
+        self.assertEqual(checkpoint.target, transfer.destination.root)
+        upload = transfer.destination.upload(checkpoint=checkpoint)
+        offset = next(upload)
+        self.assertEqual(offset, 2 * PART_SIZE)
+        send(upload, data[offset:])
+        upload.send(None)
+
+        self.assertEqual(self.client.completed['file.bin'], data)
+        self.assertEqual(self.client.next_id, 1)
+
+    def test_keeps_only_the_parts_s3_still_has(self):
+        data = bytes(range(45))
+        transfer = transfer_item(1, data)
+        self.add_transfer(transfer)
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        upload = transfer.destination.upload(checkpoint=checkpoint)
+        next(upload)
+        send(upload, data[:36])
+        upload.close()
+        upload_id = checkpoint.upload_id
+        del self.client.uploads[upload_id][1][2]
+
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        upload = transfer.destination.upload(checkpoint=checkpoint)
+        offset = next(upload)
+        self.assertEqual(offset, PART_SIZE)
+        self.assertEqual(
+            store.TransferCheckpoint.load(transfer).parts,
+            [(1, f'"{upload_id}-1"', PART_SIZE)],
+        )
+        send(upload, data[offset:])
+        upload.send(None)
+        self.assertEqual(self.client.completed['file.bin'], data)
+
+    def test_stale_checkpoint_is_discarded(self):
+        transfer = transfer_item(1, bytes(30))
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        checkpoint.begin(transfer.destination.root, upload_id='stale')
+        checkpoint.add_part(1, 'etag', PART_SIZE)
+
+        changed = transfer_item(1, bytes(40))
+        checkpoint = store.TransferCheckpoint.load(changed)
+        self.assertFalse(checkpoint.started)
+        self.assertEqual(checkpoint.parts, [])
+        self.assertEqual(
+            store.abandoned_uploads(),
+            [('stale', transfer.destination.root, 's3')],
+        )
+
+
+class TestCompletion(CheckpointTestCase):
+
+    def test_completed_checkpoint_is_dropped(self):
+        transfer = transfer_item(1, bytes(30))
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        checkpoint.begin(transfer.destination.root, upload_id='done')
+        checkpoint.add_part(1, 'etag', PART_SIZE)
+        checkpoint.clear(completed=True)
+
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        self.assertFalse(checkpoint.started)
+        self.assertEqual(checkpoint.parts, [])
+        self.assertEqual(store.abandoned_uploads(), [])
+
+    def test_cleared_checkpoint_abandons_its_upload(self):
+        transfer = transfer_item(1, bytes(30))
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        checkpoint.begin(transfer.destination.root, upload_id='dropped')
+        checkpoint.clear()
+        self.assertEqual(
+            store.abandoned_uploads(),
+            [('dropped', transfer.destination.root, 's3')],
+        )
+
+
+class TestAbandonedUploads(CheckpointTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.dict(items.types, {'s3': FakeS3Item})
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.queue = TransferQueue()
+        self.queue.clients = [{'Type': 'S3', 'Root': '/bucket'}]
+
+    def test_deleted_transfer_upload_is_aborted(self):
+        data = bytes(range(45))
+        transfer = transfer_item(1, data)
+        self.add_transfer(transfer)
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        upload = transfer.destination.upload(checkpoint=checkpoint)
+        next(upload)
+        send(upload, data[:20])
+        upload.close()
+        upload_id = checkpoint.upload_id
+
+        con = store.connect()
+        with con:
+            con.execute('DELETE FROM transfers')
+        con.close()
+        self.assertEqual(
+            store.abandoned_uploads(),
+            [(upload_id, transfer.destination.root, 's3')],
+        )
+        self.queue.abort_abandoned_uploads()
+        self.assertEqual(self.client.aborted, [upload_id])
+        self.assertEqual(store.abandoned_uploads(), [])
+
+    def test_replaced_upload_is_aborted(self):
+        transfer = transfer_item(1, bytes(30))
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        first = self.client.create_multipart_upload(
+            Bucket='bucket', Key='file.bin'
+        )['UploadId']
+        checkpoint.begin(transfer.destination.root, upload_id=first)
+        checkpoint.begin(transfer.destination.root, upload_id='second')
+        self.queue.abort_abandoned_uploads()
+        self.assertEqual(self.client.aborted, [first])
+        self.assertEqual(store.abandoned_uploads(), [])
+
+    def test_upload_without_client_is_kept(self):
+        transfer = transfer_item(1, bytes(30), root='/other/file.bin')
+        checkpoint = store.TransferCheckpoint.load(transfer)
+        checkpoint.begin(transfer.destination.root, upload_id='orphan')
+        checkpoint.clear()
+        self.queue.clients = []
+        with mock.patch.object(settings, 'saved_clients', list):
+            self.queue.abort_abandoned_uploads()
+        self.assertEqual(
+            store.abandoned_uploads(),
+            [('orphan', '/other/file.bin', 's3')],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,462 @@
+import datetime
+import itertools
+import os
+import tempfile
+import unittest
+
+from types import SimpleNamespace
+
+from cirrus import filters
+from cirrus.filters import FilterState, compile_filters
+from cirrus.items import LocalItem
+
+try:
+    from cirrus import windows  # noqa: F401
+    from cirrus import dialogs
+    from PySide6.QtWidgets import QApplication
+except ImportError:
+    QT = False
+else:
+    QT = True
+
+
+NOW = datetime.datetime(2024, 6, 1, 12, tzinfo=datetime.timezone.utc)
+HOUR = datetime.timedelta(hours=1)
+
+
+def item(root='/bucket/Report.CSV', size=0, mtime=NOW, ctime=NOW):
+    return SimpleNamespace(root=root, size=size, mtime=mtime, ctime=ctime)
+
+
+def passes(state, *roots):
+    predicate = compile_filters(state)
+    return [predicate(item(root)) for root in roots]
+
+
+def _tail(item):
+    tail = os.path.split(item.root.rstrip('/').rstrip('\\'))[1]
+    return os.path.splitext(tail)[0].lower()
+
+
+def _ext(item):
+    return os.path.splitext(item.root)[1].lower()
+
+
+# The per-widget predicates compile_filters replaced, which always
+# ignored case
+OLD_PREDICATES = {
+    filters.CONTAINS: lambda value, text: value in text,
+    filters.NOT_CONTAINS: lambda value, text: value not in text,
+    filters.EQUALS: lambda value, text: text == value,
+    filters.NOT_EQUALS: lambda value, text: text != value,
+    filters.STARTS_WITH: lambda value, text: text.startswith(value),
+    filters.ENDS_WITH: lambda value, text: text.endswith(value),
+}
+
+
+class TestNames(unittest.TestCase):
+    roots = (
+        '/bucket/Report.csv',
+        '/bucket/folder/annual report.TXT',
+        '/bucket/REPORT',
+        '/bucket/folder/',
+        '/bucket/.hidden',
+        'C:\\Users\\me\\Reports\\Report_2024.csv',
+        '/bucket/archive.tar.gz',
+    )
+    needles = ('report', 'REPORT', 'Rep', 'ort', 'folder', '2024', 'archive')
+
+    def test_matches_old_predicates(self):
+        for (option, old), needle in itertools.product(
+            OLD_PREDICATES.items(), self.needles
+        ):
+            predicate = compile_filters(FilterState(name=(option, needle)))
+            for root in self.roots:
+                with self.subTest(option=option, needle=needle, root=root):
+                    self.assertEqual(
+                        predicate(item(root)),
+                        old(needle.lower(), _tail(item(root))),
+                    )
+
+    def test_ignores_case(self):
+        state = FilterState(name=(filters.EQUALS, 'rEpOrT'))
+        self.assertEqual(
+            passes(state, '/b/REPORT.csv', '/b/report', '/b/reports'),
+            [True, True, False],
+        )
+
+    def test_ignores_extension(self):
+        state = FilterState(name=(filters.ENDS_WITH, 'csv'))
+        self.assertEqual(
+            passes(state, '/b/report.csv', '/b/report_csv.txt'),
+            [False, True],
+        )
+
+    def test_several_needles(self):
+        cases = [
+            (filters.CONTAINS, [True, True, False]),
+            (filters.NOT_CONTAINS, [False, False, True]),
+            (filters.EQUALS, [False, True, False]),
+            (filters.NOT_EQUALS, [True, False, True]),
+            (filters.STARTS_WITH, [True, True, False]),
+            (filters.ENDS_WITH, [False, True, False]),
+        ]
+        for option, expected in cases:
+            with self.subTest(option=option):
+                state = FilterState(name=(option, ' Report , summary,'))
+                self.assertEqual(
+                    passes(
+                        state,
+                        '/b/Report 2024.csv',
+                        '/b/SUMMARY.txt',
+                        '/b/notes.md',
+                    ),
+                    expected,
+                )
+
+    def test_invalid_option(self):
+        with self.assertRaises(ValueError):
+            compile_filters(FilterState(name=('sounds like', 'report')))
+
+
+class TestExtensions(unittest.TestCase):
+    roots = (
+        '/bucket/Report.csv',
+        '/bucket/photo.JPG',
+        '/bucket/archive.tar.gz',
+        '/bucket/README',
+        '/bucket/.hidden',
+    )
+    needles = ('.csv', '.CSV', '.jp', 'g', 'gz', '.tar.gz')
+
+    def test_matches_old_predicates(self):
+        for (option, old), needle in itertools.product(
+            OLD_PREDICATES.items(), self.needles
+        ):
+            predicate = compile_filters(
+                FilterState(extension=(option, needle))
+            )
+            for root in self.roots:
+                with self.subTest(option=option, needle=needle, root=root):
+                    self.assertEqual(
+                        predicate(item(root)),
+                        old(needle.lower(), _ext(item(root))),
+                    )
+
+    def test_extension_list(self):
+        state = FilterState(extension=(filters.EQUALS, '.jpg, .PNG,.gif'))
+        self.assertEqual(
+            passes(
+                state,
+                '/b/a.JPG',
+                '/b/b.png',
+                '/b/c.gif',
+                '/b/d.jpeg',
+                '/b/png',
+            ),
+            [True, True, True, False, False],
+        )
+        state = FilterState(extension=(filters.NOT_EQUALS, '.jpg, .png'))
+        self.assertEqual(
+            passes(state, '/b/a.jpg', '/b/b.PNG', '/b/c.gif'),
+            [False, False, True],
+        )
+        state = FilterState(extension=(filters.ENDS_WITH, 'z, 2'))
+        self.assertEqual(
+            passes(state, '/b/a.tar.gz', '/b/b.bz2', '/b/c.zip'),
+            [True, True, False],
+        )
+
+
+class TestSizes(unittest.TestCase):
+
+    def test_operators(self):
+        sizes = (99, 100, 101)
+        cases = [
+            ('>', [False, False, True]),
+            ('<', [True, False, False]),
+            ('=', [False, True, False]),
+            ('>=', [False, True, True]),
+            ('<=', [True, True, False]),
+        ]
+        for operator, expected in cases:
+            with self.subTest(operator=operator):
+                predicate = compile_filters(FilterState(size=(operator, 100)))
+                self.assertEqual(
+                    [predicate(item(size=size)) for size in sizes], expected
+                )
+
+    def test_threshold_may_be_text(self):
+        predicate = compile_filters(FilterState(size=('>=', '100')))
+        self.assertTrue(predicate(item(size=100)))
+
+
+class TestDates(unittest.TestCase):
+    dates = (NOW - HOUR, NOW, NOW + HOUR, None)
+
+    def check(self, attribute, option, expected):
+        predicate = compile_filters(
+            FilterState(**{attribute: (option, NOW)})
+        )
+        self.assertEqual(
+            [
+                predicate(item(**{attribute: date})) for date in self.dates
+            ],
+            expected,
+        )
+
+    def test_before(self):
+        for attribute in ('mtime', 'ctime'):
+            with self.subTest(attribute=attribute):
+                self.check(
+                    attribute, filters.BEFORE, [True, False, False, False]
+                )
+
+    def test_after(self):
+        for attribute in ('mtime', 'ctime'):
+            with self.subTest(attribute=attribute):
+                self.check(
+                    attribute, filters.AFTER, [False, True, True, False]
+                )
+
+    def test_within_last(self):
+        for attribute in ('mtime', 'ctime'):
+            with self.subTest(attribute=attribute):
+                self.check(
+                    attribute, filters.WITHIN_LAST, [False, True, True, False]
+                )
+
+    def test_only_the_filtered_date_is_checked(self):
+        predicate = compile_filters(FilterState(ctime=(filters.BEFORE, NOW)))
+        self.assertTrue(predicate(item(mtime=NOW + HOUR, ctime=NOW - HOUR)))
+        self.assertFalse(predicate(item(mtime=NOW - HOUR, ctime=NOW + HOUR)))
+
+    def test_dates_may_be_text_or_naive(self):
+        predicate = compile_filters(FilterState(mtime=(filters.AFTER, NOW)))
+        self.assertTrue(predicate(item(mtime=(NOW + HOUR).isoformat())))
+        naive = datetime.datetime.fromtimestamp((NOW - HOUR).timestamp())
+        self.assertFalse(predicate(item(mtime=naive)))
+
+
+class TestCompileFilters(unittest.TestCase):
+
+    def test_no_filters(self):
+        self.assertTrue(compile_filters(FilterState())(item()))
+
+    def test_every_filter_must_pass(self):
+        predicate = compile_filters(FilterState(
+            name=(filters.STARTS_WITH, 'report'),
+            extension=(filters.EQUALS, '.csv'),
+            mtime=(filters.AFTER, NOW - HOUR),
+            ctime=(filters.BEFORE, NOW + HOUR),
+            size=('>', 10),
+        ))
+        self.assertTrue(predicate(item('/b/Report 1.csv', size=11)))
+        self.assertFalse(predicate(item('/b/Report 1.csv', size=10)))
+        self.assertFalse(predicate(item('/b/Report 1.txt', size=11)))
+        self.assertFalse(predicate(item('/b/Summary.csv', size=11)))
+        self.assertFalse(
+            predicate(item('/b/Report.csv', size=11, mtime=NOW - 2 * HOUR))
+        )
+        self.assertFalse(
+            predicate(item('/b/Report.csv', size=11, ctime=NOW + 2 * HOUR))
+        )
+
+
+class TestPatterns(unittest.TestCase):
+
+    def test_glob_sees_the_whole_name(self):
+        state = FilterState(name=(filters.MATCHES_GLOB, '*.csv'))
+        self.assertEqual(
+            passes(state, '/b/report.csv', '/b/report.csv.bak', '/b/csv'),
+            [True, False, False],
+        )
+
+    def test_glob_list(self):
+        state = FilterState(name=(filters.MATCHES_GLOB, 'report_?.*, *.md'))
+        self.assertEqual(
+            passes(
+                state,
+                '/b/Report_1.csv',
+                '/b/report_10.csv',
+                '/b/notes.md',
+                '/b/folder/',
+            ),
+            [True, False, True, False],
+        )
+
+    def test_glob_ignores_case(self):
+        state = FilterState(name=(filters.MATCHES_GLOB, 'REPORT*.CSV'))
+        self.assertEqual(
+            passes(state, '/b/report 1.csv', '/b/Report 2.Csv'),
+            [True, True],
+        )
+
+    def test_regex_sees_the_whole_name(self):
+        state = FilterState(name=(filters.MATCHES_REGEX, r'report\.csv$'))
+        self.assertEqual(
+            passes(state, '/b/report.csv', '/b/report.csv.bak', '/b/report'),
+            [True, False, False],
+        )
+
+    def test_regex_is_searched_for(self):
+        state = FilterState(name=(filters.MATCHES_REGEX, r'\d{4}'))
+        self.assertEqual(
+            passes(state, '/b/report 2024.csv', '/b/report.csv'),
+            [True, False],
+        )
+
+    def test_regex_ignores_case(self):
+        state = FilterState(name=(filters.MATCHES_REGEX, '^Report_[a-z]+'))
+        self.assertEqual(
+            passes(state, '/b/REPORT_ABC.csv', '/b/report_1.csv'),
+            [True, False],
+        )
+
+    def test_regex_keeps_commas(self):
+        state = FilterState(name=(filters.MATCHES_REGEX, r'^a,b\.txt$'))
+        self.assertEqual(
+            passes(state, '/b/a,b.txt', '/b/a.txt'), [True, False]
+        )
+
+    def test_invalid_regex(self):
+        with self.assertRaises(ValueError):
+            compile_filters(FilterState(name=(filters.MATCHES_REGEX, '(')))
+        with self.assertRaises(ValueError):
+            compile_filters(
+                FilterState(extension=(filters.MATCHES_REGEX, '[a-'))
+            )
+
+
+class TestTopResults(unittest.TestCase):
+    sizes = (5, 1, 9, 3, 7, 2, 8)
+
+    def sized(self):
+        return [item(f'/b/{size}.txt', size=size) for size in self.sizes]
+
+    def dated(self):
+        return [
+            item(f'/b/{hours}.txt', mtime=NOW + hours * HOUR)
+            for hours in self.sizes
+        ]
+
+    def roots(self, top):
+        return [result.root for result in top.results()]
+
+    def test_largest(self):
+        top = filters.TopResults(filters.LARGEST, 3)
+        self.assertTrue(top.add(self.sized()))
+        self.assertEqual(self.roots(top), ['/b/9.txt', '/b/8.txt', '/b/7.txt'])
+
+    def test_smallest(self):
+        top = filters.TopResults(filters.SMALLEST, 3)
+        top.add(self.sized())
+        self.assertEqual(self.roots(top), ['/b/1.txt', '/b/2.txt', '/b/3.txt'])
+
+    def test_newest(self):
+        top = filters.TopResults(filters.NEWEST, 3)
+        top.add(self.dated())
+        self.assertEqual(self.roots(top), ['/b/9.txt', '/b/8.txt', '/b/7.txt'])
+
+    def test_oldest(self):
+        top = filters.TopResults(filters.OLDEST, 3)
+        top.add(self.dated())
+        self.assertEqual(self.roots(top), ['/b/1.txt', '/b/2.txt', '/b/3.txt'])
+
+    def test_added_in_batches(self):
+        top = filters.TopResults(filters.LARGEST, 3)
+        for result in self.sized():
+            top.add([result])
+        self.assertEqual(len(top), 3)
+        self.assertEqual(self.roots(top), ['/b/9.txt', '/b/8.txt', '/b/7.txt'])
+
+    def test_fewer_items_than_count(self):
+        top = filters.TopResults(filters.LARGEST, 10)
+        top.add(self.sized())
+        self.assertEqual(len(top), len(self.sizes))
+        self.assertEqual(
+            [result.size for result in top.results()],
+            sorted(self.sizes, reverse=True),
+        )
+
+    def test_admits(self):
+        top = filters.TopResults(filters.LARGEST, 2)
+        self.assertTrue(top.admits(item(size=0)))
+        top.add([item(size=5), item(size=7)])
+        self.assertFalse(top.admits(item(size=4)))
+        self.assertFalse(top.admits(item(size=5)))
+        self.assertTrue(top.admits(item(size=6)))
+        self.assertFalse(top.add([item(size=4)]))
+        top.add([item(size=6)])
+        self.assertFalse(top.admits(item(size=6)))
+
+    def test_items_without_a_date_are_left_out(self):
+        for order in (filters.NEWEST, filters.OLDEST):
+            with self.subTest(order=order):
+                top = filters.TopResults(order, 3)
+                undated = item('/b/undated.txt', mtime=None)
+                self.assertFalse(top.admits(undated))
+                self.assertFalse(top.add([undated]))
+                top.add([undated, item('/b/dated.txt')])
+                self.assertEqual(self.roots(top), ['/b/dated.txt'])
+
+    def test_changed(self):
+        top = filters.TopResults(filters.LARGEST, 2)
+        self.assertFalse(top.changed)
+        top.add([item(size=5), item(size=7)])
+        self.assertTrue(top.changed)
+        top.results()
+        self.assertFalse(top.changed)
+        top.add([item(size=1)])
+        self.assertFalse(top.changed)
+        top.add([item(size=9)])
+        self.assertTrue(top.changed)
+        top.results()
+        self.assertFalse(top.changed)
+
+    def test_invalid_order(self):
+        with self.assertRaises(ValueError):
+            filters.TopResults('alphabetical', 3)
+
+
+@unittest.skipUnless(QT, 'PySide6 is not installed')
+class TestInvalidPatterns(unittest.TestCase):
+
+    def setUp(self):
+        self.app = QApplication.instance() or QApplication([])
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.dialog = dialogs.SearchItemsDialog(
+            folders=[LocalItem({'Root': folder.name}, is_dir=True)]
+        )
+        self.addCleanup(self.dialog.deleteLater)
+        self.form = self.dialog.filters
+        index = self.form.name_option.findData(filters.MATCHES_REGEX)
+        self.form.name_option.setCurrentIndex(index)
+
+    def buttons_enabled(self):
+        return [
+            self.dialog.search_btn.isEnabled(),
+            self.dialog.recursive_search_btn.isEnabled(),
+        ]
+
+    def test_invalid_regex_disables_search(self):
+        self.form.name.setText('report(')
+        self.assertFalse(self.form.valid)
+        self.assertEqual(self.buttons_enabled(), [False, False])
+        self.assertTrue(self.form.name.toolTip())
+        self.form.name.setText(r'report\(')
+        self.assertTrue(self.form.valid)
+        self.assertEqual(self.buttons_enabled(), [True, True])
+        self.assertEqual(self.form.name.toolTip(), '')
+
+    def test_changing_option_revalidates(self):
+        self.form.name.setText('report(')
+        self.assertEqual(self.buttons_enabled(), [False, False])
+        index = self.form.name_option.findData(filters.CONTAINS)
+        self.form.name_option.setCurrentIndex(index)
+        self.assertEqual(self.buttons_enabled(), [True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from cirrus import settings
+from cirrus.core import store
+from cirrus.core.pipeline import TransferPipeline, destination_paths
+
+
+def relpath_destination(folder, destination, source):
+    """Where `source` was transferred to before destination_paths"""
+    target = os.path.join(destination, os.path.basename(folder.rstrip('/')))
+    return os.path.abspath(
+        os.path.join(target, os.path.relpath(source, start=folder))
+    )
+
+
+class TestDestinationPaths(unittest.TestCase):
+    cases = {
+        '/home/me/photos': (
+            '/home/me/photos/a.jpg',
+            '/home/me/photos/2024/june/b.jpg',
+            '/home/me/photos/.hidden',
+            '/home/me/photos/.cache/c.jpg',
+            '/home/me/photos/a..b.jpg',
+            '/home/me/photos/./d.jpg',
+            '/home/me/photos/sub/../e.jpg',
+            '/home/me/photos//f.jpg',
+            '/home/me/photos/g/',
+            '/home/me/photos-old/h.jpg',
+            '/home/me/photos/',
+            '/home/me/photos',
+        ),
+        '/home/me/photos/': (
+            '/home/me/photos/a.jpg',
+            '/home/me/photos/2024/b.jpg',
+            '/home/me/photos/.hidden',
+        ),
+        '/bucket/prefix': (
+            '/bucket/prefix/key.csv',
+            '/bucket/prefix/folder/key with spaces.csv',
+            '/bucket/prefix/folder//empty-named/key.csv',
+            '/bucket/prefix/folder/.keep',
+            '/bucket/prefix/..key.csv',
+            '/bucket/prefix/folder/',
+        ),
+        '/bucket': (
+            '/bucket/key.csv',
+            '/bucket/.a/.b/key.csv',
+        ),
+        '/.dotted/folder': (
+            '/.dotted/folder/a.txt',
+            '/.dotted/folder/b/.c.txt',
+        ),
+        '/data/../bucket//prefix': (
+            '/data/../bucket//prefix/a.txt',
+            '/data/../bucket//prefix/b/c.txt',
+            '/data/../bucket//prefix/',
+        ),
+        '/': (
+            '/a.txt',
+            '/b/c.txt',
+            '/.d',
+        ),
+    }
+    destinations = ('/tmp/downloads', '/tmp/downloads/', '/tmp/./a/../b')
+
+    def test_matches_relpath(self):
+        for folder, sources in self.cases.items():
+            for destination in self.destinations:
+                path = destination_paths(folder, destination)
+                for source in sources:
+                    with self.subTest(
+                        folder=folder, destination=destination, source=source
+                    ):
+                        self.assertEqual(
+                            path(source),
+                            relpath_destination(folder, destination, source),
+                        )
+
+    def test_keeps_the_folder_name(self):
+        path = destination_paths('/bucket/prefix/', '/tmp/downloads')
+        self.assertEqual(
+            path('/bucket/prefix/a/b.csv'), '/tmp/downloads/prefix/a/b.csv'
+        )
+
+
+def rows(folder, count):
+    path = destination_paths(folder, '/tmp/destination')
+    for i in range(count):
+        source = f'{folder}/{i}.txt'
+        yield source, path(source), i, 'local', 'local'
+
+
+def failing_rows(folder, count):
+    yield from rows(folder, count)
+    raise OSError(f'{folder} went away')
+
+
+class TestTransferPipeline(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patch = mock.patch.object(
+            settings, 'DATABASE', os.path.join(folder.name, 'cirrus.db')
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+        store.setup()
+        self.pipeline = TransferPipeline(batch_size=10, wait=0.01)
+        self.failures = []
+        self.pipeline.failed.connect(self.failures.append)
+
+    def transfers(self):
+        con = store.connect()
+        try:
+            return con.execute('SELECT COUNT(*) FROM transfers').fetchone()[0]
+        finally:
+            con.close()
+
+    def test_inserts_every_row(self):
+        inserted = []
+        self.pipeline.inserted.connect(inserted.append)
+        count = self.pipeline.run([
+            lambda: rows('/a', 25),
+            lambda: rows('/b', 30),
+        ])
+        self.assertEqual(count, 55)
+        self.assertEqual(sum(inserted), 55)
+        self.assertEqual(self.transfers(), 55)
+        self.assertEqual(self.pipeline.errors, [])
+        self.assertEqual(self.failures, [])
+
+    def test_failed_producer(self):
+        with self.assertLogs(level='WARNING'):
+            count = self.pipeline.run([
+                lambda: failing_rows('/a', 15),
+                lambda: rows('/b', 20),
+            ])
+        self.assertEqual(count, 35)
+        self.assertEqual(self.transfers(), 35)
+        self.assertEqual(len(self.pipeline.errors), 1)
+        self.assertIsInstance(self.pipeline.errors[0], OSError)
+        self.assertEqual(self.failures, self.pipeline.errors)
+
+    def test_producer_failing_to_start(self):
+        def producer():
+            raise PermissionError('/a')
+
+        with self.assertLogs(level='WARNING'):
+            count = self.pipeline.run([producer, lambda: rows('/b', 5)])
+        self.assertEqual(count, 5)
+        self.assertIsInstance(self.pipeline.errors[0], PermissionError)
+
+    def test_failed_insert_stops(self):
+        with mock.patch.object(store, 'insert_transfers', return_value=False):
+            with self.assertLogs(level='WARNING'):
+                count = self.pipeline.run([lambda: rows('/a', 50)])
+        self.assertEqual(count, 0)
+        self.assertTrue(self.pipeline.stopped.is_set())
+        self.assertEqual(len(self.failures), 1)
+        self.assertIsInstance(self.failures[0], RuntimeError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from cirrus import retries
+from cirrus.retries import DelayedRetryQueue, RetryPolicy, classify
+from cirrus.statuses import ErrorCategory
+
+
+class ClientError(Exception):
+    """Shaped like botocore.exceptions.ClientError"""
+
+    def __init__(self, code='', status=400):
+        super().__init__(code)
+        self.response = {
+            'Error': {'Code': code},
+            'ResponseMetadata': {'HTTPStatusCode': status},
+        }
+
+
+class EndpointConnectionError(Exception):
+    pass
+
+
+class ReadTimeoutError(EndpointConnectionError):
+    pass
+
+
+class TestClassify(unittest.TestCase):
+
+    def test_error_codes(self):
+        cases = [
+            ('SlowDown', ErrorCategory.THROTTLING),
+            ('ThrottlingException', ErrorCategory.THROTTLING),
+            ('AccessDenied', ErrorCategory.AUTH),
+            ('InvalidAccessKeyId', ErrorCategory.AUTH),
+            ('NoSuchKey', ErrorCategory.NOT_FOUND),
+            ('NoSuchBucket', ErrorCategory.NOT_FOUND),
+            ('InternalError', ErrorCategory.SERVER),
+            ('RequestTimeout', ErrorCategory.SERVER),
+            ('InvalidArgument', ErrorCategory.UNKNOWN),
+        ]
+        for code, category in cases:
+            with self.subTest(code=code):
+                self.assertEqual(classify(ClientError(code)), category)
+
+    def test_status_codes(self):
+        cases = [
+            (429, ErrorCategory.THROTTLING),
+            (401, ErrorCategory.AUTH),
+            (403, ErrorCategory.AUTH),
+            (404, ErrorCategory.NOT_FOUND),
+            (500, ErrorCategory.SERVER),
+            (503, ErrorCategory.SERVER),
+            (400, ErrorCategory.UNKNOWN),
+        ]
+        for status, category in cases:
+            with self.subTest(status=status):
+                self.assertEqual(
+                    classify(ClientError(status=status)), category
+                )
+
+    def test_code_wins_over_status(self):
+        self.assertEqual(
+            classify(ClientError('SlowDown', status=503)),
+            ErrorCategory.THROTTLING,
+        )
+
+    def test_builtin_errors(self):
+        cases = [
+            (EndpointConnectionError(), ErrorCategory.CONNECTION),
+            (ReadTimeoutError(), ErrorCategory.CONNECTION),
+            (ConnectionResetError(), ErrorCategory.CONNECTION),
+            (TimeoutError(), ErrorCategory.CONNECTION),
+            (FileNotFoundError(), ErrorCategory.NOT_FOUND),
+            (PermissionError(), ErrorCategory.AUTH),
+            (ValueError(), ErrorCategory.UNKNOWN),
+        ]
+        for error, category in cases:
+            with self.subTest(error=error):
+                self.assertEqual(classify(error), category)
+
+    def test_chained_errors(self):
+        try:
+            try:
+                raise ClientError('SlowDown')
+            except ClientError as e:
+                raise RuntimeError('Upload failed') from e
+        except RuntimeError as e:
+            self.assertEqual(classify(e), ErrorCategory.THROTTLING)
+        try:
+            try:
+                raise ConnectionResetError()
+            except ConnectionResetError:
+                raise ValueError('Bad response')
+        except ValueError as e:
+            self.assertEqual(classify(e), ErrorCategory.CONNECTION)
+
+    def test_cyclic_chain(self):
+        error, cause = ValueError(), KeyError()
+        error.__cause__, cause.__cause__ = cause, error
+        self.assertEqual(classify(error), ErrorCategory.UNKNOWN)
+
+    def test_label(self):
+        self.assertEqual(ErrorCategory.NOT_FOUND.label, 'Not Found')
+        self.assertEqual(ErrorCategory.AUTH.label, 'Auth')
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(
+            max_attempts=3, base_delay=1.0, max_delay=10.0, throttle_factor=4.0
+        )
+
+    def test_should_retry(self):
+        for category in ErrorCategory:
+            with self.subTest(category=category):
+                self.assertEqual(
+                    self.policy.should_retry(category, 1), category.retryable
+                )
+        self.assertTrue(self.policy.should_retry(ErrorCategory.SERVER, 2))
+        self.assertFalse(self.policy.should_retry(ErrorCategory.SERVER, 3))
+
+    def test_delay_ceiling(self):
+        cases = [
+            (ErrorCategory.SERVER, 1, 1.0),
+            (ErrorCategory.SERVER, 2, 2.0),
+            (ErrorCategory.SERVER, 4, 8.0),
+            (ErrorCategory.SERVER, 5, 10.0),
+            (ErrorCategory.THROTTLING, 1, 4.0),
+            (ErrorCategory.THROTTLING, 2, 8.0),
+            (ErrorCategory.THROTTLING, 3, 10.0),
+        ]
+        with mock.patch.object(retries.random, 'uniform', max):
+            for category, attempts, ceiling in cases:
+                with self.subTest(category=category, attempts=attempts):
+                    self.assertEqual(
+                        self.policy.delay(category, attempts), ceiling
+                    )
+
+    def test_delay_is_jittered(self):
+        delays = [
+            self.policy.delay(ErrorCategory.SERVER, 3) for _ in range(200)
+        ]
+        self.assertTrue(all(0 <= delay <= 4.0 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+
+class TestDelayedRetryQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.released = []
+        self.times = []
+        self.done = threading.Event()
+        self.expected = 0
+        self.queue = DelayedRetryQueue(self.release)
+
+    def release(self, item):
+        self.released.append(item)
+        self.times.append(time.monotonic())
+        if len(self.released) == self.expected:
+            self.done.set()
+
+    def test_releases_in_due_order(self):
+        self.expected = 3
+        self.queue.put('late', 0.15)
+        self.queue.put('early', 0.05)
+        self.queue.put('middle', 0.1)
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.released, ['early', 'middle', 'late'])
+
+    def test_waits_for_the_delay(self):
+        self.expected = 1
+        start = time.monotonic()
+        self.queue.put('item', 0.1)
+        self.assertTrue(self.queue.pending)
+        self.assertEqual(len(self.queue), 1)
+        self.assertTrue(self.done.wait(2))
+        self.assertGreaterEqual(self.times[0] - start, 0.1)
+
+    def test_same_delay_keeps_insertion_order(self):
+        self.expected = 5
+        due = time.monotonic() + 0.05
+        with mock.patch.object(retries.time, 'monotonic', return_value=due):
+            for item in range(5):
+                self.queue.put(item, 0)
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.released, list(range(5)))
+
+    def test_clear(self):
+        self.queue.put('first', 10)
+        self.queue.put('second', 10)
+        self.assertEqual(sorted(self.queue.clear()), ['first', 'second'])
+        self.assertFalse(self.queue.pending)
+        self.assertEqual(self.released, [])
+
+    def test_failed_release_is_not_pending(self):
+        def release(item):
+            try:
+                raise ValueError(item)
+            finally:
+                self.done.set()
+
+        queue = DelayedRetryQueue(release)
+        with self.assertLogs(level='WARNING'):
+            queue.put('item', 0)
+            self.assertTrue(self.done.wait(2))
+            deadline = time.monotonic() + 2
+            while queue.pending and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertFalse(queue.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
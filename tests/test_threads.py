@@ -0,0 +1,140 @@
+import threading
+import time
+import unittest
+
+from cirrus.utils.threads import BatchQueue
+
+
+def start(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+class TestGetBatch(unittest.TestCase):
+
+    def test_full_batch(self):
+        queue = BatchQueue(batch_size=3)
+        for item in range(5):
+            self.assertTrue(queue.put(item))
+        self.assertEqual(queue.get_batch(), [0, 1, 2])
+
+    def test_timeout_returns_partial_batch(self):
+        queue = BatchQueue(batch_size=10)
+        queue.put('item')
+        started = time.monotonic()
+        self.assertEqual(queue.get_batch(timeout=0.05), ['item'])
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_timeout_returns_empty_batch(self):
+        queue = BatchQueue(batch_size=10)
+        self.assertEqual(queue.get_batch(timeout=0.01), [])
+        self.assertFalse(queue.closed)
+
+    def test_wakes_for_a_full_batch(self):
+        queue = BatchQueue(batch_size=2)
+
+        def put():
+            time.sleep(0.05)
+            queue.put(1)
+            queue.put(2)
+
+        start(put)
+        started = time.monotonic()
+        self.assertEqual(queue.get_batch(timeout=5), [1, 2])
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_closed_queue_drains_then_returns_none(self):
+        queue = BatchQueue(batch_size=2)
+        for item in range(3):
+            queue.put(item)
+        queue.close()
+        self.assertEqual(queue.get_batch(), [0, 1])
+        self.assertEqual(queue.get_batch(), [2])
+        self.assertIsNone(queue.get_batch())
+        self.assertIsNone(queue.get_batch(timeout=0))
+
+
+class TestClose(unittest.TestCase):
+
+    def test_put_after_close(self):
+        queue = BatchQueue()
+        queue.close()
+        self.assertTrue(queue.closed)
+        self.assertFalse(queue.put('item'))
+        self.assertIsNone(queue.get_batch())
+
+    def test_wakes_blocked_producer(self):
+        queue = BatchQueue(maxsize=1)
+        queue.put('first')
+        results = []
+        thread = start(lambda: results.append(queue.put('second')))
+        thread.join(0.05)
+        self.assertTrue(thread.is_alive())
+        queue.close()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [False])
+        self.assertEqual(queue.get_batch(), ['first'])
+
+    def test_wakes_blocked_consumer(self):
+        queue = BatchQueue(batch_size=10)
+        results = []
+        thread = start(lambda: results.append(queue.get_batch()))
+        thread.join(0.05)
+        self.assertTrue(thread.is_alive())
+        queue.close()
+        thread.join(2)
+        self.assertEqual(results, [None])
+
+    def test_get_batch_makes_room(self):
+        queue = BatchQueue(batch_size=1, maxsize=1)
+        queue.put('first')
+        results = []
+        thread = start(lambda: results.append(queue.put('second')))
+        self.assertEqual(queue.get_batch(), ['first'])
+        thread.join(2)
+        self.assertEqual(results, [True])
+        self.assertEqual(queue.get_batch(), ['second'])
+
+
+class TestDone(unittest.TestCase):
+
+    def test_closes_after_every_producer(self):
+        queue = BatchQueue(producers=3, batch_size=10)
+        queue.put('item')
+        queue.done()
+        queue.done()
+        self.assertFalse(queue.closed)
+        self.assertEqual(queue.get_batch(timeout=0), ['item'])
+        self.assertTrue(queue.put('last'))
+        queue.done()
+        self.assertTrue(queue.closed)
+        self.assertFalse(queue.put('late'))
+        self.assertEqual(queue.get_batch(), ['last'])
+        self.assertIsNone(queue.get_batch())
+
+    def test_no_producers(self):
+        queue = BatchQueue(producers=0)
+        self.assertTrue(queue.closed)
+        self.assertIsNone(queue.get_batch())
+
+    def test_producer_threads(self):
+        queue = BatchQueue(producers=4, batch_size=7, maxsize=20)
+
+        def produce(first):
+            for item in range(first, first + 100):
+                queue.put(item)
+            queue.done()
+
+        for producer in range(4):
+            start(produce, producer * 100)
+        received = []
+        while (batch := queue.get_batch(timeout=1)) is not None:
+            self.assertLessEqual(len(batch), 7)
+            received.extend(batch)
+        self.assertEqual(sorted(received), list(range(400)))
+
+
+if __name__ == '__main__':
+    unittest.main()